@@ -0,0 +1,421 @@
+# -*- coding: utf-8-*-
+"""
+A CaptureStream owns the one and only microphone input stream of Jasper.
+
+The stream is opened once and drained by a background reader thread. Every
+listening phase (passive, active, nested modes like MusicMode) subscribes to
+it instead of opening the audio device on its own, so no audio is dropped
+between phases and the device is only closed at shutdown.
+
+The most recent audio is additionally kept in a RingBuffer, so a new
+subscriber can start a little in the past (pre-roll) and pick up what the
+user said while Jasper was still busy with the previous phase.
+"""
+import logging
+import threading
+import Queue
+import numpy
+from resample import downmix
+
+
+def negotiate_rate(audio, device_index, candidates, channels=1,
+                   sample_width=2):
+    """
+    Finds a sample rate the input device supports.
+
+    Arguments:
+        audio -- an initialized pyaudio.PyAudio instance
+        device_index -- index of the input device
+        candidates -- sample rates to try, in order of preference
+
+    Returns:
+        The first supported candidate, or the default sample rate of the
+        device if none of them is supported
+    """
+    logger = logging.getLogger(__name__)
+    fmt = audio.get_format_from_width(sample_width)
+    for rate in candidates:
+        try:
+            if audio.is_format_supported(rate, input_device=device_index,
+                                         input_channels=channels,
+                                         input_format=fmt):
+                logger.debug("Device %r supports %d Hz", device_index, rate)
+                return rate
+        except ValueError:
+            logger.debug("Device %r doesn't support %d Hz", device_index,
+                         rate)
+    info = audio.get_device_info_by_index(device_index)
+    return int(info['defaultSampleRate'])
+
+
+class RingBuffer(object):
+    """
+    A preallocated, fixed-size ring buffer of int16 samples. Positions are
+    absolute sample counts since the buffer was created.
+    """
+
+    def __init__(self, capacity, dtype=numpy.int16):
+        self.capacity = capacity
+        self._data = numpy.zeros(capacity, dtype=dtype)
+        self.position = 0
+
+    @property
+    def oldest(self):
+        """
+        Returns:
+            The oldest absolute position that is still available
+        """
+        return max(0, self.position - self.capacity)
+
+    def write(self, samples):
+        """
+        Appends samples, overwriting the oldest ones if necessary.
+
+        Arguments:
+            samples -- a numpy array with the same dtype as the buffer
+        """
+        n = len(samples)
+        if n > self.capacity:
+            self.position += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        start = self.position % self.capacity
+        end = start + n
+        if end <= self.capacity:
+            self._data[start:end] = samples
+        else:
+            split = self.capacity - start
+            self._data[start:] = samples[:split]
+            self._data[:n - split] = samples[split:]
+        self.position += n
+
+    def read(self, start, stop=None):
+        """
+        Copies the samples between the absolute positions start and stop.
+
+        Arguments:
+            start -- first absolute position, must not be older than
+                     self.oldest
+            stop -- (optional) end position (Default: current position)
+
+        Returns:
+            A new numpy array
+
+        Raises:
+            ValueError if the requested range is not in the buffer
+        """
+        if stop is None:
+            stop = self.position
+        if start < self.oldest or stop > self.position or start > stop:
+            raise ValueError(("Range [%d, %d) is not available (buffer " +
+                              "holds [%d, %d))") % (start, stop, self.oldest,
+                                                    self.position))
+        first = start % self.capacity
+        n = stop - start
+        if first + n <= self.capacity:
+            return self._data[first:first + n].copy()
+        split = self.capacity - first
+        return numpy.concatenate((self._data[first:],
+                                  self._data[:n - split]))
+
+
+class CaptureReader(object):
+    """
+    A file-like view on a CaptureStream. It receives every chunk captured
+    after it was created.
+
+    If the reader falls too far behind, the oldest chunks are dropped. Its
+    position skips the dropped frames, so that it always is the absolute
+    position of the audio read next.
+    """
+
+    def __init__(self, capture, maxsize=0, position=0, preroll=b''):
+        self._capture = capture
+        self._queue = Queue.Queue(maxsize=maxsize)
+        self._pending = preroll
+        self.preroll_frames = len(preroll) // capture.frame_width
+        self.overruns = 0
+        # Absolute frame position of the next frame returned by read()
+        self.position = position
+
+    def _put(self, data, position=None):
+        """
+        Arguments:
+            data -- a captured chunk, or None if the stream has been closed
+            position -- absolute frame position of the chunk
+        """
+        item = (position, data) if data is not None else None
+        try:
+            self._queue.put_nowait(item)
+        except Queue.Full:
+            # Drop the oldest chunk, the consumer is too slow
+            try:
+                self._queue.get_nowait()
+            except Queue.Empty:
+                pass
+            self._queue.put_nowait(item)
+            self.overruns += 1
+
+    def read(self, num_frames, timeout=None):
+        """
+        Reads exactly num_frames frames, blocking until they are captured.
+
+        Arguments:
+            num_frames -- number of frames to read
+            timeout -- (optional) seconds to wait for each captured chunk
+
+        Returns:
+            The raw frame data as byte string
+
+        Raises:
+            IOError if the capture stream has been closed or no data arrived
+            within timeout
+        """
+        frame_width = self._capture.frame_width
+        size = num_frames * frame_width
+        while len(self._pending) < size:
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                raise IOError("No audio captured within %r seconds" % timeout)
+            if item is None:
+                raise IOError("Capture stream has been closed")
+            position, data = item
+            if position > self.position + len(self._pending) // frame_width:
+                # Chunks have been dropped since, so the pending frames
+                # aren't followed by this one. Skip them as well, the
+                # audio returned is always contiguous.
+                self.position = position
+                self._pending = b''
+            self._pending += data
+        data, self._pending = self._pending[:size], self._pending[size:]
+        self.position += num_frames
+        return data
+
+    def close(self):
+        self._capture.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CaptureStream(object):
+    """
+    Keeps a single PyAudio input stream open and fans out its chunks to all
+    subscribed CaptureReaders. Only 16 bit samples are supported. Devices
+    with more than one channel are downmixed, readers always get mono audio.
+
+    If the device fails (e.g. it has been unplugged), it's reopened with
+    exponential backoff. After max_retries failures in a row the stream
+    gives up and pending reads of its readers fail with IOError.
+    """
+
+    # Seconds to wait before reopening a failed device, doubled after every
+    # further failure up to MAX_RETRY_DELAY
+    RETRY_DELAY = 0.5
+    MAX_RETRY_DELAY = 8.0
+
+    def __init__(self, audio, device_index=0, rate=44100, channels=1,
+                 sample_width=2, chunk=1024, reader_queue_size=512,
+                 buffer_seconds=5, max_retries=10):
+        """
+        Arguments:
+            audio -- an initialized pyaudio.PyAudio instance
+            device_index -- index of the input device
+            rate -- sample rate in Hz
+            channels -- number of channels to open the device with
+            sample_width -- bytes per sample
+            chunk -- frames read from the device per iteration
+            reader_queue_size -- chunks a reader may lag behind before the
+                                 oldest ones get dropped
+            buffer_seconds -- seconds of recent audio kept for pre-roll
+            max_retries -- failures of the device in a row before giving
+                           up
+        """
+        self._logger = logging.getLogger(__name__)
+        self._audio = audio
+        self.device_index = device_index
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.chunk = chunk
+        self._reader_queue_size = reader_queue_size
+        self._ring = RingBuffer(int(buffer_seconds * rate))
+        self._readers = []
+        self._lock = threading.Lock()
+        self._stream = None
+        self._thread = None
+        self._running = threading.Event()
+        self.max_retries = max_retries
+        # Set by close(), interrupts the backoff
+        self._closing = threading.Event()
+
+    @property
+    def frame_width(self):
+        # Frames are downmixed to mono
+        return self.sample_width
+
+    @property
+    def position(self):
+        """
+        Returns:
+            The absolute frame position of the next captured frame
+        """
+        return self._ring.position
+
+    @property
+    def device_name(self):
+        """
+        Returns:
+            The name of the input device, or its index if it has no name
+        """
+        try:
+            info = self._audio.get_device_info_by_index(self.device_index)
+        except (IOError, ValueError):
+            return str(self.device_index)
+        return info.get('name', str(self.device_index))
+
+    @property
+    def is_active(self):
+        return self._running.is_set()
+
+    def start(self):
+        """
+        Opens the input stream and starts the reader thread. Calling this on
+        an already started stream does nothing.
+        """
+        if self.is_active:
+            return
+        if self._thread is not None:
+            # The thread of a stream that gave up
+            self._thread.join()
+        self._open()
+        self._closing.clear()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run,
+                                        name='CaptureStream')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _open(self):
+        self._logger.debug("Opening input stream on device %r (%d Hz, %d " +
+                           "channel(s))", self.device_index, self.rate,
+                           self.channels)
+        self._stream = self._audio.open(
+            format=self._audio.get_format_from_width(self.sample_width),
+            channels=self.channels,
+            rate=self.rate,
+            input=True,
+            input_device_index=self.device_index,
+            frames_per_buffer=self.chunk)
+
+    def _close_stream(self):
+        stream, self._stream = self._stream, None
+        try:
+            stream.stop_stream()
+            stream.close()
+        except IOError:
+            self._logger.debug("Failed to close the input stream",
+                               exc_info=True)
+
+    def _run(self):
+        failures = 0
+        while self._running.is_set():
+            try:
+                if self._stream is None:
+                    self._open()
+                # An input overflow loses audio, but the stream is fine
+                data = self._stream.read(self.chunk,
+                                         exception_on_overflow=False)
+            except IOError:
+                failures += 1
+                if self._stream is not None:
+                    self._close_stream()
+                if failures > self.max_retries:
+                    self._logger.error("Giving up on input device %r " +
+                                       "after %d failures",
+                                       self.device_index, failures,
+                                       exc_info=True)
+                    self._running.clear()
+                    self._disconnect_readers()
+                    break
+                delay = min(self.RETRY_DELAY * 2 ** (failures - 1),
+                            self.MAX_RETRY_DELAY)
+                self._logger.warning("Failed to read from input device " +
+                                     "%r, reopening it in %.1f s",
+                                     self.device_index, delay,
+                                     exc_info=True)
+                self._closing.wait(delay)
+                continue
+            failures = 0
+            samples = numpy.frombuffer(data, dtype=numpy.int16)
+            if self.channels > 1:
+                samples = downmix(samples, self.channels)
+                data = samples.tostring()
+            with self._lock:
+                position = self._ring.position
+                self._ring.write(samples)
+                for reader in self._readers:
+                    reader._put(data, position)
+
+    def subscribe(self, start=None, lookback=0):
+        """
+        Arguments:
+            start -- (optional) absolute frame position to start reading at,
+                     e.g. the position of a previous reader (Default: the
+                     beginning of the lookback window)
+            lookback -- (optional) maximum number of seconds the reader may
+                        start in the past (Default: 0)
+
+        Returns:
+            A new CaptureReader receiving all chunks captured from now on,
+            prefixed with the requested pre-roll audio
+        """
+        self.start()
+        with self._lock:
+            position = self.position
+            earliest = max(self._ring.oldest,
+                           position - int(lookback * self.rate))
+            if start is None:
+                start = earliest
+            start = min(max(start, earliest), position)
+            preroll = self._ring.read(start).tostring()
+            reader = CaptureReader(self, maxsize=self._reader_queue_size,
+                                   position=start, preroll=preroll)
+            self._readers.append(reader)
+        return reader
+
+    def unsubscribe(self, reader):
+        with self._lock:
+            if reader in self._readers:
+                self._readers.remove(reader)
+        if reader.overruns:
+            self._logger.warning("Capture reader dropped %d chunk(s)",
+                                 reader.overruns)
+
+    def _disconnect_readers(self):
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for reader in readers:
+            reader._put(None)
+
+    def close(self):
+        """
+        Stops the reader thread and closes the input stream. Pending reads
+        of subscribed readers fail with IOError.
+        """
+        if not self.is_active:
+            return
+        self._running.clear()
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._stream is not None:
+            self._close_stream()
+        self._disconnect_readers()
+        self._logger.debug("Closed input stream on device %r",
+                           self.device_index)
@@ -0,0 +1,499 @@
+# -*- coding: utf-8-*-
+"""
+In-process audio output.
+
+An OutputStream keeps a single PyAudio output stream open and plays queued
+PCM buffers from a background thread, so playing a sound neither forks a
+process nor blocks the caller. AudioCues are short sounds (like the beeps
+of active listening) that are decoded once and kept in memory, longer WAV
+files are memory-mapped instead of being read.
+
+The output device, rate, channels and buffer size are configured in the
+audio section of the profile:
+
+    audio:
+      output_device: 'USB Audio'  # index or (part of the) name
+      output_rate: 44100
+      output_channels: 2
+      output_buffer: 1024  # frames
+"""
+import atexit
+import collections
+import logging
+import os
+import struct
+import threading
+import time
+import wave
+import numpy
+import jasperconfig
+import metrics
+import resample
+
+# PortAudio's paOutputUnderflowed, raised by pyaudio's Stream.write()
+OUTPUT_UNDERFLOWED = -9980
+
+
+def convert(samples, rate, channels, to_rate, to_channels):
+    """
+    Converts interleaved int16 samples to another rate and channel count.
+
+    Returns:
+        A numpy int16 array
+    """
+    if channels != 1 and (channels != to_channels or rate != to_rate):
+        samples = resample.downmix(samples, channels)
+        channels = 1
+    if rate != to_rate:
+        samples = resample.resample(samples, rate, to_rate)
+    if channels != to_channels:
+        samples = numpy.repeat(samples, to_channels)
+    return samples
+
+
+def find_device(audio, device):
+    """
+    Finds an output device.
+
+    Arguments:
+        audio -- an initialized pyaudio.PyAudio instance
+        device -- the index of the device, or (part of) its name
+
+    Returns:
+        The index of the device
+
+    Raises:
+        ValueError if there's no output device with that name
+    """
+    if isinstance(device, (int, long)):
+        return device
+    if device.isdigit():
+        return int(device)
+    for index in range(audio.get_device_count()):
+        info = audio.get_device_info_by_index(index)
+        if info.get('maxOutputChannels', 0) > 0 and \
+                device in info.get('name', ''):
+            return index
+    raise ValueError("No output device named '%s' found" % device)
+
+
+def read_wav(fname):
+    """
+    Memory-maps the samples of a 16 bit PCM WAV file, instead of reading
+    them.
+
+    Returns:
+        A tuple (samples, rate, channels) with a read-only numpy int16
+        memmap of interleaved samples
+
+    Raises:
+        ValueError if fname isn't a 16 bit PCM WAV file
+    """
+    with open(fname, 'rb') as f:
+        riff, size, form = struct.unpack('<4sI4s', f.read(12))
+        if riff != 'RIFF' or form != 'WAVE':
+            raise ValueError("'%s' isn't a WAV file" % fname)
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("'%s' has no data chunk" % fname)
+            name, size = struct.unpack('<4sI', header)
+            if name == 'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                # Chunks are padded to an even size
+                f.seek(size + size % 2 - 16, 1)
+            elif name == 'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + size % 2, 1)
+    if fmt is None:
+        raise ValueError("'%s' has no format chunk" % fname)
+    tag, channels, rate, byte_rate, align, width = fmt
+    if tag != 1 or width != 16:
+        raise ValueError("Only 16 bit PCM WAV files are supported, " +
+                         "'%s' isn't" % fname)
+    # The data chunk of a file that is still being written may claim more
+    # than there is
+    frames = min(size, os.path.getsize(fname) - offset) // align
+    if not frames:
+        return (numpy.zeros(0, dtype=numpy.int16), rate, channels)
+    samples = numpy.memmap(fname, dtype='<i2', mode='r', offset=offset,
+                           shape=(frames * channels,))
+    return (samples, rate, channels)
+
+
+class AudioCue(object):
+    """
+    A short sound kept in memory.
+    """
+
+    def __init__(self, samples, rate, channels=1):
+        """
+        Arguments:
+            samples -- a numpy int16 array of interleaved samples
+            rate -- sample rate in Hz
+            channels -- number of channels
+        """
+        self.samples = samples
+        self.rate = rate
+        self.channels = channels
+        self._converted = {}
+
+    @classmethod
+    def from_file(cls, fname):
+        """
+        Decodes a 16 bit WAV file.
+        """
+        wav = wave.open(fname, 'rb')
+        try:
+            if wav.getsampwidth() != 2:
+                raise ValueError("Only 16 bit WAV files are supported, " +
+                                 "'%s' isn't" % fname)
+            samples = numpy.frombuffer(wav.readframes(wav.getnframes()),
+                                       dtype=numpy.int16)
+            return cls(samples, wav.getframerate(), wav.getnchannels())
+        finally:
+            wav.close()
+
+    @property
+    def duration(self):
+        return float(len(self.samples)) / self.channels / self.rate
+
+    def get_samples(self, rate, channels):
+        """
+        Returns:
+            The samples converted to rate and channels. The conversion is
+            only done once.
+        """
+        key = (rate, channels)
+        if key not in self._converted:
+            self._converted[key] = convert(self.samples, self.rate,
+                                           self.channels, rate, channels)
+        return self._converted[key]
+
+
+class Playback(object):
+    """
+    A handle for a buffer queued on an OutputStream.
+    """
+
+    def __init__(self, samples, rate, channels):
+        self.samples = samples
+        self.rate = rate
+        self.channels = channels
+        # Time at which the buffer was queued
+        self.queued = time.time()
+        # Estimated time at which the first sample left the speaker
+        self.started = None
+        # Times the device ran out of samples while playing the buffer
+        self.underruns = 0
+        self._done = threading.Event()
+        self.cancelled = False
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the buffer has been played or cancelled.
+
+        Returns:
+            True if playback has finished
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _finish(self):
+        self._done.set()
+
+
+class OutputStream(object):
+    """
+    Keeps a single PyAudio output stream open and plays queued buffers
+    one after the other.
+    """
+
+    def __init__(self, audio, device_index=None, rate=44100, channels=2,
+                 chunk=1024):
+        """
+        Arguments:
+            audio -- an initialized pyaudio.PyAudio instance
+            device_index -- (optional) index of the output device, or (part
+                            of) its name (Default: the default output
+                            device)
+            rate -- sample rate of the output stream in Hz
+            channels -- number of channels of the output stream
+            chunk -- size of the device buffer in frames, also the frames
+                     written to the device at once. Larger buffers underrun
+                     less often, but add latency.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._audio = audio
+        self.device_index = device_index
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self._queue = collections.deque()
+        # Guards the queue and the current buffer
+        self._queue_changed = threading.Condition()
+        self._stream = None
+        self._thread = None
+        self._current = None
+        self._running = threading.Event()
+        self.underruns = 0
+
+    @classmethod
+    def get_config(cls):
+        """
+        Returns:
+            The keyword arguments configured by the audio section of the
+            profile
+        """
+        section = jasperconfig.get_section('audio')
+        config = {}
+        if 'output_device' in section:
+            config['device_index'] = section['output_device']
+        if 'output_rate' in section:
+            config['rate'] = int(section['output_rate'])
+        if 'output_channels' in section:
+            config['channels'] = int(section['output_channels'])
+        if 'output_buffer' in section:
+            config['chunk'] = int(section['output_buffer'])
+        return config
+
+    @classmethod
+    def get_instance(cls, audio, **kwargs):
+        """
+        Returns:
+            An OutputStream configured by the profile, kwargs override it
+        """
+        config = cls.get_config()
+        config.update(kwargs)
+        return cls(audio, **config)
+
+    @property
+    def is_active(self):
+        return self._running.is_set()
+
+    @property
+    def latency(self):
+        """
+        Returns:
+            The output latency of the device in seconds, as far as known
+        """
+        try:
+            return self._stream.get_output_latency()
+        except AttributeError:
+            return 0.0
+
+    def start(self):
+        """
+        Opens the output stream and starts the writer thread. Calling this
+        on an already started stream does nothing.
+        """
+        if self.is_active:
+            return
+        if self.device_index is not None:
+            self.device_index = find_device(self._audio, self.device_index)
+        self._open()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run,
+                                        name='OutputStream')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _open(self):
+        self._logger.debug("Opening output stream on device %r (%d Hz, " +
+                           "%d channel(s))", self.device_index, self.rate,
+                           self.channels)
+        self._stream = self._audio.open(
+            format=self._audio.get_format_from_width(2),
+            channels=self.channels,
+            rate=self.rate,
+            output=True,
+            output_device_index=self.device_index,
+            frames_per_buffer=self.chunk)
+        self._logger.debug("Output latency is %.0f ms", 1000 * self.latency)
+
+    def _close_stream(self):
+        stream, self._stream = self._stream, None
+        try:
+            stream.stop_stream()
+            stream.close()
+        except IOError:
+            self._logger.debug("Failed to close the output stream",
+                               exc_info=True)
+
+    def _run(self):
+        # Nothing has been played since the stream was opened
+        idle = True
+        while True:
+            with self._queue_changed:
+                if not self._queue:
+                    # The device runs dry while waiting, that's no underrun
+                    idle = True
+                    while not self._queue:
+                        self._queue_changed.wait()
+                playback = self._queue.popleft()
+                if playback is None:
+                    break
+                # Under the lock, so that stop() can't miss it
+                self._current = playback
+            try:
+                self._write(playback, idle)
+                # The next buffer is played back to back, if it's queued
+                # already
+                idle = False
+            except Exception:
+                metrics.increment('audiooutput.errors')
+                self._logger.error("Failed to play on the output stream",
+                                   exc_info=True)
+                # Only this buffer is given up, the stream is reopened for
+                # the next one
+                playback.cancel()
+                if self._stream is not None:
+                    self._close_stream()
+                idle = True
+            finally:
+                with self._queue_changed:
+                    self._current = None
+                playback._finish()
+
+    def _write(self, playback, idle):
+        if self._stream is None:
+            self._open()
+        step = self.chunk * self.channels
+        samples = playback.samples
+        for start in range(0, len(samples), step):
+            if playback.cancelled or not self._running.is_set():
+                break
+            if playback.started is None:
+                playback.started = time.time() + self.latency
+                metrics.observe('audiooutput.latency',
+                                playback.started - playback.queued)
+            try:
+                self._stream.write(samples[start:start + step].tostring(),
+                                   exception_on_underflow=True)
+            except IOError as e:
+                # The samples have been written nevertheless
+                if e.args[-1] != OUTPUT_UNDERFLOWED:
+                    raise
+                if start or not idle:
+                    self._underrun(playback)
+
+    def _underrun(self, playback):
+        playback.underruns += 1
+        self.underruns += 1
+        metrics.increment('audiooutput.underruns')
+        self._logger.debug("Output stream underrun, consider a larger " +
+                           "output_buffer than %d frames", self.chunk)
+
+    def _enqueue(self, playback):
+        with self._queue_changed:
+            self._queue.append(playback)
+            self._queue_changed.notify()
+
+    def play(self, samples, rate=None, channels=1):
+        """
+        Queues a buffer for playback and returns immediately.
+
+        Arguments:
+            samples -- a numpy int16 array of interleaved samples
+            rate -- (optional) sample rate of samples (Default: the rate
+                    of the output stream)
+            channels -- number of channels of samples
+
+        Returns:
+            A Playback handle
+        """
+        self.start()
+        samples = convert(samples, rate or self.rate, channels, self.rate,
+                          self.channels)
+        playback = Playback(samples, self.rate, self.channels)
+        self._enqueue(playback)
+        return playback
+
+    def play_file(self, fname):
+        """
+        Queues a 16 bit WAV file for playback and returns immediately. The
+        file is memory-mapped, it must not be removed until the Playback
+        is done.
+
+        Returns:
+            A Playback handle
+        """
+        return self.play(*read_wav(fname))
+
+    def play_cue(self, cue):
+        """
+        Queues an AudioCue for playback and returns immediately.
+
+        Returns:
+            A Playback handle
+        """
+        self.start()
+        playback = Playback(cue.get_samples(self.rate, self.channels),
+                            self.rate, self.channels)
+        self._enqueue(playback)
+        return playback
+
+    def stop(self):
+        """
+        Cancels the current and all queued buffers.
+        """
+        with self._queue_changed:
+            queued = [playback for playback in self._queue
+                      if playback is not None]
+            # Keeps the None put by close()
+            self._queue = collections.deque(
+                playback for playback in self._queue if playback is None)
+            if self._current is not None:
+                self._current.cancel()
+        for playback in queued:
+            playback.cancel()
+            playback._finish()
+
+    def close(self):
+        """
+        Stops playback and closes the output stream.
+        """
+        if not self.is_active:
+            return
+        self.stop()
+        self._running.clear()
+        self._enqueue(None)
+        self._thread.join()
+        self._thread = None
+        if self._stream is not None:
+            self._close_stream()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_shared():
+    """
+    Returns:
+        An OutputStream configured by the profile, on a PyAudio instance of
+        its own, for code that doesn't get the one of the Mic passed (e.g.
+        a TTS engine used on its own). It's closed at exit.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            import pyaudio
+            audio = pyaudio.PyAudio()
+            _shared = OutputStream.get_instance(audio)
+
+            def close():
+                _shared.close()
+                audio.terminate()
+            atexit.register(close)
+        return _shared
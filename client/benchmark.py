@@ -0,0 +1,255 @@
+# -*- coding: utf-8-*-
+"""
+End-to-end benchmark of the path from a recorded utterance to the module
+that handles it, against local stand-ins of the cloud STT services (see
+sttserver.py). No credentials or network access are needed.
+
+Every utterance goes through the same stages as in the Mic and the Brain:
+
+    resample  -- to the sample rate of the STT engine
+    encode    -- trimming and compressing the upload
+    upload    -- the request to the service, including its latency
+    recognize -- the whole STT engine call (encode + upload + parsing)
+    rescore   -- reranking the n-best list
+    dispatch  -- finding the module that handles the command
+    total     -- all of the above
+
+and p50/p95/p99 are reported per stage. Run it with e.g.
+
+    python client/benchmark.py --engine failover --latency 0.1 \\
+        --jitter 0.5 --failure-rate 0.05 --runs 50
+"""
+import collections
+import logging
+import time
+import wave
+import numpy
+import speech_recognition as sr
+import brain
+import metrics
+import resample
+import rescoring
+import stt
+import sttserver
+
+STAGES = ('resample', 'encode', 'upload', 'recognize', 'rescore',
+          'dispatch', 'total')
+
+# Metrics recorded by the STT engines themselves
+_ENGINE_METRICS = {'encode': 'upload.encode_time',
+                   'upload': 'upload.time'}
+
+
+class _SilentMic(object):
+    """
+    Modules aren't run by the benchmark, but the Brain needs a mic.
+    """
+
+    def say(self, phrase):
+        pass
+
+
+def create_engine(slug, servers, timeout=10):
+    """
+    Returns:
+        The engine with the given slug ('IBM', 'ATT', 'failover' or
+        'hedged'), talking to the local servers
+    """
+    def ibm():
+        return stt.Ibm(url=servers['IBM'].ibm_url, timeout=timeout)
+
+    def att():
+        return stt.AttSTT(timeout=timeout, **servers['ATT'].att_urls)
+
+    if slug == 'IBM':
+        return ibm()
+    elif slug == 'ATT':
+        return att()
+    elif slug == stt.FailoverSTT.SLUG:
+        return stt.FailoverSTT([ibm(), att()])
+    elif slug == stt.HedgedSTT.SLUG:
+        return stt.HedgedSTT([ibm(), att()], timeout=timeout)
+    raise ValueError("Can't benchmark engine '%s'" % slug)
+
+
+class Benchmark(object):
+
+    def __init__(self, engine, rescorer=None, brain=None):
+        """
+        Arguments:
+            engine -- the STT engine instance
+            rescorer -- (optional) a rescoring.Rescorer
+            brain -- (optional) the Brain whose modules are matched
+        """
+        self._logger = logging.getLogger(__name__)
+        self.engine = engine
+        self.rescorer = rescorer
+        self.brain = brain
+        self.errors = collections.Counter()
+        self.handled = collections.Counter()
+
+    @staticmethod
+    def _count(metric):
+        summary = metrics.summary(metric)
+        return summary['count'] if summary is not None else 0
+
+    def run_once(self, audio):
+        """
+        Runs an utterance through all stages.
+
+        Returns:
+            The name of the module that would handle it, None if no module
+            would and False if the recognition failed
+        """
+        samples = {}
+        start = time.time()
+        target_rate = self.engine.SAMPLE_RATE
+        if target_rate and target_rate != audio.sample_rate:
+            data = resample.resample(
+                numpy.frombuffer(audio.frame_data, dtype=numpy.int16),
+                audio.sample_rate, target_rate)
+            audio = sr.AudioData(data.tostring(), target_rate,
+                                 audio.sample_width)
+        samples['resample'] = time.time() - start
+
+        counts = dict((name, self._count(metric))
+                      for name, metric in _ENGINE_METRICS.items())
+        stage_start = time.time()
+        try:
+            hypotheses = self.engine.recognize_all(audio)
+        except (sr.UnknownValueError, sr.RequestError) as e:
+            self.errors[e.__class__.__name__] += 1
+            self._logger.debug("Recognition failed: %r", e)
+            return False
+        samples['recognize'] = time.time() - stage_start
+        # The engine has observed its encode and upload times meanwhile
+        for name, metric in _ENGINE_METRICS.items():
+            if self._count(metric) > counts[name]:
+                samples[name] = metrics.last(metric)
+
+        stage_start = time.time()
+        if self.rescorer is not None:
+            texts = self.rescorer.rank(hypotheses)
+        else:
+            texts = [text for text, confidence in hypotheses]
+        samples['rescore'] = time.time() - stage_start
+
+        stage_start = time.time()
+        module = None
+        if self.brain is not None:
+            module, text = self.brain.match(texts)
+        samples['dispatch'] = time.time() - stage_start
+        samples['total'] = time.time() - start
+
+        for name, value in samples.items():
+            metrics.observe('benchmark.%s' % name, value)
+        name = module.__name__ if module is not None else None
+        self.handled[name] += 1
+        return name
+
+    def report(self):
+        """
+        Returns:
+            The per stage latencies as printable table
+        """
+        lines = ["%-10s %6s %8s %8s %8s" % ('stage', 'n', 'p50 ms',
+                                            'p95 ms', 'p99 ms')]
+        for name in STAGES:
+            summary = metrics.summary('benchmark.%s' % name)
+            if summary is None:
+                continue
+            lines.append("%-10s %6d %8.1f %8.1f %8.1f" %
+                         (name, summary['count'], 1000 * summary['p50'],
+                          1000 * summary['p95'], 1000 * summary['p99']))
+        return "\n".join(lines)
+
+
+def read_wav(fname):
+    wav = wave.open(fname, 'rb')
+    try:
+        return sr.AudioData(wav.readframes(wav.getnframes()),
+                            wav.getframerate(), wav.getsampwidth())
+    finally:
+        wav.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import jasperpath
+
+    parser = argparse.ArgumentParser(description='End-to-end benchmark ' +
+                                     'against local STT services')
+    parser.add_argument('--engine', default='IBM',
+                        choices=['IBM', 'ATT', stt.FailoverSTT.SLUG,
+                                 stt.HedgedSTT.SLUG])
+    parser.add_argument('--script', action='append', default=[],
+                        metavar='WAV=TRANSCRIPT',
+                        help='utterance and what the services recognize in ' +
+                        'it, may be given several times')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='number of runs per utterance')
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='median simulated latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.3,
+                        help='spread of the latency')
+    parser.add_argument('--distribution', default='lognormal',
+                        choices=sttserver.ServiceConditions.DISTRIBUTIONS)
+    parser.add_argument('--processing-factor', type=float, default=0.1,
+                        help='simulated recognition time per second of audio')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='share of the requests that fail')
+    parser.add_argument('--throttle', type=float, default=None,
+                        help='requests per second before the services ' +
+                        'answer 429')
+    parser.add_argument('--no-modules', action='store_true',
+                        help="don't rescore and dispatch to the modules")
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug
+                        else logging.WARNING)
+
+    scripts = [script.split('=', 1) for script in args.script]
+    if not scripts:
+        scripts = [(jasperpath.data('audio', 'jasper.wav'), 'JASPER'),
+                   (jasperpath.data('audio', 'time.wav'), 'QUE HORA ES')]
+    recognizer = sttserver.FingerprintRecognizer()
+    utterances = []
+    for fname, transcript in scripts:
+        recognizer.add_file(fname, transcript)
+        utterances.append(read_wav(fname))
+
+    servers = {}
+    for seed, name in enumerate(('IBM', 'ATT')):
+        conditions = sttserver.ServiceConditions(
+            latency=args.latency, jitter=args.jitter,
+            distribution=args.distribution, failure_rate=args.failure_rate,
+            throttle=args.throttle, seed=seed)
+        servers[name] = sttserver.LocalSTTServer(
+            recognizer=recognizer, processing_factor=args.processing_factor,
+            conditions=conditions).start()
+    try:
+        rescorer, my_brain = None, None
+        if not args.no_modules:
+            my_brain = brain.Brain(_SilentMic(), {})
+            rescorer = rescoring.Rescorer.from_modules(my_brain.modules)
+        benchmark = Benchmark(create_engine(args.engine, servers),
+                              rescorer=rescorer, brain=my_brain)
+        metrics.reset()
+        for i in range(args.runs):
+            for audio in utterances:
+                benchmark.run_once(audio)
+        print("%s: %d utterances, %d failed" %
+              (args.engine, args.runs * len(utterances),
+               sum(benchmark.errors.values())))
+        print(benchmark.report())
+        for name, count in sorted(benchmark.errors.items()):
+            print("%s: %d" % (name, count))
+        for name, count in sorted(benchmark.handled.items()):
+            print("handled by %s: %d" % (name, count))
+        for name, server in sorted(servers.items()):
+            print("%s server responses: %s" %
+                  (name, ', '.join('%d: %d' % item for item in
+                                   sorted(server.stats.items()))))
+    finally:
+        for server in servers.values():
+            server.stop()
@@ -7,6 +7,12 @@ import jasperpath
 
 class Brain(object):
 
+    ERROR_MESSAGE = ("Lo siento, tengo algun problema con su peticion " +
+                     "por favor, intentelo mas tarde")
+
+    # Everything the Brain says itself, synthesized in advance
+    PHRASES = [ERROR_MESSAGE]
+
     def __init__(self, mic, profile):
         """
         Instantiates a new Brain object, which cross-references user
@@ -51,31 +57,48 @@ class Brain(object):
                      else 0, reverse=True)
         return modules
 
-    def query(self, text):
+    def match(self, texts):
+        """
+        Finds the module that handles user input, without handling it.
+
+        Arguments:
+        texts -- the user input, or a list of alternative transcriptions,
+                 most likely first
+
+        Returns:
+        A tuple of the first module that accepts one of texts and that
+        text, or (None, None)
+        """
+        if isinstance(texts, basestring):
+            texts = [texts]
+        for text in texts:
+            for module in self.modules:
+                if module.isValid(text):
+                    return module, text
+        return None, None
+
+    def query(self, texts):
         """
         Passes user input to the appropriate module, testing it against
         each candidate module's isValid function.
 
         Arguments:
-        text -- user input, typically speech, to be parsed by a module
+        texts -- user input, typically speech, to be parsed by a module. A
+                 list holds the alternative transcriptions, most likely
+                 first: the first one a module accepts is handled.
         """
-        for module in self.modules:
-            
-			if module.isValid(text):
-				self._logger.debug("'%s' is a valid phrase for module " +
-								   "'%s'", text, module.__name__)
-				try:
-					module.handle(text, self.mic, self.profile)
-				except Exception:
-					self._logger.error('Failed to execute module',
-									   exc_info=True)
-					self.mic.say("Lo siento, tengo algun problema con su peticion " +
-								 "por favor, intentelo mas tarde")
-				else:
-					self._logger.debug("Handling of phrase '%s' by " +
-									   "module '%s' completed", text,
-									   module.__name__)
-				finally:
-					return
-        self._logger.debug("No module was able to handle any of these " +
-                           "phrases: %r", texts)
+        module, text = self.match(texts)
+        if module is None:
+            self._logger.debug("No module was able to handle any of these " +
+                               "phrases: %r", texts)
+            return
+        self._logger.debug("'%s' is a valid phrase for module '%s'", text,
+                           module.__name__)
+        try:
+            module.handle(text, self.mic, self.profile)
+        except Exception:
+            self._logger.error('Failed to execute module', exc_info=True)
+            self.mic.say(self.ERROR_MESSAGE)
+        else:
+            self._logger.debug("Handling of phrase '%s' by module '%s' " +
+                               "completed", text, module.__name__)
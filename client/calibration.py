@@ -0,0 +1,102 @@
+# -*- coding: utf-8-*-
+"""
+Persists the ambient noise calibration of the input devices.
+
+The noise floor learned by the VAD is stored per device and sample rate in
+<CONFIG_PATH>/calibration.yml, so that Jasper listens accurately from the
+first frame after a restart instead of relearning it every time.
+"""
+import os
+import time
+import logging
+import threading
+import yaml
+
+import jasperpath
+
+
+class CalibrationStore(object):
+
+    def __init__(self, path=None, save_interval=60):
+        """
+        Arguments:
+            path -- (optional) the calibration file (Default:
+                    <CONFIG_PATH>/calibration.yml)
+            save_interval -- minimum number of seconds between two writes
+                             of the calibration file
+        """
+        self._logger = logging.getLogger(__name__)
+        self.path = path if path else jasperpath.config('calibration.yml')
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._data = {}
+        self._dirty = False
+        self._last_save = time.time()
+        self.load()
+
+    @staticmethod
+    def get_key(device, rate):
+        return "%s@%d" % (device, rate)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = yaml.safe_load(f)
+        except (IOError, OSError, yaml.YAMLError):
+            self._logger.warning("Could not read calibration file '%s'",
+                                 self.path, exc_info=True)
+            return
+        with self._lock:
+            self._data = data if isinstance(data, dict) else {}
+
+    def get(self, device, rate):
+        """
+        Returns:
+            The stored noise floor for device at rate, or None
+        """
+        with self._lock:
+            entry = self._data.get(self.get_key(device, rate))
+        if entry and 'noise_floor' in entry:
+            return float(entry['noise_floor'])
+        return None
+
+    def update(self, device, rate, noise_floor):
+        """
+        Stores a new noise floor. The file is written if the last write is
+        at least save_interval seconds ago.
+        """
+        if noise_floor is None:
+            return
+        with self._lock:
+            self._data[self.get_key(device, rate)] = {
+                'noise_floor': float(noise_floor),
+                'updated': int(time.time())}
+            self._dirty = True
+        if time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self):
+        """
+        Writes the calibration file, if anything has changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict(self._data)
+            self._dirty = False
+        self._last_save = time.time()
+        dirname = os.path.dirname(self.path)
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            jasperpath.atomic_write(
+                self.path,
+                lambda f: yaml.safe_dump(data, f, default_flow_style=False),
+                mode='w')
+        except (IOError, OSError):
+            self._logger.warning("Could not write calibration file '%s'",
+                                 self.path, exc_info=True)
+        else:
+            self._logger.debug("Saved calibration to '%s'", self.path)
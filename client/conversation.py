@@ -2,11 +2,21 @@
 import logging
 from notifier import Notifier
 from brain import Brain
+from pipeline import ConversationPipeline
 
 #logging.basicConfig(level=logging.DEBUG)
 
 class Conversation(object):
 
+    # Seconds between two checks for notifications
+    NOTIFICATION_INTERVAL = 5
+
+    # Said when nothing has been transcribed
+    PARDON = "Perdon?"
+
+    # Everything the Conversation says itself, synthesized in advance
+    PHRASES = [PARDON]
+
     def __init__(self, persona, mic, profile):
         self._logger = logging.getLogger(__name__)
         self.persona = persona
@@ -21,8 +31,32 @@ class Conversation(object):
         """
         self._logger.info("Starting to handle conversation with keyword '%s'.",
                           self.persona)
+        if not hasattr(self.mic, 'recordUtterance'):
+            # E.g. local_mic, which can't listen in the background
+            return self._handleSequentially()
+        with ConversationPipeline(self.mic, self.persona) as pipeline:
+            while True:
+                # Print notifications until empty
+                notifications = self.notifier.getAllNotifications()
+                for notif in notifications:
+                    self._logger.info("Received notification: '%s'",
+                                      str(notif))
+                    pipeline.say(str(notif))
+
+                input = pipeline.get_command(
+                    timeout=self.NOTIFICATION_INTERVAL)
+                if input is None:
+                    continue
+                if input:
+                    with pipeline.exclusive():
+                        self.brain.query(input)
+                else:
+                    self._logger.info("Nothing has been transcribed.")
+                    pipeline.say(self.PARDON)
+
+    def _handleSequentially(self):
         while True:
-            ## Print notifications until empty
+            # Print notifications until empty
             notifications = self.notifier.getAllNotifications()
             for notif in notifications:
                 self._logger.info("Received notification: '%s'", str(notif))
@@ -48,4 +82,4 @@ class Conversation(object):
             if input:
                 self.brain.query(input)
             else:
-                self.mic.say("Perdon?")
+                self.mic.say(self.PARDON)
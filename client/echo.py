@@ -0,0 +1,126 @@
+# -*- coding: utf-8-*-
+"""
+Echo suppression for listening while Jasper is speaking.
+
+The microphone picks up Jasper's own voice while a phrase is played. The
+PlaybackGate knows what is being played (the reference signal) and
+attenuates captured frames that are explained by its echo, so that a
+keyword spotter only hears the user talking over Jasper.
+"""
+import logging
+import numpy
+import resample
+
+
+class PlaybackGate(object):
+
+    def __init__(self, reference, rate, channels=1, frame_duration=0.01,
+                 tolerance=0.2, coupling=1.0, margin=2.0, attenuation=0.03,
+                 adaptation=0.05, floor=None):
+        """
+        Arguments:
+            reference -- numpy int16 array of the samples being played
+            rate -- sample rate of reference
+            channels -- number of channels of reference
+            frame_duration -- length of the energy frames in seconds
+            tolerance -- seconds the echo may be early or late compared to
+                         the estimated playback time (output and input
+                         latency of the sound card)
+            coupling -- initial ratio of echo energy to reference energy
+            margin -- captured frames louder than margin times the
+                      expected echo are passed unchanged
+            attenuation -- gain applied to frames that are mostly echo
+            adaptation -- weight of each echo-only frame in the coupling
+            floor -- (optional) RMS energy that frames which are mostly echo
+                     are scaled to instead of applying attenuation, e.g. the
+                     noise floor of a VAD, which then neither hears the echo
+                     nor learns a lower noise floor from it
+        """
+        self._logger = logging.getLogger(__name__)
+        self.frame_duration = frame_duration
+        self.coupling = coupling
+        self.margin = margin
+        self.attenuation = attenuation
+        self.floor = floor
+        self.adaptation = adaptation
+        self.passed = 0
+        self.suppressed = 0
+
+        mono = resample.downmix(reference, channels).astype(numpy.float64)
+        frame_size = max(1, int(round(rate * frame_duration)))
+        num = len(mono) // frame_size
+        frames = mono[:num * frame_size].reshape(num, frame_size)
+        envelope = numpy.sqrt((frames ** 2).mean(axis=1)) if num \
+            else numpy.zeros(0)
+        # The exact alignment is unknown, so use the loudest reference
+        # frame within the tolerance window
+        spread = int(round(tolerance / frame_duration))
+        padded = numpy.concatenate((numpy.zeros(spread), envelope,
+                                    numpy.zeros(spread)))
+        self._envelope = numpy.zeros(len(envelope) + spread)
+        for shift in range(2 * spread + 1):
+            window = padded[shift:shift + len(self._envelope)]
+            self._envelope[:len(window)] = numpy.maximum(
+                self._envelope[:len(window)], window)
+
+    def reference_energy(self, t):
+        """
+        Arguments:
+            t -- seconds since the start of the playback
+
+        Returns:
+            The RMS energy of the reference around t
+        """
+        idx = int(t / self.frame_duration)
+        if idx < 0 or idx >= len(self._envelope):
+            return 0.0
+        return self._envelope[idx]
+
+    def process(self, frame, t):
+        """
+        Arguments:
+            frame -- a numpy int16 array of captured samples
+            t -- seconds since the start of the playback at which frame
+                 has been captured
+
+        Returns:
+            frame, either unchanged or attenuated if it is mostly echo
+        """
+        ref_energy = self.reference_energy(t)
+        if ref_energy <= 0:
+            return frame
+        samples = frame.astype(numpy.float64)
+        energy = numpy.sqrt((samples ** 2).mean()) if len(samples) else 0.0
+        expected = self.coupling * ref_energy
+        if energy > self.margin * expected:
+            # The user is talking over the playback
+            self.passed += 1
+            return frame
+        self.suppressed += 1
+        self.coupling = min(max((1 - self.adaptation) * self.coupling +
+                                self.adaptation * energy / ref_energy,
+                                1e-3), 1e3)
+        gain = self.attenuation
+        if self.floor is not None and energy > 0:
+            gain = min(1.0, self.floor / energy)
+        return (samples * gain).astype(numpy.int16)
+
+    def process_block(self, block, t, rate, frame_size):
+        """
+        Like process(), but for a block of several frames that are gated
+        one by one.
+
+        Arguments:
+            block -- a numpy int16 array of captured samples
+            t -- seconds since the start of the playback at which the first
+                 sample of block has been captured
+            rate -- sample rate of block
+            frame_size -- number of samples gated at once
+
+        Returns:
+            block, with the frames that are mostly echo attenuated
+        """
+        gated = [self.process(block[i:i + frame_size],
+                              t + float(i) / rate)
+                 for i in range(0, len(block), frame_size)]
+        return numpy.concatenate(gated) if gated else block
@@ -0,0 +1,388 @@
+# -*- coding: utf-8-*-
+"""
+A long-lived Festival server.
+
+Starting festival (or text2wave) per phrase costs a process start and
+loading the voice every time, which takes seconds. The FestivalServer keeps
+one `festival --server` process running, talks to it over a persistent
+socket and restarts it if it crashes.
+
+Festival's client protocol: each Scheme command is answered by any number of
+replies, each a three byte tag followed by a payload that ends with
+KEY (occurrences of KEY inside the payload are stuffed with an 'X'):
+
+    WV\\n -- a waveform, one per utterance (roughly: per sentence)
+    LP\\n -- the result of the command, as Lisp
+    ER\\n -- the command failed, instead of OK (no payload)
+    OK\\n -- the command is done (no payload)
+
+With tts_return_to_client, tts_textall sends the waveform of every
+utterance as soon as it's synthesized. The FestivalServer collects all of
+them before handing them out, so that the server is free for the next
+phrase while they're being played; Mic.say() synthesizes sentence by
+sentence anyway.
+"""
+import atexit
+import io
+import logging
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+import numpy
+import metrics
+
+KEY = 'ft_StUfF_key'
+# How KEY[:-1] is sent when it's followed by anything but the last
+# character of KEY
+_STUFFED = KEY[:-1] + 'X'
+
+
+class FestivalError(Exception):
+    pass
+
+
+class CommandError(FestivalError):
+    """
+    Festival failed to run a command, e.g. because of text it can't
+    synthesize. The server itself is fine.
+    """
+    pass
+
+
+def quote(text):
+    """
+    Returns:
+        text as a Scheme string literal
+    """
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class ReplyReader(object):
+    """
+    Reads the replies of a Festival server from a socket.
+    """
+
+    def __init__(self, sock, chunk_size=65536):
+        self._sock = sock
+        self._chunk_size = chunk_size
+        self._buffer = b''
+
+    def _fill(self):
+        data = self._sock.recv(self._chunk_size)
+        if not data:
+            raise FestivalError("Festival closed the connection")
+        self._buffer += data
+
+    def read_exactly(self, size):
+        while len(self._buffer) < size:
+            self._fill()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read_until_key(self):
+        """
+        Returns:
+            The payload up to KEY, unstuffed
+        """
+        start = 0
+        while True:
+            index = self._buffer.find(KEY, start)
+            if index >= 0:
+                break
+            # KEY may be split across two reads
+            start = max(0, len(self._buffer) - len(KEY) + 1)
+            self._fill()
+        data = self._buffer[:index]
+        self._buffer = self._buffer[index + len(KEY):]
+        return data.replace(_STUFFED, KEY[:-1])
+
+    def replies(self):
+        """
+        Yields:
+            Tuples (tag, payload) up to (excluding) the final OK
+
+        Raises:
+            CommandError on ER
+        """
+        while True:
+            tag = self.read_exactly(3)
+            if tag == 'OK\n':
+                return
+            elif tag == 'ER\n':
+                raise CommandError("Festival failed to run the command")
+            elif tag in ('WV\n', 'LP\n'):
+                yield tag[:2], self.read_until_key()
+            else:
+                raise FestivalError("Unexpected reply %r" % tag)
+
+
+def decode_wave(data):
+    """
+    Returns:
+        A tuple (samples, rate, channels) of a RIFF waveform
+    """
+    wav = wave.open(io.BytesIO(data), 'rb')
+    try:
+        samples = numpy.frombuffer(wav.readframes(wav.getnframes()),
+                                   dtype=numpy.int16)
+        return (samples, wav.getframerate(), wav.getnchannels())
+    finally:
+        wav.close()
+
+
+class FestivalServer(object):
+
+    def __init__(self, command='festival', voice=None, port=None,
+                 startup_timeout=10.0, timeout=30.0, max_restarts=5,
+                 restart_window=60.0, check_interval=1.0):
+        """
+        Arguments:
+            command -- the festival executable
+            voice -- (optional) the voice to select, e.g.
+                     'el_diphone' for voice_el_diphone
+            port -- (optional) the server port (Default: a free port)
+            startup_timeout -- seconds to wait for the server to accept
+                               connections
+            timeout -- seconds to wait for a reply
+            max_restarts -- restarts within restart_window seconds after
+                            which the server is given up
+            check_interval -- seconds between two checks whether the
+                              process is still running
+        """
+        self._logger = logging.getLogger(__name__)
+        self.command = command
+        self.voice = voice
+        self.port = port
+        self.startup_timeout = startup_timeout
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._process = None
+        self._script = None
+        self._port = None
+        self._sock = None
+        self._reader = None
+        self._restarts = []
+        self._closed = threading.Event()
+        self._supervisor = None
+
+    @property
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """
+        Starts the server (if it isn't running yet) and the supervisor that
+        restarts it when it dies.
+
+        Raises:
+            FestivalError if the server doesn't come up
+        """
+        with self._lock:
+            if self._closed.is_set():
+                raise FestivalError("Festival server has been closed")
+            if not self.is_running:
+                self._spawn()
+            if self._supervisor is None:
+                self._supervisor = threading.Thread(target=self._supervise,
+                                                    name='FestivalServer')
+                self._supervisor.daemon = True
+                self._supervisor.start()
+                atexit.register(self.close)
+        return self
+
+    def _spawn(self):
+        # Called with the lock held
+        self._disconnect()
+        port = self._port = self.port or free_port()
+        fd, self._script = tempfile.mkstemp(suffix='.scm')
+        with os.fdopen(fd, 'w') as f:
+            f.write("(set! server_port %d)\n" % port)
+            f.write("(set! server_access_list '(\"localhost.*\" " +
+                    "\"127.0.0.1\"))\n")
+        start = time.time()
+        self._logger.debug("Starting festival server on port %d", port)
+        with open(os.devnull, 'w') as devnull:
+            try:
+                self._process = subprocess.Popen(
+                    [self.command, '--server', self._script],
+                    stdin=devnull, stdout=devnull, stderr=devnull)
+            except OSError as e:
+                self._process = None
+                raise FestivalError("Can't start festival: %s" % e)
+        while True:
+            try:
+                self._connect()
+                break
+            except FestivalError:
+                self._kill()
+                raise
+            except socket.error:
+                if not self.is_running:
+                    returncode = self._process.returncode
+                    self._kill()
+                    raise FestivalError("Festival server exited with %r" %
+                                        returncode)
+                if time.time() - start > self.startup_timeout:
+                    self._kill()
+                    raise FestivalError("Festival server didn't start " +
+                                        "within %.0f s" %
+                                        self.startup_timeout)
+                time.sleep(0.05)
+        try:
+            # Load everything a synthesis needs before the first phrase
+            self._run("(tts_textall %s 'nil)" % quote('a'))
+        except (FestivalError, socket.error) as e:
+            self._kill()
+            raise FestivalError("Festival server failed to start: %s" % e)
+        metrics.observe('tts.festival.startup_time', time.time() - start)
+        self._logger.info("Festival server is ready after %.0f ms",
+                          1000 * (time.time() - start))
+
+    def _connect(self):
+        # Called with the lock held
+        sock = socket.create_connection(('127.0.0.1', self._port),
+                                        self.timeout)
+        self._sock, self._reader = sock, ReplyReader(sock)
+        try:
+            self._run("(Parameter.set 'Wavefiletype 'riff)")
+            self._run("(tts_return_to_client)")
+            if self.voice:
+                self._run("(voice_%s)" % self.voice)
+        except (FestivalError, socket.error):
+            self._disconnect()
+            raise
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+        self._sock, self._reader = None, None
+
+    def _kill(self):
+        # Called with the lock held
+        self._disconnect()
+        if self.is_running:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+        if self._script is not None:
+            try:
+                os.remove(self._script)
+            except OSError:
+                pass
+            self._script = None
+
+    def _restart(self, reason):
+        # Called with the lock held
+        now = time.time()
+        self._restarts = [t for t in self._restarts
+                          if now - t < self.restart_window] + [now]
+        metrics.increment('tts.festival.restarts')
+        if len(self._restarts) > self.max_restarts:
+            self._kill()
+            raise FestivalError("Festival server restarted too often, " +
+                                "last because of: %s" % reason)
+        self._logger.warning("Restarting festival server: %s", reason)
+        self._kill()
+        self._spawn()
+
+    def _supervise(self):
+        while not self._closed.wait(self.check_interval):
+            with self._lock:
+                if self._closed.is_set() or self._process is None or \
+                        self.is_running:
+                    continue
+                try:
+                    self._restart("exited with %r" %
+                                  self._process.returncode)
+                except FestivalError:
+                    self._logger.error("Festival server could not be " +
+                                       "restarted", exc_info=True)
+
+    def _send(self, command):
+        self._sock.sendall(command + "\n")
+        return self._reader.replies()
+
+    def _run(self, command):
+        for reply in self._send(command):
+            pass
+
+    def synthesize(self, text):
+        """
+        Synthesizes text, restarting the server once if it has crashed.
+
+        Arguments:
+            text -- an ISO-8859-1 encoded str
+
+        Yields:
+            A tuple (samples, rate, channels) per utterance, once Festival
+            has synthesized all of text
+
+        Raises:
+            CommandError if Festival can't synthesize text
+            FestivalError if the server fails
+        """
+        with self._lock:
+            self.start()
+            if self._sock is None:
+                try:
+                    self._connect()
+                except (FestivalError, socket.error) as e:
+                    self._restart("can't connect: %s" % e)
+            start = time.time()
+            retried = False
+            while True:
+                chunks = []
+                try:
+                    for tag, data in self._send(
+                            "(tts_textall %s 'nil)" % quote(text)):
+                        if tag != 'WV':
+                            continue
+                        if not chunks:
+                            metrics.observe('tts.festival.first_audio',
+                                            time.time() - start)
+                        chunks.append(decode_wave(data))
+                    break
+                except CommandError:
+                    # Only this text has failed, restarting wouldn't help
+                    metrics.increment('tts.festival.errors')
+                    raise
+                except (socket.error, FestivalError) as e:
+                    if retried or self._closed.is_set():
+                        self._disconnect()
+                        raise FestivalError("Festival failed: %s" % e)
+                    retried = True
+                    self._restart(str(e))
+            metrics.observe('tts.festival.synthesis_time',
+                            time.time() - start)
+        # Handed out without the lock, the caller may take its time to
+        # play them
+        for chunk in chunks:
+            yield chunk
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._kill()
+        supervisor = self._supervisor
+        if supervisor is not None and \
+                supervisor is not threading.current_thread():
+            supervisor.join()
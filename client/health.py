@@ -0,0 +1,140 @@
+# -*- coding: utf-8-*-
+"""
+Health tracking and circuit breaking for remote services.
+
+Every request to a service is recorded with its outcome and latency. Once
+too many of the recent requests have failed, the breaker opens: requests are
+refused immediately instead of waiting for a dead service again. After a
+while a single probe request is let through (half-open) and its outcome
+decides whether the breaker closes again or stays open.
+"""
+import collections
+import logging
+import threading
+import time
+import speech_recognition as sr
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(sr.RequestError):
+    """
+    Raised instead of contacting a service whose breaker is open.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, window=20, min_requests=5, max_error_rate=0.5,
+                 reset_timeout=30.0, alpha=0.2):
+        """
+        Arguments:
+            name -- prefix of the metrics of this breaker, e.g. 'stt.IBM'
+            window -- number of recent requests the error rate is computed
+                      over
+            min_requests -- the breaker doesn't open before this many
+                            requests are known
+            max_error_rate -- error rate (0 to 1) that opens the breaker
+            reset_timeout -- seconds the breaker stays open before a probe
+                             request is let through
+            alpha -- weight of the latest latency in the moving average
+        """
+        self._logger = logging.getLogger(__name__)
+        self.name = name
+        self.min_requests = min_requests
+        self.max_error_rate = max_error_rate
+        self.reset_timeout = reset_timeout
+        self.alpha = alpha
+        self.state = CLOSED
+        # Exponentially weighted moving average of the latency in seconds
+        self.latency = None
+        # Time of the last recorded request
+        self.last_request = None
+        self._outcomes = collections.deque(maxlen=window)
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return float(self._outcomes.count(False)) / len(self._outcomes)
+
+    def allow_request(self):
+        """
+        Returns:
+            True if a request may be sent now. While the breaker is
+            half-open, only the probe request is allowed.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and \
+                    time.time() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def check(self):
+        """
+        Raises:
+            CircuitOpenError if no request may be sent now
+        """
+        if not self.allow_request():
+            raise CircuitOpenError("%s is unavailable, retrying in %.0f s" %
+                                   (self.name, self.retry_in))
+
+    @property
+    def retry_in(self):
+        """
+        Seconds until the next probe request is let through
+        """
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.time())
+
+    def record_success(self, latency):
+        with self._lock:
+            self._record(True, latency)
+            if self.state != CLOSED:
+                # Start over, the old failures don't matter anymore
+                self._outcomes.clear()
+                self._outcomes.append(True)
+                self._set_state(CLOSED)
+
+    def record_failure(self, latency=None):
+        with self._lock:
+            self._record(False, latency)
+            metrics.increment('%s.failures' % self.name)
+            if self.state == HALF_OPEN:
+                self._set_state(OPEN)
+            elif self.state == CLOSED and \
+                    len(self._outcomes) >= self.min_requests and \
+                    float(self._outcomes.count(False)) / \
+                    len(self._outcomes) >= self.max_error_rate:
+                self._set_state(OPEN)
+
+    def _record(self, success, latency):
+        self._probing = False
+        self.last_request = time.time()
+        self._outcomes.append(success)
+        if latency is not None:
+            self.latency = latency if self.latency is None \
+                else self.alpha * latency + (1 - self.alpha) * self.latency
+            metrics.observe('%s.latency' % self.name, latency)
+
+    def _set_state(self, state):
+        if state == OPEN:
+            self._opened_at = time.time()
+            metrics.increment('%s.breaker_opened' % self.name)
+        self._logger.info("%s: circuit %s -> %s", self.name, self.state,
+                          state)
+        self.state = state
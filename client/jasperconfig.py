@@ -0,0 +1,162 @@
+# -*- coding: utf-8-*-
+"""
+Shared access to the user profile (profile.yml).
+
+The profile is parsed once and shared by everyone who needs it. It's only
+read again after the file has changed. A binary snapshot of the parsed
+profile is kept next to it, so that starting Jasper doesn't even need to
+parse the YAML unless the profile has been edited since the last start.
+"""
+import os
+import time
+import logging
+import threading
+import cPickle as pickle
+import yaml
+
+import jasperpath
+
+
+class Profile(object):
+
+    def __init__(self, path=None, snapshot_path=None, check_interval=1.0):
+        """
+        Arguments:
+            path -- (optional) the profile (Default: <CONFIG_PATH>/profile.yml)
+            snapshot_path -- (optional) the binary snapshot of the parsed
+                             profile (Default: <CONFIG_PATH>/profile.cache)
+            check_interval -- minimum number of seconds between two checks
+                              of the modification time of the profile
+        """
+        self._logger = logging.getLogger(__name__)
+        self.path = path if path else jasperpath.config('profile.yml')
+        self.snapshot_path = snapshot_path if snapshot_path \
+            else jasperpath.config('profile.cache')
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._data = None
+        self._stamp = None
+        self._last_check = 0
+
+    def _get_stamp(self):
+        """
+        Returns:
+            The modification time and size of the profile, or None if it
+            doesn't exist
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def get(self, required=False):
+        """
+        Returns the parsed profile. The returned dict is shared, so it must
+        not be modified.
+
+        Arguments:
+            required -- raise an error if the profile doesn't exist, instead
+                        of returning an empty dict
+
+        Raises:
+            IOError if required is set and the profile doesn't exist
+        """
+        with self._lock:
+            now = time.time()
+            if self._data is None or \
+                    now - self._last_check >= self.check_interval:
+                self._last_check = now
+                stamp = self._get_stamp()
+                if stamp != self._stamp or self._data is None:
+                    self._data = self._load(stamp)
+                    self._stamp = stamp
+            data = self._data
+        if required and self._stamp is None:
+            raise IOError("Profile '%s' does not exist" % self.path)
+        return data
+
+    def get_section(self, name):
+        """
+        Returns:
+            A section of the profile as dict, empty if it doesn't exist
+        """
+        section = self.get().get(name)
+        return section if isinstance(section, dict) else {}
+
+    def invalidate(self):
+        """
+        Makes the next get() check the profile for changes.
+        """
+        with self._lock:
+            self._last_check = 0
+
+    def _load(self, stamp):
+        if stamp is None:
+            return {}
+        snapshot = self._load_snapshot(stamp)
+        if snapshot is not None:
+            return snapshot
+        self._logger.debug("Parsing profile '%s'", self.path)
+        with open(self.path, 'r') as f:
+            data = yaml.safe_load(f)
+        if not isinstance(data, dict):
+            data = {}
+        self._save_snapshot(stamp, data)
+        return data
+
+    def _load_snapshot(self, stamp):
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot_stamp, data = pickle.load(f)
+            if tuple(snapshot_stamp) != stamp:
+                return None
+        except (IOError, OSError):
+            # No snapshot yet
+            return None
+        except Exception:
+            # Unpickling a truncated or stale snapshot can raise about
+            # anything, it's rebuilt from the profile
+            self._logger.warning("Ignoring unreadable profile snapshot " +
+                                 "'%s'", self.snapshot_path, exc_info=True)
+            return None
+        self._logger.debug("Loaded profile from snapshot '%s'",
+                           self.snapshot_path)
+        return data
+
+    def _save_snapshot(self, stamp, data):
+        try:
+            jasperpath.atomic_write(
+                self.snapshot_path,
+                lambda f: pickle.dump((stamp, data), f,
+                                      pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError, pickle.PicklingError):
+            self._logger.warning("Could not write profile snapshot '%s'",
+                                 self.snapshot_path, exc_info=True)
+
+
+_profile = None
+
+
+def _get_default():
+    global _profile
+    if _profile is None:
+        _profile = Profile()
+    return _profile
+
+
+def get_profile(required=False):
+    """
+    Returns:
+        The parsed <CONFIG_PATH>/profile.yml, see Profile.get()
+    """
+    return _get_default().get(required=required)
+
+
+def get_section(name):
+    """
+    Returns:
+        A section of <CONFIG_PATH>/profile.yml as dict, empty if it doesn't
+        exist
+    """
+    return _get_default().get_section(name)
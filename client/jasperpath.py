@@ -1,5 +1,6 @@
 # -*- coding: utf-8-*-
 import os
+import tempfile
 
 # Jasper main directory
 APP_PATH = os.path.normpath(os.path.join(
@@ -20,4 +21,34 @@ def data(*fname):
     return os.path.join(DATA_PATH, *fname)
 
 
+def atomic_write(path, writer, mode='wb'):
+    """
+    Writes a file through a temporary file in the same directory, so that a
+    crash never leaves a truncated file behind.
+
+    Arguments:
+        path -- the file to write
+        writer -- called with the open temporary file
+        mode -- mode to open the temporary file with
+
+    Raises:
+        IOError or OSError if the file can't be written, or whatever writer
+        raises. The temporary file is removed in any case.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    suffix='.tmp')
+    written = False
+    try:
+        with os.fdopen(fd, mode) as f:
+            writer(f)
+        os.rename(tmp_path, path)
+        written = True
+    finally:
+        if not written:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
 print(APP_PATH )
@@ -0,0 +1,116 @@
+# -*- coding: utf-8-*-
+"""
+Keep-alive HTTP sessions for the cloud engines.
+
+Opening a new HTTPS connection costs a DNS lookup, the TCP handshake and the
+TLS handshake, which is several round trips on a slow network. A
+KeepAliveSession keeps its connections open between utterances and can open
+one in advance (preconnect), e.g. while the user is still speaking, so that
+the upload itself doesn't have to wait for any handshake.
+"""
+import logging
+import threading
+import time
+import requests
+import metrics
+
+
+class KeepAliveSession(requests.Session):
+
+    PRECONNECT_TIMEOUT = 5
+
+    def __init__(self, name, pool_size=2):
+        """
+        Arguments:
+            name -- prefix of the metrics of this session, e.g. 'stt.ibm'
+            pool_size -- number of connections kept open per host
+        """
+        super(KeepAliveSession, self).__init__()
+        self._logger = logging.getLogger(__name__)
+        self.name = name
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                                pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.reused = 0
+        self.opened = 0
+        # Average time needed to open a connection, learned by preconnect()
+        self.handshake_time = None
+        self._preconnecting = None
+
+    def _get_pool(self, url):
+        try:
+            return self.get_adapter(url).poolmanager.connection_from_url(url)
+        except (requests.exceptions.RequestException, ValueError,
+                AttributeError):
+            return None
+
+    def request(self, method, url, *args, **kwargs):
+        # Waiting for a handshake in progress is faster than starting
+        # another one
+        self.wait_preconnect(self.PRECONNECT_TIMEOUT)
+        pool = self._get_pool(url)
+        opened = pool.num_connections if pool is not None else None
+        response = super(KeepAliveSession, self).request(method, url, *args,
+                                                         **kwargs)
+        if pool is not None:
+            if pool.num_connections == opened:
+                self.reused += 1
+                metrics.increment('%s.connections_reused' % self.name)
+                if self.handshake_time is not None:
+                    metrics.observe('%s.handshake_saved' % self.name,
+                                    self.handshake_time)
+            else:
+                self.opened += 1
+                metrics.increment('%s.connections_opened' % self.name)
+            self._logger.debug("%s: connection reuse rate %.0f%%", self.name,
+                               100.0 * self.reuse_rate)
+        return response
+
+    @property
+    def reuse_rate(self):
+        total = self.reused + self.opened
+        return float(self.reused) / total if total else 0.0
+
+    def preconnect(self, url):
+        """
+        Opens a connection to the host of url in the background, unless
+        that is already being done.
+        """
+        thread = self._preconnecting
+        if thread is not None and thread.is_alive():
+            return
+        self._preconnecting = threading.Thread(target=self._preconnect,
+                                               args=(url,),
+                                               name='KeepAliveSession')
+        self._preconnecting.daemon = True
+        self._preconnecting.start()
+
+    def _preconnect(self, url):
+        pool = self._get_pool(url)
+        opened = pool.num_connections if pool is not None else None
+        start = time.time()
+        try:
+            # Any response will do, only the connection matters
+            super(KeepAliveSession, self).request(
+                'HEAD', url, timeout=self.PRECONNECT_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            self._logger.debug("%s: preconnect to %s failed: %s", self.name,
+                               url, e)
+            return
+        elapsed = time.time() - start
+        if pool is not None and pool.num_connections != opened:
+            # A new connection had to be opened
+            self.handshake_time = elapsed if self.handshake_time is None \
+                else 0.8 * self.handshake_time + 0.2 * elapsed
+            metrics.observe('%s.handshake_time' % self.name, elapsed)
+            self._logger.debug("%s: connected to %s in %.0f ms", self.name,
+                               url, 1000 * elapsed)
+
+    def wait_preconnect(self, timeout=None):
+        """
+        Waits for a running preconnect() to finish.
+        """
+        thread = self._preconnecting
+        if thread is not None:
+            thread.join(timeout)
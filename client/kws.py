@@ -0,0 +1,502 @@
+# -*- coding: utf-8-*-
+"""
+Offline keyword spotting for passive listening.
+
+A keyword spotter (KWS) engine consumes the captured audio in short frames
+(5-20 ms) and reports when one of its keywords has been said. This way,
+passive listening doesn't need to send every background noise to the cloud
+STT engine; only audio captured after a detection is transcribed remotely.
+
+KWS methods:
+    process - feed one frame of int16 samples, returns the detected keyword
+              or None
+    reset - forget all audio seen so far
+    is_available - returns True if the platform supports this implementation
+"""
+import os
+import glob
+import audioop
+import wave
+import logging
+import shutil
+import tempfile
+from abc import ABCMeta, abstractmethod
+import numpy
+
+import diagnose
+import jasperpath
+import jasperconfig
+import registry
+import vocabcompiler
+from g2p import PhonetisaurusG2P
+
+try:
+    import pocketsphinx
+except ImportError:
+    pass
+
+
+class AbstractKWSEngine(object):
+    """
+    Generic parent class for all keyword spotters
+    """
+    __metaclass__ = ABCMeta
+
+    # Frame length in seconds, must be between 5 and 20 ms
+    FRAME_DURATION = 0.01
+
+    @classmethod
+    def get_profile_config(cls):
+        """
+        Returns:
+            The 'keyword_spotter' section of profile.yml as dict
+        """
+        return dict(jasperconfig.get_section('keyword_spotter'))
+
+    @classmethod
+    def get_config(cls):
+        config = {}
+        profile_config = cls.get_profile_config()
+        if 'frame_duration' in profile_config:
+            config['frame_duration'] = \
+                float(profile_config['frame_duration'])
+        return config
+
+    @classmethod
+    def get_instance(cls, keywords, rate):
+        config = cls.get_config()
+        instance = cls(keywords, rate, **config)
+        return instance
+
+    @classmethod
+    @abstractmethod
+    def is_available(cls):
+        return True
+
+    def __init__(self, keywords, rate, frame_duration=None):
+        """
+        Arguments:
+            keywords -- a list of keywords to spot simultaneously
+            rate -- sample rate of the frames passed to process()
+            frame_duration -- (optional) frame length in seconds
+        """
+        self._logger = logging.getLogger(__name__)
+        if frame_duration is None:
+            frame_duration = self.FRAME_DURATION
+        if not 0.005 <= frame_duration <= 0.02:
+            raise ValueError("Frame duration must be between 5 and 20 ms, " +
+                             "got %r" % frame_duration)
+        self.keywords = [keyword.upper() for keyword in keywords]
+        self.rate = rate
+        self.frame_size = int(round(rate * frame_duration))
+
+    @abstractmethod
+    def process(self, frame):
+        """
+        Feeds one frame of audio to the spotter.
+
+        Arguments:
+            frame -- a numpy int16 array of self.frame_size samples
+
+        Returns:
+            The detected keyword or None
+        """
+        pass
+
+    def reset(self):
+        pass
+
+
+class PocketSphinxKWS(AbstractKWSEngine):
+    """
+    Spots keywords with the keyphrase search of pocketsphinx, using the
+    shipped persona dictionary (static/dictionary_persona.dic) and language
+    model (static/languagemodel_persona.lm).
+
+    Keywords missing from the dictionary (e.g. 'ESPEJO') get their
+    pronunciation from Phonetisaurus, just like the words of a compiled
+    vocabulary. A pronunciation in the 'pronunciations' dict of the
+    'keyword_spotter' profile section takes precedence; without
+    Phonetisaurus, the engine can't be instantiated for keywords that have
+    none.
+    """
+
+    SLUG = 'pocketsphinx-kws'
+
+    # pocketsphinx acoustic models expect 16 kHz
+    DECODER_RATE = 16000
+
+    @classmethod
+    def get_config(cls):
+        config = super(PocketSphinxKWS, cls).get_config()
+        config['hmm_dir'] = os.path.join('/usr/local/share/pocketsphinx',
+                                         'model/hmm/en_US/hub4wsj_sc_8k')
+        profile_config = cls.get_profile_config()
+        for key in ('hmm_dir', 'dictionary', 'languagemodel',
+                    'pronunciations'):
+            if key in profile_config:
+                config[key] = profile_config[key]
+        if 'threshold' in profile_config:
+            config['threshold'] = float(profile_config['threshold'])
+        # The hmm_dir of the pocketsphinx STT section works, too
+        pocketsphinx = jasperconfig.get_section('pocketsphinx')
+        if 'hmm_dir' not in profile_config and 'hmm_dir' in pocketsphinx:
+            config['hmm_dir'] = pocketsphinx['hmm_dir']
+        return config
+
+    @classmethod
+    def is_available(cls):
+        return diagnose.check_python_import('pocketsphinx')
+
+    def __init__(self, keywords, rate, hmm_dir=None,
+                 dictionary=jasperpath.data('dictionary_persona.dic'),
+                 languagemodel=jasperpath.data('languagemodel_persona.lm'),
+                 pronunciations=None, threshold=1e-20, **kwargs):
+        """
+        Arguments:
+            keywords -- a list of keywords to spot simultaneously
+            rate -- sample rate of the frames passed to process()
+            hmm_dir -- the pocketsphinx acoustic model directory
+            dictionary -- the pronunciation dictionary
+            languagemodel -- the language model, only used to complete the
+                             decoder configuration
+            pronunciations -- (optional) dict of extra pronunciations, the
+                              missing ones are derived with Phonetisaurus
+            threshold -- the keyphrase detection threshold
+
+        Raises:
+            ValueError if a keyword has no pronunciation
+        """
+        super(PocketSphinxKWS, self).__init__(keywords, rate, **kwargs)
+        pronunciations = dict((word.upper(), phones) for word, phones
+                              in (pronunciations or {}).items())
+        known_words = set(vocabcompiler.get_keyword_phrases())
+        known_words.update(pronunciations)
+        missing = sorted(set(word for keyword in self.keywords
+                             for word in keyword.split()
+                             if word not in known_words))
+        if missing:
+            pronunciations.update(self._derive_pronunciations(missing))
+            known_words.update(pronunciations)
+        for keyword in self.keywords:
+            if not all(word in known_words for word in keyword.split()):
+                raise ValueError("No pronunciation found for keyword " +
+                                 "'%s', add one to the profile" % keyword)
+
+        # The decoder reads the files while it's set up, they aren't needed
+        # afterwards
+        workdir = tempfile.mkdtemp(prefix='jasper-kws-')
+        try:
+            self._decoder = self._create_decoder(workdir, hmm_dir,
+                                                 dictionary, languagemodel,
+                                                 pronunciations, threshold)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        self._ratecv_state = None
+        self._in_utterance = False
+
+    def _derive_pronunciations(self, words):
+        """
+        Returns:
+            A dict of the most likely pronunciation of each of words
+            according to Phonetisaurus, empty if Phonetisaurus isn't
+            available
+        """
+        try:
+            g2pconverter = PhonetisaurusG2P(**PhonetisaurusG2P.get_config())
+            phonemes = g2pconverter.translate(words)
+        except OSError:
+            self._logger.warning("Can't derive pronunciations for %s",
+                                 ', '.join(words), exc_info=True)
+            return {}
+        derived = {}
+        for word, pronunciations in phonemes.items():
+            if pronunciations:
+                self._logger.info("Derived pronunciation of '%s': %s",
+                                  word, pronunciations[0])
+                derived[word.upper()] = pronunciations[0]
+        return derived
+
+    def _create_decoder(self, workdir, hmm_dir, dictionary, languagemodel,
+                        pronunciations, threshold):
+        dict_file = os.path.join(workdir, 'keywords.dic')
+        with open(dictionary, 'r') as f:
+            dict_content = f.read()
+        with open(dict_file, 'w') as f:
+            f.write(dict_content)
+            for word, phones in pronunciations.items():
+                f.write("%s\t%s\n" % (word, phones))
+
+        keyphrase_file = os.path.join(workdir, 'keyphrases')
+        with open(keyphrase_file, 'w') as f:
+            for keyword in self.keywords:
+                f.write("%s /%s/\n" % (keyword, threshold))
+
+        config = pocketsphinx.Decoder.default_config()
+        config.set_string('-hmm', hmm_dir)
+        config.set_string('-dict', dict_file)
+        config.set_string('-lm', languagemodel)
+        config.set_string('-logfn', os.devnull)
+        decoder = pocketsphinx.Decoder(config)
+        decoder.set_kws('keywords', keyphrase_file)
+        decoder.set_search('keywords')
+        return decoder
+
+    def process(self, frame):
+        data = frame.tostring()
+        if self.rate != self.DECODER_RATE:
+            data, self._ratecv_state = audioop.ratecv(
+                data, 2, 1, self.rate, self.DECODER_RATE, self._ratecv_state)
+        if not self._in_utterance:
+            self._decoder.start_utt()
+            self._in_utterance = True
+        self._decoder.process_raw(data, False, False)
+        hyp = self._decoder.hyp()
+        if hyp is None:
+            return None
+        keyword = hyp.hypstr.strip().upper()
+        self.reset()
+        return keyword if keyword in self.keywords else None
+
+    def reset(self):
+        if self._in_utterance:
+            self._decoder.end_utt()
+            self._in_utterance = False
+        self._ratecv_state = None
+
+
+class TemplateKWS(AbstractKWSEngine):
+    """
+    Spots keywords by comparing the incoming audio with enrolled recordings
+    of each keyword using dynamic time warping on log filterbank energies.
+
+    Templates are mono 16 bit WAV files in
+    <CONFIG_PATH>/kws-templates/<keyword>/, see enroll().
+    """
+
+    SLUG = 'template-kws'
+
+    NUM_BANDS = 20
+    WINDOW_DURATION = 0.025
+    # Run the (comparatively expensive) DTW match every n frames
+    CHECK_INTERVAL = 5
+
+    @classmethod
+    def get_template_dir(cls, keyword):
+        return jasperpath.config('kws-templates', keyword.lower())
+
+    @classmethod
+    def enroll(cls, keyword, wav_file):
+        """
+        Adds a recording of keyword to its templates.
+
+        Arguments:
+            keyword -- the keyword that is said in the recording
+            wav_file -- path of a mono 16 bit WAV file
+        """
+        template_dir = cls.get_template_dir(keyword)
+        if not os.path.exists(template_dir):
+            os.makedirs(template_dir)
+        with open(wav_file, 'rb') as f:
+            data = f.read()
+        fname = os.path.join(template_dir, '%d.wav' %
+                             len(os.listdir(template_dir)))
+        with open(fname, 'wb') as f:
+            f.write(data)
+        return fname
+
+    @classmethod
+    def get_config(cls):
+        config = super(TemplateKWS, cls).get_config()
+        profile_config = cls.get_profile_config()
+        if 'threshold' in profile_config:
+            config['threshold'] = float(profile_config['threshold'])
+        return config
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def __init__(self, keywords, rate, templates=None, threshold=0.3,
+                 **kwargs):
+        """
+        Arguments:
+            keywords -- a list of keywords to spot simultaneously
+            rate -- sample rate of the frames passed to process()
+            templates -- (optional) dict mapping keywords to lists of numpy
+                         int16 arrays, instead of the enrolled WAV files
+            threshold -- maximum average cosine distance of a match
+        """
+        super(TemplateKWS, self).__init__(keywords, rate, **kwargs)
+        self.threshold = threshold
+        self._window_size = int(round(rate * self.WINDOW_DURATION))
+        self._window = numpy.hamming(self._window_size)
+        fft_size = 1
+        while fft_size < self._window_size:
+            fft_size *= 2
+        self._fft_size = fft_size
+        self._filterbank = self._make_filterbank()
+
+        if templates is None:
+            templates = self._load_templates()
+        self._templates = []
+        for keyword in self.keywords:
+            samples_list = templates.get(keyword, [])
+            if not samples_list:
+                self._logger.warning("No templates enrolled for keyword " +
+                                     "'%s', it won't be detected.", keyword)
+            for samples in samples_list:
+                features = self.features(samples)
+                if len(features):
+                    self._templates.append((keyword, features))
+
+        max_len = max([len(t) for k, t in self._templates] or [1])
+        self._history = numpy.zeros((int(max_len * 1.5) + 1,
+                                     self.NUM_BANDS))
+        self.reset()
+
+    def _load_templates(self):
+        templates = {}
+        for keyword in self.keywords:
+            templates[keyword] = []
+            pattern = os.path.join(self.get_template_dir(keyword), '*.wav')
+            for fname in sorted(glob.glob(pattern)):
+                wav = wave.open(fname, 'rb')
+                try:
+                    data = wav.readframes(wav.getnframes())
+                    if wav.getframerate() != self.rate:
+                        data, _ = audioop.ratecv(data, 2, 1,
+                                                 wav.getframerate(),
+                                                 self.rate, None)
+                finally:
+                    wav.close()
+                templates[keyword].append(numpy.frombuffer(data,
+                                                           dtype=numpy.int16))
+        return templates
+
+    def _make_filterbank(self):
+        # Triangular filters, equally spaced on the mel scale
+        num_bins = self._fft_size // 2 + 1
+        max_mel = 2595 * numpy.log10(1 + (self.rate / 2.0) / 700)
+        mels = numpy.linspace(0, max_mel, self.NUM_BANDS + 2)
+        hz = 700 * (10 ** (mels / 2595) - 1)
+        bins = numpy.floor((self._fft_size + 1) * hz / self.rate).astype(int)
+        filterbank = numpy.zeros((self.NUM_BANDS, num_bins))
+        for i in range(self.NUM_BANDS):
+            left, center, right = bins[i], bins[i + 1], bins[i + 2]
+            if center > left:
+                filterbank[i, left:center] = \
+                    (numpy.arange(left, center) - left) / float(center - left)
+            if right > center:
+                filterbank[i, center:right] = \
+                    (right - numpy.arange(center, right)) / \
+                    float(right - center)
+        return filterbank
+
+    def _frame_features(self, windows):
+        # windows: (n, window_size) array -> (n, NUM_BANDS) unit vectors
+        spectrum = numpy.abs(numpy.fft.rfft(windows * self._window,
+                                            self._fft_size)) ** 2
+        energies = numpy.log(numpy.dot(spectrum, self._filterbank.T) + 1e-3)
+        energies -= energies.mean(axis=1)[:, numpy.newaxis]
+        norms = numpy.sqrt((energies ** 2).sum(axis=1))[:, numpy.newaxis]
+        return energies / numpy.maximum(norms, 1e-9)
+
+    def features(self, samples):
+        """
+        Computes the feature vectors of a whole recording.
+
+        Arguments:
+            samples -- a numpy int16 array
+
+        Returns:
+            A (frames, NUM_BANDS) numpy array
+        """
+        samples = numpy.asarray(samples, dtype=numpy.float64)
+        if len(samples) < self._window_size:
+            return numpy.zeros((0, self.NUM_BANDS))
+        num = 1 + (len(samples) - self._window_size) // self.frame_size
+        idx = (numpy.arange(self._window_size)[numpy.newaxis, :] +
+               self.frame_size * numpy.arange(num)[:, numpy.newaxis])
+        return self._frame_features(samples[idx])
+
+    @staticmethod
+    def match(template, history):
+        """
+        Subsequence DTW of template against the end of history.
+
+        Returns:
+            The average cosine distance of the best alignment that ends
+            with the last frame of history
+        """
+        dist = 1 - numpy.dot(template, history.T)
+        acc = dist[0].copy()
+        inf = numpy.empty(2)
+        inf.fill(numpy.inf)
+        for row in dist[1:]:
+            shifted1 = numpy.concatenate((inf[:1], acc[:-1]))
+            shifted2 = numpy.concatenate((inf, acc[:-2]))
+            acc = row + numpy.minimum(numpy.minimum(acc, shifted1), shifted2)
+        return acc[-1] / len(template)
+
+    def process(self, frame):
+        self._samples = numpy.concatenate((self._samples, frame))
+        while len(self._samples) >= self._window_size:
+            window = self._samples[:self._window_size]
+            features = self._frame_features(
+                window.astype(numpy.float64)[numpy.newaxis, :])
+            self._history[:-1] = self._history[1:]
+            self._history[-1] = features[0]
+            self._frames_seen += 1
+            self._samples = self._samples[self.frame_size:]
+
+        self._until_check -= 1
+        if self._until_check > 0:
+            return None
+        self._until_check = self.CHECK_INTERVAL
+
+        best_keyword, best_distance = None, self.threshold
+        for keyword, template in self._templates:
+            # Ignore templates longer than the audio seen so far
+            if len(template) > self._frames_seen:
+                continue
+            history = self._history[-min(len(self._history),
+                                         self._frames_seen):]
+            distance = self.match(template, history)
+            if distance < best_distance:
+                best_keyword, best_distance = keyword, distance
+        if best_keyword is not None:
+            self._logger.debug("Spotted keyword '%s' (distance: %.3f)",
+                               best_keyword, best_distance)
+            self.reset()
+        return best_keyword
+
+    def reset(self):
+        self._samples = numpy.zeros(0, dtype=numpy.int16)
+        self._history.fill(0)
+        self._frames_seen = 0
+        self._until_check = self.CHECK_INTERVAL
+
+
+def get_default_engine_slug():
+    return PocketSphinxKWS.SLUG
+
+
+def get_engine_by_slug(slug=None):
+    """
+    Returns:
+        A KWS engine implementation available on the current platform
+
+    Raises:
+        ValueError if no KWS engine implementation is available for slug
+    """
+    if not slug or type(slug) is not str:
+        raise ValueError("Invalid slug '%s'" % slug)
+    return _registry.get_engine(slug)
+
+
+def get_engines():
+    return _registry.get_engines()
+
+
+_registry = registry.EngineRegistry(AbstractKWSEngine, 'kws')
@@ -0,0 +1,154 @@
+# -*- coding: utf-8-*-
+"""
+A tiny in-process metrics registry.
+
+Counters and timing samples are kept in memory, so that the different parts
+of Jasper (capture, STT, TTS...) can report what they are doing without
+depending on an external monitoring system. Use snapshot() or log() to
+inspect them, or a Reporter to log them periodically.
+"""
+import time
+import logging
+import threading
+import contextlib
+import collections
+
+
+class Metrics(object):
+
+    def __init__(self, max_samples=1000):
+        """
+        Arguments:
+            max_samples -- number of recent samples kept per distribution
+        """
+        self._lock = threading.Lock()
+        self._max_samples = max_samples
+        self._counters = collections.defaultdict(float)
+        self._samples = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = collections.deque(
+                    maxlen=self._max_samples)
+            self._samples[name].append(value)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Observes the wall-clock seconds spent in the with block.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def last(self, name):
+        """
+        Returns:
+            The most recent sample of a distribution, or None
+        """
+        with self._lock:
+            samples = self._samples.get(name)
+            return samples[-1] if samples else None
+
+    def summary(self, name):
+        """
+        Returns:
+            A dict with count, mean, p50, p95 and p99 of a distribution, or
+            None if nothing has been observed yet
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(name, []))
+        if not samples:
+            return None
+
+        def percentile(p):
+            idx = int(round(p / 100.0 * (len(samples) - 1)))
+            return samples[idx]
+
+        return {'count': len(samples),
+                'mean': sum(samples) / float(len(samples)),
+                'p50': percentile(50),
+                'p95': percentile(95),
+                'p99': percentile(99)}
+
+    def snapshot(self):
+        """
+        Returns:
+            A dict with all counters and the summaries of all distributions
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            names = list(self._samples.keys())
+        return {'counters': counters,
+                'distributions': dict((name, self.summary(name))
+                                      for name in names)}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._samples.clear()
+
+    def log(self, logger=None, level=logging.INFO):
+        logger = logger or logging.getLogger(__name__)
+        snapshot = self.snapshot()
+        for name, value in sorted(snapshot['counters'].items()):
+            logger.log(level, "%s: %g", name, value)
+        for name, summary in sorted(snapshot['distributions'].items()):
+            logger.log(level, "%s: n=%d mean=%.4f p50=%.4f p95=%.4f " +
+                       "p99=%.4f", name, summary['count'], summary['mean'],
+                       summary['p50'], summary['p95'], summary['p99'])
+
+
+class Reporter(threading.Thread):
+    """
+    Logs all metrics of a registry every few seconds.
+    """
+
+    def __init__(self, interval, registry=None, logger=None,
+                 level=logging.INFO):
+        """
+        Arguments:
+            interval -- seconds between two summaries
+            registry -- (optional) the Metrics to log (Default: the shared
+                        registry of this module)
+            logger -- (optional) the logger to log to
+            level -- level of the log messages
+        """
+        super(Reporter, self).__init__(name='MetricsReporter')
+        self.daemon = True
+        self.interval = interval
+        self.registry = registry if registry is not None else _registry
+        self.logger = logger
+        self.level = level
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.registry.log(self.logger, self.level)
+
+    def stop(self):
+        self._stopped.set()
+
+
+_registry = Metrics()
+
+increment = _registry.increment
+observe = _registry.observe
+timer = _registry.timer
+counter = _registry.counter
+last = _registry.last
+summary = _registry.summary
+snapshot = _registry.snapshot
+reset = _registry.reset
+log = _registry.log
@@ -3,79 +3,566 @@
 """
     The Mic class handles all interactions with the microphone and speaker.
 """
+import collections
 import logging
-import tempfile
-import wave
-import audioop
+import threading
+import time
+import numpy
 import pyaudio
 import alteration
 import jasperpath
-import os
+import metrics
+import presynth
+import resample
+import sentences
 import speech_recognition as sr
-import time
+from audiocapture import CaptureStream, negotiate_rate
+from audiooutput import AudioCue, OutputStream
+from echo import PlaybackGate
+from calibration import CalibrationStore
+from vad import VoiceActivityDetector, Endpointer
 
 #logging.basicConfig(level=logging.DEBUG)
 
+# A recorded command: its audio and, for streaming engines, the
+# TranscriptionStream that has been fed with it
+Utterance = collections.namedtuple('Utterance', ['audio', 'stream'])
+
+
 class Mic:
 
     speechRec = None
     speechRec_persona = None
-   
-    def __init__(self, speaker, stt_engine):
+
+    # Number of VAD frames processed at once
+    BLOCK_FRAMES = 10
+    # Seconds of audio kept before and after the detected speech
+    PADDING = 0.3
+    # Seconds of speech the speech filter checks before a streaming upload
+    # starts
+    STREAM_HOLD_BACK = 0.3
+
+    # Capture rates tried if none is configured, after the one preferred
+    # by the STT engine
+    CAPTURE_RATES = (16000, 48000, 32000, 44100, 22050, 8000)
+
+    def __init__(self, speaker, stt_engine, capture=None, input_device=0,
+                 sample_rate=None, channels=1, lookback=1.0, kws_engine=None,
+                 silence_timeout=1.0, output=None, output_device=None,
+                 rescorer=None, speech_filter=None, tts_cache=None):
         """
         Initiates the pocketsphinx instance.
 
         Arguments:
         speaker -- handles platform-independent audio output
-        passive_stt_engine -- performs STT while Jasper is in passive listen
-                              mode
-        acive_stt_engine -- performs STT while Jasper is in active listen mode
+        stt_engine -- performs STT of the captured audio
+        capture -- (optional) a CaptureStream to share with another Mic
+                   (e.g. a nested mode), instead of opening a new one
+        input_device -- index of the input device (Default: 0)
+        sample_rate -- (optional) capture sample rate in Hz, negotiated
+                       with the device if not set
+        channels -- number of channels of the input device, they're
+                    downmixed to mono (Default: 1)
+        lookback -- seconds of audio captured before active listening
+                    started that may be included in the recording
+                    (Default: 1.0)
+        kws_engine -- (optional) a KWS engine class that spots the keyword
+                      offline during passive listen, instead of sending
+                      everything to stt_engine
+        silence_timeout -- seconds of silence that end an utterance
+                           (Default: 1.0)
+        output -- (optional) an OutputStream to share with another Mic
+        output_device -- (optional) index or name of the output device,
+                         overrides the one configured by the audio section
+                         of the profile
+        rescorer -- (optional) a rescoring.Rescorer that reranks the n-best
+                    hypotheses of the STT engine
+        speech_filter -- (optional) a speechfilter.SpeechFilter that keeps
+                         recordings which aren't speech from being
+                         transcribed
+        tts_cache -- (optional) a ttscache.AudioCache of synthesized
+                     phrases
         """
         self._logger = logging.getLogger(__name__)
         self.speaker = speaker
         self.stt_engine = stt_engine
-        self._logger.info("Initializing PyAudio. ALSA/Jack error messages " +
-                          "that pop up during this process are normal and " +
-                          "can usually be safely ignored.")
-        self._audio = pyaudio.PyAudio()
-        self._logger.info("Initialization of PyAudio completed.")
-       
-        
+        self._audio = None
+        if capture is None:
+            self._logger.info("Initializing PyAudio. ALSA/Jack error " +
+                              "messages that pop up during this process " +
+                              "are normal and can usually be safely " +
+                              "ignored.")
+            self._audio = pyaudio.PyAudio()
+            self._logger.info("Initialization of PyAudio completed.")
+            if sample_rate is None:
+                candidates = list(self.CAPTURE_RATES)
+                if stt_engine.SAMPLE_RATE:
+                    candidates.insert(0, stt_engine.SAMPLE_RATE)
+                sample_rate = negotiate_rate(self._audio, input_device,
+                                             candidates, channels=channels)
+            self._logger.info("Capturing at %d Hz", sample_rate)
+            capture = CaptureStream(self._audio, device_index=input_device,
+                                    rate=sample_rate, channels=channels)
+            capture.start()
+            output_kwargs = {}
+            if output_device is not None:
+                output_kwargs['device_index'] = output_device
+            output = OutputStream.get_instance(self._audio, **output_kwargs)
+        self.capture = capture
+        self.output = output
+        # Decode the audio cues once, they're played from memory
+        self._cues = {}
+        for name in ('beep_hi', 'beep_lo'):
+            self._cues[name] = AudioCue.from_file(
+                jasperpath.data('audio', '%s.wav' % name))
+        # Time at which the keyword was last spotted
+        self._wake_time = None
+        # Keywords of the last passive listen, spotted during playback
+        self._keywords = None
+        # Keyword said while Jasper was speaking, not handled yet
+        self._barge_in = None
+        # Echo coupling learned by the playback gate
+        self._echo_coupling = 1.0
+        self.lookback = lookback
+        # Capture position at which the last passive listen stopped
+        self._passive_end = None
+        self.kws_engine = kws_engine
+        self._spotters = {}
+        self.silence_timeout = silence_timeout
+        self.rescorer = rescorer
+        self.speech_filter = speech_filter
+        self.tts_cache = tts_cache
+        # Serializes the use of the STT engine (and its session) and of the
+        # speech filter, so that an utterance can be transcribed while the
+        # next one is being captured
+        self._stt_lock = threading.RLock()
+        # The noise floor of the VAD is kept across all listens and
+        # restarts of Jasper
+        self._calibration = CalibrationStore()
+        self._device_name = self.capture.device_name
+        noise_floor = self._calibration.get(self._device_name,
+                                            self.capture.rate)
+        if noise_floor is not None:
+            self._logger.debug("Loaded noise floor %.1f for device '%s'",
+                               noise_floor, self._device_name)
+        self._vad = VoiceActivityDetector(self.capture.rate,
+                                          noise_floor=noise_floor)
+
+    def close(self):
+        """
+        Saves the calibration and closes the capture stream, if this Mic
+        owns it.
+        """
+        if hasattr(self, '_vad'):
+            self._updateCalibration()
+            self._calibration.save()
+        if self._audio is not None:
+            self.output.close()
+            self.capture.close()
+            self._audio.terminate()
+            self._audio = None
+
     def __del__(self):
-        self._audio.terminate()
-        
-
-    def passiveListen(self, PERSONA,LISTEN_TIME = 5, THRESHOLD_TIME = 5):
-		"""
-		First the function listen for a number of seconds (THRESHOLD_TIME) 
-		to allow to establish threshold.
-		Listens for PERSONA in everyday sound. Times out after LISTEN_TIME, so
-		needs to be restarted.
-		"""
-		r = sr.Recognizer()
-		r.dynamic_energy_threshold = True
-		m = sr.Microphone(device_index=0, sample_rate=44100)
-		
-		with m as source:	
-			try:
-				audio = r.listen(m, timeout=LISTEN_TIME)
-				mensaje = self.stt_engine.transcribe(audio)
-				fraseInterpretada = mensaje.encode('utf-8')
-				self._logger.debug(fraseInterpretada)
-			except sr.WaitTimeoutError:
-				print("No se ha escuchado nada")
-				fraseInterpretada = ""
-			
-		if PERSONA in fraseInterpretada:
-			self._logger.debug("localizada palabra clave")
-		
-			return (r.energy_threshold, PERSONA)
-		
-		return (r.energy_threshold, None)
-		
-		
-			
-        
+        self.close()
+
+    def _playCue(self, name):
+        """
+        Plays an audio cue without waiting for it to finish.
+        """
+        if self.output is not None:
+            return self.output.play_cue(self._cues[name])
+        self.speaker.play(jasperpath.data('audio', '%s.wav' % name))
+
+    def _onWake(self, wake_time):
+        """
+        Called as soon as the keyword has been spotted. The STT engine
+        connects to its server while the user is still speaking.
+        """
+        self._wake_time = wake_time
+        self.stt_engine.preconnect()
+
+    def _updateCalibration(self):
+        self._calibration.update(self._device_name, self.capture.rate,
+                                 self._vad.noise_floor)
+
+    def _calibrate(self, seconds):
+        """
+        Learns the noise floor from seconds of ambient audio.
+        """
+        self._logger.info("Calibrating noise floor for %d seconds...",
+                          seconds)
+        block = self._vad.frame_size * self.BLOCK_FRAMES
+        with self.capture.subscribe() as reader:
+            for i in range(max(1, int(seconds * self.capture.rate) // block)):
+                self._vad.process(numpy.frombuffer(reader.read(block),
+                                                   dtype=numpy.int16))
+        self._logger.debug("Noise floor is %.1f", self._vad.noise_floor)
+        self._updateCalibration()
+
+    def passiveListen(self, PERSONA, LISTEN_TIME=5, THRESHOLD_TIME=5,
+                      interrupt=None):
+        """
+        First the function listen for a number of seconds (THRESHOLD_TIME)
+        to allow to establish threshold.
+        Listens for PERSONA in everyday sound. Times out after LISTEN_TIME, so
+        needs to be restarted.
+
+        PERSONA may also be a list of keywords, in which case the one that
+        has been said is returned.
+
+        If the threading.Event interrupt is set meanwhile, listening stops
+        as if nothing had been said.
+        """
+        self._keywords = [PERSONA] if isinstance(PERSONA, basestring) \
+            else list(PERSONA)
+        if self._barge_in is not None:
+            # The keyword has been said while Jasper was speaking
+            keyword, self._barge_in = self._barge_in, None
+            return (self._vad.threshold, keyword)
+
+        if self._vad.noise_floor is None:
+            # Nothing stored for this device yet
+            self._calibrate(THRESHOLD_TIME)
+
+        if self.kws_engine is not None:
+            try:
+                self._getSpotter(self._keywords)
+            except (ValueError, RuntimeError, IOError):
+                # Unknown keywords, or a broken acoustic model or dictionary
+                self._logger.warning("KWS engine '%s' can't spot %s, " +
+                                     "every utterance will be sent to the " +
+                                     "STT engine while listening " +
+                                     "passively.", self.kws_engine.SLUG,
+                                     self._keywords, exc_info=True)
+                self.kws_engine = None
+        if self.kws_engine is not None:
+            return self._spotKeyword(PERSONA, LISTEN_TIME, interrupt)
+
+        with self.capture.subscribe() as reader:
+            try:
+                audio = self._listen(reader, LISTEN_TIME,
+                                     interrupt=interrupt)
+                self._passive_end = reader.position
+                mensaje = self._filtered(audio, self._transcribe, u"")
+                fraseInterpretada = mensaje.encode('utf-8')
+                self._logger.debug(fraseInterpretada)
+            except sr.WaitTimeoutError:
+                print("No se ha escuchado nada")
+                fraseInterpretada = ""
+            except sr.RequestError as e:
+                self._logger.warning("Transcription failed: %s", e)
+                fraseInterpretada = ""
+
+        for keyword in self._keywords:
+            if isinstance(keyword, unicode):
+                keyword_text = keyword.encode('utf-8')
+            else:
+                keyword_text = keyword
+            if keyword_text in fraseInterpretada:
+                self._logger.debug("localizada palabra clave '%s'",
+                                   keyword_text)
+                self._onWake(time.time())
+                return (self._vad.threshold, keyword)
+
+        return (self._vad.threshold, None)
+
+    def _listen(self, reader, timeout, phrase_limit=None, on_audio=None,
+                interrupt=None, playback=None):
+        """
+        Records a single utterance from a CaptureReader, using the VAD to
+        find where it starts and ends.
+
+        Arguments:
+            reader -- the CaptureReader to read from
+            timeout -- seconds to wait for speech to start
+            phrase_limit -- (optional) maximum utterance length in seconds
+            on_audio -- (optional) called with the raw audio of the
+                        utterance as soon as it has been captured, before
+                        the end of the utterance is known
+            interrupt -- (optional) a threading.Event that stops waiting for
+                         speech to start. An utterance that has already
+                         started is always recorded to its end.
+            playback -- (optional) a Playback whose echo is suppressed
+                        before the VAD gets the audio, e.g. an audio cue
+
+        Returns:
+            A speech_recognition.AudioData instance
+
+        Raises:
+            speech_recognition.WaitTimeoutError if nobody started speaking
+            within timeout seconds or before interrupt was set
+        """
+        rate = self.capture.rate
+        width = self.capture.frame_width
+        frame_size = self._vad.frame_size
+        endpointer = Endpointer(self._vad,
+                                silence_timeout=self.silence_timeout,
+                                max_duration=phrase_limit)
+        gate = None
+        if playback is not None:
+            gate = PlaybackGate(playback.samples, playback.rate,
+                                channels=playback.channels,
+                                coupling=self._echo_coupling,
+                                floor=self._vad.noise_floor)
+        padding = int(self.PADDING * rate) // frame_size
+        frame_bytes = frame_size * width
+        captured = bytearray()
+        # Frame up to which the utterance has been passed to on_audio
+        sent = None
+        while True:
+            data = reader.read(frame_size * self.BLOCK_FRAMES)
+            # Audio captured before the playback started is never echo
+            if gate is not None and playback.started is not None:
+                block = numpy.frombuffer(data, dtype=numpy.int16)
+                t = time.time() - playback.started - \
+                    float(self.capture.position - reader.position +
+                          len(block)) / rate
+                data = gate.process_block(block, t, rate,
+                                          frame_size).tostring()
+                self._echo_coupling = gate.coupling
+            captured.extend(data)
+            if endpointer.process(numpy.frombuffer(data,
+                                                   dtype=numpy.int16)):
+                break
+            if (endpointer.state == Endpointer.WAITING and
+                    (endpointer.frames_seen * frame_size >= timeout * rate or
+                     (interrupt is not None and interrupt.is_set()))):
+                self._updateCalibration()
+                raise sr.WaitTimeoutError("listening timed out while " +
+                                          "waiting for phrase to start")
+            if on_audio is not None and endpointer.speech_start is not None:
+                if sent is None:
+                    sent = max(0, endpointer.speech_start - padding)
+                # Silence after the last speech frame is only passed on
+                # once the user goes on speaking
+                upto = min(endpointer.frames_seen,
+                           endpointer.last_speech + 1 + padding)
+                if upto > sent:
+                    on_audio(bytes(captured[sent * frame_bytes:
+                                            upto * frame_bytes]))
+                    sent = upto
+
+        # The endpoint fires silence_timeout after the speech has ended,
+        # plus the time the captured audio waited to be processed
+        lag = endpointer.endpoint_lag + \
+            float(self.capture.position - reader.position) / rate
+        metrics.observe('mic.endpoint_lag', lag)
+        self._updateCalibration()
+        self._logger.debug("Endpoint detected %.0f ms after the end of " +
+                           "speech", 1000 * lag)
+
+        first = max(0, endpointer.speech_start - padding)
+        last = min(endpointer.end, endpointer.last_speech + 1 + padding)
+        if on_audio is not None:
+            sent = first if sent is None else sent
+            if last > sent:
+                on_audio(bytes(captured[sent * frame_bytes:
+                                        last * frame_bytes]))
+        frame_data = bytes(captured[first * frame_bytes:last * frame_bytes])
+        return sr.AudioData(frame_data, rate, self.capture.sample_width)
+
+    def _resample(self, audio):
+        """
+        Resamples audio to the rate preferred by the STT engine.
+        """
+        target_rate = self.stt_engine.SAMPLE_RATE
+        if target_rate and target_rate != audio.sample_rate:
+            original_size = len(audio.frame_data)
+            start = time.clock()
+            samples = resample.resample(
+                numpy.frombuffer(audio.frame_data, dtype=numpy.int16),
+                audio.sample_rate, target_rate)
+            cpu_time = time.clock() - start
+            audio = sr.AudioData(samples.tostring(), target_rate,
+                                 audio.sample_width)
+            metrics.observe('mic.resample_cpu', cpu_time)
+            self._logger.debug("Resampled utterance to %d Hz in %.1f ms " +
+                               "CPU time (%d -> %d bytes)", target_rate,
+                               1000 * cpu_time, original_size,
+                               len(audio.frame_data))
+        metrics.observe('mic.utterance_bytes', len(audio.frame_data))
+        return audio
+
+    def _transcribe(self, audio):
+        """
+        Resamples audio to the rate preferred by the STT engine and
+        transcribes it.
+        """
+        return self.stt_engine.transcribe(self._resample(audio))
+
+    def _filtered(self, audio, transcribe, rejected):
+        """
+        Transcribes audio with transcribe(audio), unless the speech filter
+        rejects it.
+
+        Returns:
+            The transcription, or rejected if audio hasn't been transcribed
+        """
+        with self._stt_lock:
+            if self.speech_filter is None:
+                return transcribe(audio)
+            reason = self.speech_filter.check(audio)
+            if reason is None:
+                return transcribe(audio)
+            if not self.speech_filter.audit():
+                return rejected
+            result = transcribe(audio)
+            self.speech_filter.record_audit(reason, bool(result))
+            return result
+
+    def _transcribeAll(self, audio):
+        """
+        Like _transcribe(), but returns all hypotheses of the STT engine,
+        best first according to the rescorer.
+        """
+        try:
+            hypotheses = self.stt_engine.recognize_all(self._resample(audio))
+        except sr.UnknownValueError:
+            return []
+        except sr.RequestError as e:
+            self._logger.warning("Transcription failed: %s", e)
+            return []
+        self._logger.debug("Hypotheses: %r", hypotheses)
+        if self.rescorer is not None:
+            return self.rescorer.rank(hypotheses)
+        return [text for text, confidence in hypotheses if text]
+
+    def _startStream(self):
+        """
+        Starts a streaming transcription at the rate preferred by the STT
+        engine.
+
+        Returns:
+            A tuple of the TranscriptionStream and a function that resamples
+            and feeds captured audio to it
+        """
+        rate = self.capture.rate
+        target_rate = self.stt_engine.SAMPLE_RATE or rate
+        # Once started, the stream uploads on a connection of its own
+        with self._stt_lock:
+            stream = self.stt_engine.start_stream(
+                target_rate, sample_width=self.capture.sample_width,
+                on_partial=lambda text: self._logger.debug(
+                    "Partial hypothesis: %s", text))
+        # The chunks of a stream need their own resampler state
+        resampler = resample.PolyphaseResampler(rate, target_rate) \
+            if target_rate != rate else None
+
+        def feed(data):
+            if resampler is not None:
+                data = resampler.process(
+                    numpy.frombuffer(data, dtype=numpy.int16)).tostring()
+            stream.feed(data)
+        return stream, feed
+
+    def _startFilteredStream(self):
+        """
+        Like _startStream(), but the stream only starts once the speech
+        filter has accepted the first STREAM_HOLD_BACK seconds of speech,
+        so that a cough or a door slam isn't uploaded while it's recorded.
+        Audio the filter rejects is left to transcribeUtterance(), which
+        checks the whole utterance.
+
+        Returns:
+            A tuple of a function that returns the TranscriptionStream (None
+            if it hasn't been started) and a function that feeds captured
+            audio to it
+        """
+        if self.speech_filter is None:
+            stream, feed = self._startStream()
+            return (lambda: stream), feed
+        hold_back = int((self.PADDING + self.STREAM_HOLD_BACK) *
+                        self.capture.rate) * self.capture.frame_width
+        held = bytearray()
+        state = {'stream': None, 'feed': None, 'rejected': False}
+
+        def feed(data):
+            if state['feed'] is not None:
+                state['feed'](data)
+                return
+            if state['rejected']:
+                return
+            held.extend(data)
+            if len(held) < hold_back:
+                return
+            reason = self.speech_filter.classifier.classify(
+                numpy.frombuffer(bytes(held), dtype=numpy.int16),
+                self.capture.rate)
+            if reason is not None:
+                self._logger.debug("Not streaming the utterance, it " +
+                                   "starts like a non-speech recording " +
+                                   "(%s)", reason)
+                metrics.increment('mic.stream_held_back')
+                state['rejected'] = True
+                return
+            state['stream'], state['feed'] = self._startStream()
+            state['feed'](bytes(held))
+        return (lambda: state['stream']), feed
+
+    def _finishStream(self, stream):
+        """
+        Waits for the final hypothesis of a streaming transcription.
+        """
+        start = time.time()
+        try:
+            mensaje = stream.finish()
+        except sr.UnknownValueError:
+            mensaje = ""
+        except sr.RequestError as e:
+            self._logger.warning("Streaming transcription failed: %s", e)
+            mensaje = ""
+        latency = time.time() - start
+        metrics.observe('mic.stream_final_latency', latency)
+        metrics.observe('mic.utterance_bytes', stream.bytes_fed)
+        self._logger.debug("Final hypothesis %.0f ms after the endpoint",
+                           1000 * latency)
+        return mensaje
+
+    def _getSpotter(self, keywords):
+        key = tuple(sorted(keyword.upper() for keyword in keywords))
+        if key not in self._spotters:
+            self._spotters[key] = self.kws_engine.get_instance(
+                keywords, self.capture.rate)
+        return self._spotters[key]
+
+    def _spotKeyword(self, PERSONA, LISTEN_TIME, interrupt=None):
+        """
+        Runs the offline keyword spotter on the captured audio for up to
+        LISTEN_TIME seconds or until interrupt is set. Nothing is sent to
+        the STT engine.
+        """
+        keywords = [PERSONA] if isinstance(PERSONA, basestring) \
+            else list(PERSONA)
+        by_name = dict((keyword.upper(), keyword) for keyword in keywords)
+        spotter = self._getSpotter(keywords)
+        spotter.reset()
+
+        # Keep the noise floor of the VAD up to date meanwhile
+        vad_block = self._vad.frame_size * self.BLOCK_FRAMES
+        vad_pending = numpy.zeros(0, dtype=numpy.int16)
+        num_frames = int(LISTEN_TIME * self.capture.rate)
+        with self.capture.subscribe() as reader:
+            while num_frames > 0 and \
+                    (interrupt is None or not interrupt.is_set()):
+                frame = numpy.frombuffer(reader.read(spotter.frame_size),
+                                         dtype=numpy.int16)
+                num_frames -= spotter.frame_size
+                vad_pending = numpy.concatenate((vad_pending, frame))
+                if len(vad_pending) >= vad_block:
+                    self._vad.process(vad_pending)
+                    vad_pending = vad_pending[:0]
+                keyword = spotter.process(frame)
+                if keyword is not None:
+                    self._onWake(time.time())
+                    self._updateCalibration()
+                    self._passive_end = reader.position
+                    self._logger.debug("localizada palabra clave '%s'",
+                                       keyword)
+                    return (self._vad.threshold,
+                            by_name.get(keyword, keyword))
+        self._updateCalibration()
+        return (self._vad.threshold, None)
+
     def activeListen(self, THRESHOLD=None, LISTEN_TIME=5, MUSIC=False):
         """
             Records until a second of silence or times out after 12 seconds
@@ -87,40 +574,196 @@ class Mic:
         if options:
             return options[0]
 
-    def activeListenToAllOptions(self, threshold , listen_time=5,
+    def activeListenToAllOptions(self, threshold, listen_time=5,
                                  MUSIC=False):
-		"""
-			Records until a second of silence or times out after 12 seconds
-		
-			Returns a list of the matching options or None
-		"""
-		
-		self.speaker.play(jasperpath.data('audio', 'beep_hi.wav'))
-		
-		r = sr.Recognizer()
-		r.dynamic_energy_threshold = True
-		m = sr.Microphone(device_index=0, sample_rate=44100)
-		
-		with m as source:
-			
-			try:
-				audio = r.listen(m, timeout=listen_time)
-				self.speaker.play(jasperpath.data('audio', 'beep_lo.wav'))
-				mensaje = self.stt_engine.transcribe(audio)
-				fraseInterpretada = mensaje.encode('utf-8')
-				self._logger.debug(fraseInterpretada)
-				print(fraseInterpretada)
-				return fraseInterpretada
-			except sr.WaitTimeoutError:
-				print("No se ha escuchado nada")
-				return ""
+        """
+            Records until a second of silence or times out after 12 seconds
+
+            Returns a list of the matching options, most likely first, which
+            is empty if nothing has been understood
+        """
+        utterance = self.recordUtterance(threshold, listen_time)
+        if utterance is None:
+            return []
+        return self.transcribeUtterance(utterance)
+
+    def recordUtterance(self, threshold, listen_time=5):
+        """
+        Records the command said after the keyword, without waiting for its
+        transcription. Streaming engines get the audio while it's being
+        recorded, as soon as the speech filter has accepted its beginning.
+
+        Returns:
+            An Utterance for transcribeUtterance(), or None if nothing has
+            been said within listen_time seconds
+        """
+        self._barge_in = None
+
+        # The beep is played while we're already recording, its echo is
+        # suppressed so that it doesn't start the utterance
+        cue = self._playCue('beep_hi')
+
+        # Only fall back to the given threshold if the VAD hasn't
+        # calibrated itself yet
+        if self._vad.noise_floor is None and threshold:
+            self._vad.threshold = threshold
+
+        # Start where passive listening stopped, so that whatever was said
+        # right after the keyword (or during the beep) isn't lost
+        with self.capture.subscribe(start=self._passive_end,
+                                    lookback=self.lookback) as reader:
+            self._passive_end = None
+            if self._wake_time is not None:
+                delay = time.time() - self._wake_time
+                self._wake_time = None
+                metrics.observe('mic.wake_to_record', delay)
+                self._logger.debug("Recording started %.0f ms after the " +
+                                   "keyword was detected", 1000 * delay)
+            self._logger.debug("Pre-roll saved %.0f ms: audio captured " +
+                               "before active listening started",
+                               1000.0 * reader.preroll_frames /
+                               self.capture.rate)
+            # Streaming engines recognize the utterance while it's being
+            # said, the others get it as a whole after the endpoint
+            get_stream, on_audio = lambda: None, None
+            if self.stt_engine.STREAMING:
+                get_stream, on_audio = self._startFilteredStream()
+            try:
+                audio = self._listen(reader, listen_time, on_audio=on_audio,
+                                     playback=cue)
+            except sr.WaitTimeoutError:
+                if get_stream() is not None:
+                    get_stream().cancel()
+                print("No se ha escuchado nada")
+                return None
+
+        self._playCue('beep_lo')
+        return Utterance(audio, get_stream())
+
+    def transcribeUtterance(self, utterance):
+        """
+        Safe to call while another utterance is being captured, the STT
+        engine is only used by one thread at a time.
+
+        Returns:
+            The transcriptions of an Utterance, most likely first, empty if
+            nothing has been understood
+        """
+        if utterance.stream is not None:
+            mensaje = self._filtered(
+                utterance.audio,
+                lambda audio: self._finishStream(utterance.stream), None)
+            if mensaje is None:
+                utterance.stream.cancel()
+            options = [mensaje] if mensaje else []
+        else:
+            options = self._filtered(utterance.audio, self._transcribeAll, [])
+        options = [option.encode('utf-8') if isinstance(option, unicode)
+                   else option for option in options]
+        if options:
+            fraseInterpretada = options[0]
+            self._logger.debug(fraseInterpretada)
+            print(fraseInterpretada)
+        return options
 
     def say(self, phrase,
             OPTIONS=" -vdefault+m3 -p 40 -s 160 --stdout > say.wav"):
+        """
+        Speaks phrase. If the keyword is said meanwhile (barge-in), the
+        rest of the phrase is cancelled and the next passiveListen returns
+        immediately.
+
+        Long phrases are spoken sentence by sentence: the next sentence is
+        synthesized while the current one is playing.
+        """
+        if self._barge_in is not None:
+            self._logger.debug("Not saying '%s', the user interrupted", phrase)
+            return
         # alter phrase before speaking
         phrase = alteration.clean(phrase)
-        self.speaker.say(phrase)
-        
+        if self.output is None:
+            self.speaker.say(phrase)
+            return
+        player = sentences.SentencePlayer(self._synthesize, self.output)
+        playbacks = player.play(sentences.split(phrase))
+        played = False
+        try:
+            for playback in playbacks:
+                played = True
+                if self.kws_engine is None or not self._keywords:
+                    playback.wait()
+                else:
+                    self._spotDuringPlayback(playback)
+                if self._barge_in is not None:
+                    break
+        finally:
+            playbacks.close()
+        if not played:
+            # The speaker can't synthesize
+            self.speaker.say(phrase)
+
+    def _synthesize(self, phrase):
+        """
+        Returns:
+            The synthesized phrase from the cache if possible, or None if
+            the speaker can't synthesize
+        """
+        key = None
+        if self.tts_cache is not None:
+            key = self.tts_cache.get_key(self.speaker, phrase)
+            synthesized = self.tts_cache.get(key)
+            if synthesized is not None:
+                self._logger.debug("Saying '%s' from the cache", phrase)
+                return synthesized
+        # Phrases synthesized in advance wait meanwhile
+        with presynth.foreground():
+            synthesized = self.speaker.synthesize(phrase)
+        if synthesized is not None and key is not None:
+            self.tts_cache.put(key, *synthesized)
+        return synthesized
+
+    def _spotDuringPlayback(self, playback):
+        """
+        Runs the keyword spotter on the captured audio until playback has
+        finished, suppressing the echo of the playback itself. Cancels the
+        playback as soon as a keyword is spotted.
+        """
+        spotter = self._getSpotter(self._keywords)
+        spotter.reset()
+        by_name = dict((keyword.upper(), keyword)
+                       for keyword in self._keywords)
+        gate = PlaybackGate(playback.samples, playback.rate,
+                            channels=playback.channels,
+                            coupling=self._echo_coupling)
+        rate = float(self.capture.rate)
+        with self.capture.subscribe() as reader:
+            while not playback.done:
+                frame = numpy.frombuffer(reader.read(spotter.frame_size),
+                                         dtype=numpy.int16)
+                if playback.started is None:
+                    continue
+                # Capture time of the frame, relative to the playback
+                t = time.time() - playback.started - \
+                    (self.capture.position - reader.position) / rate
+                keyword = spotter.process(gate.process(frame, t))
+                if keyword is None:
+                    continue
+                detected = time.time()
+                self.output.stop()
+                playback.wait()
+                latency = time.time() - detected
+                metrics.observe('mic.barge_in_latency', latency)
+                self._logger.info("Keyword '%s' spotted while speaking, " +
+                                  "playback stopped within %.0f ms",
+                                  keyword, 1000 * latency)
+                self._barge_in = by_name.get(keyword, keyword)
+                self._passive_end = reader.position
+                self._onWake(detected)
+                break
+        self._echo_coupling = gate.coupling
+        self._logger.debug("Playback gate passed %d and suppressed %d " +
+                           "frames", gate.passed, gate.suppressed)
+
 if __name__ == "__main__":
-	
-	pass
+
+    pass
@@ -2,6 +2,12 @@
 import random
 import re
 
+ANSWER = "No me se ningun chiste, soy de Lepe"
+
+# Everything this module says, synthesized in advance
+PHRASES = [ANSWER]
+
+
 def handle(text, mic, profile):
     """
         Responds to user-input, typically speech text, by telling a joke.
@@ -12,7 +18,7 @@ def handle(text, mic, profile):
         profile -- contains information related to the user (e.g., phone
                    number)
     """
-    mic.say("No me se ningun chiste, soy de Lepe")
+    mic.say(ANSWER)
 
    
 
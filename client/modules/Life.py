@@ -2,6 +2,12 @@
 import random
 import re
 
+ANSWER = "Es 42, raúl hiperbólico ñoño"
+
+# Everything this module says, synthesized in advance
+PHRASES = [ANSWER]
+
+
 def handle(text, mic, profile):
     """
         Responds to user-input, typically speech text, by relaying the
@@ -13,7 +19,7 @@ def handle(text, mic, profile):
         profile -- contains information related to the user (e.g., phone
                    number)
     """
-    mic.say("Es 42, raúl hiperbólico ñoño")
+    mic.say(ANSWER)
 
 
 def isValid(text):
@@ -75,11 +75,12 @@ class MusicMode(object):
                    "PLAYLIST"]
         phrases.extend(self.music.get_soup_playlist())
 
-        music_stt_engine = mic.active_stt_engine.get_instance('music', phrases)
+        music_stt_engine = mic.stt_engine.get_instance('music', phrases)
 
-        self.mic = Mic(mic.speaker,
-                       mic.passive_stt_engine,
-                       music_stt_engine)
+        # Share the capture and output streams of the main loop instead of
+        # reopening the audio devices
+        self.mic = Mic(mic.speaker, music_stt_engine, capture=mic.capture,
+                       output=mic.output, kws_engine=mic.kws_engine)
 
     def delegateInput(self, input):
 
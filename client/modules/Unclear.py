@@ -6,6 +6,13 @@ WORDS = []
 
 PRIORITY = -(maxint + 1)
 
+MESSAGES = ["Perdone, lo lo entiendo , ¿puede repetirlo?",
+            "Lo siento, ¿Podria repetirlo?",
+            "Digalo otra vez por favor", "¿Perdon?"]
+
+# Everything this module says, synthesized in advance
+PHRASES = MESSAGES
+
 
 def handle(text, mic, profile):
     """
@@ -18,11 +25,7 @@ def handle(text, mic, profile):
                    number)
     """
 
-    messages = ["Perdone, lo lo entiendo , ¿puede repetirlo?",
-                "Lo siento, ¿Podria repetirlo?",
-                "Digalo otra vez por favor", "¿Perdon?"]
-
-    message = random.choice(messages)
+    message = random.choice(MESSAGES)
 
     mic.say(message)
 
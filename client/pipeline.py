@@ -0,0 +1,286 @@
+# -*- coding: utf-8-*-
+"""
+Runs a conversation as a pipeline of concurrent stages:
+
+    capture -> utterances -> transcription -> commands -> conversation loop
+                                                   speech <- phrases <-'
+
+Capture keeps listening for the keyword while the previous command is still
+being transcribed or handled, so a quick follow-up command isn't lost. The
+stages are connected by bounded queues: a stage that gets too far ahead
+blocks until the next one catches up (backpressure). stop() cancels all
+stages, including their blocked queue operations.
+
+Modules use the mic themselves (to speak and to ask questions), so the
+conversation loop and the speech stage take the mic over with exclusive(),
+which interrupts capture while it's only waiting for the keyword.
+"""
+import contextlib
+import logging
+import threading
+import time
+import Queue
+import metrics
+
+
+class Cancelled(Exception):
+    """
+    Raised by the queues of a pipeline that has been stopped.
+    """
+    pass
+
+
+class StageQueue(object):
+    """
+    A bounded queue whose blocking operations give up once the pipeline is
+    cancelled.
+    """
+
+    # Seconds between two checks for cancellation while blocked
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, name, maxsize, cancelled):
+        """
+        Arguments:
+            name -- used in the metrics, e.g. 'utterances'
+            maxsize -- number of items the queue holds before put() blocks
+            cancelled -- a threading.Event set when the pipeline stops
+        """
+        self._logger = logging.getLogger(__name__)
+        self.name = name
+        self.cancelled = cancelled
+        self._queue = Queue.Queue(maxsize)
+
+    def put(self, item):
+        """
+        Raises:
+            Cancelled if the pipeline stops while the queue is full
+        """
+        start = time.time()
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled()
+            try:
+                self._queue.put(item, timeout=self.POLL_INTERVAL)
+                break
+            except Queue.Full:
+                continue
+        waited = time.time() - start
+        if waited >= self.POLL_INTERVAL:
+            self._logger.debug("Queue '%s' was full for %.0f ms", self.name,
+                               1000 * waited)
+            metrics.observe('pipeline.%s.blocked' % self.name, waited)
+        metrics.observe('pipeline.%s.depth' % self.name, self._queue.qsize())
+
+    def get(self, timeout=None):
+        """
+        Returns:
+            The next item, or None if timeout seconds have passed
+
+        Raises:
+            Cancelled if the pipeline stops while the queue is empty
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled()
+            wait = self.POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return None
+            try:
+                return self._queue.get(timeout=wait)
+            except Queue.Empty:
+                continue
+
+    def drain(self):
+        """
+        Returns:
+            The items left in the queue, which is empty afterwards
+        """
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except Queue.Empty:
+                return items
+
+
+class Stage(threading.Thread):
+    """
+    Runs process() in a loop: with the items of the input queue, or without
+    arguments if it has none (a source). Results other than None are put
+    in the output queue, if any.
+    """
+
+    def __init__(self, name, process, cancelled, input=None, output=None):
+        super(Stage, self).__init__(name='Pipeline-%s' % name)
+        self.daemon = True
+        self._logger = logging.getLogger(__name__)
+        self.stage_name = name
+        self.process = process
+        self.cancelled = cancelled
+        self.input = input
+        self.output = output
+
+    def run(self):
+        while not self.cancelled.is_set():
+            try:
+                if self.input is not None:
+                    item = self.input.get()
+                    with metrics.timer('pipeline.%s.time' % self.stage_name):
+                        result = self.process(item)
+                else:
+                    result = self.process()
+                if result is not None and self.output is not None:
+                    self.output.put(result)
+            except Cancelled:
+                break
+            except Exception:
+                # A failed item must not take the whole stage down
+                metrics.increment('pipeline.%s.errors' % self.stage_name)
+                self._logger.error("Stage '%s' failed", self.stage_name,
+                                   exc_info=True)
+        self._logger.debug("Stage '%s' stopped", self.stage_name)
+
+
+class ConversationPipeline(object):
+
+    # Queued for transcription if the keyword was said but no command
+    # followed, so that the conversation asks again
+    NOTHING_SAID = object()
+
+    def __init__(self, mic, persona, max_utterances=2, max_commands=2,
+                 max_phrases=8, listen_time=5):
+        """
+        Arguments:
+            mic -- the Mic to listen and speak with
+            persona -- the keyword
+            max_utterances -- recorded commands waiting for transcription
+            max_commands -- transcribed commands waiting to be handled
+            max_phrases -- phrases waiting to be spoken
+            listen_time -- seconds to listen for a command after the keyword
+        """
+        self._logger = logging.getLogger(__name__)
+        self.mic = mic
+        self.persona = persona
+        self.listen_time = listen_time
+        self._cancelled = threading.Event()
+        # Set while somebody waits for exclusive use of the mic
+        self._interrupt = threading.Event()
+        self._mic_lock = threading.RLock()
+        self._exclusive = 0
+        self._exclusive_changed = threading.Condition()
+        self.utterances = StageQueue('utterances', max_utterances,
+                                     self._cancelled)
+        self.commands = StageQueue('commands', max_commands, self._cancelled)
+        self.phrases = StageQueue('phrases', max_phrases, self._cancelled)
+        self._stages = [
+            Stage('capture', self._capture, self._cancelled,
+                  output=self.utterances),
+            Stage('transcription', self._transcribe,
+                  self._cancelled, input=self.utterances,
+                  output=self.commands),
+            Stage('speech', self._speak, self._cancelled,
+                  input=self.phrases)]
+
+    def start(self):
+        for stage in self._stages:
+            stage.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Cancels all stages and waits for them to finish. Commands that
+        haven't been transcribed yet are dropped.
+        """
+        self._cancelled.set()
+        self._interrupt.set()
+        for stage in self._stages:
+            if stage.is_alive():
+                stage.join(timeout)
+        for utterance in self.utterances.drain():
+            if utterance is not self.NOTHING_SAID and \
+                    utterance.stream is not None:
+                utterance.stream.cancel()
+        self.commands.drain()
+        self.phrases.drain()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def get_command(self, timeout=None):
+        """
+        Returns:
+            The transcriptions of the next command, most likely first and
+            empty if it hasn't been understood, or None if no command has
+            come in within timeout seconds
+
+        Raises:
+            Cancelled if the pipeline has been stopped
+        """
+        return self.commands.get(timeout)
+
+    def say(self, phrase):
+        """
+        Queues phrase to be spoken by the speech stage.
+        """
+        self.phrases.put(phrase)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Takes the mic over, e.g. to let a module handle a command. Capture
+        is interrupted unless it's already recording a command, and only
+        goes on afterwards.
+        """
+        with self._exclusive_changed:
+            self._exclusive += 1
+            self._interrupt.set()
+        try:
+            with self._mic_lock:
+                yield self.mic
+        finally:
+            with self._exclusive_changed:
+                self._exclusive -= 1
+                if not self._exclusive and not self._cancelled.is_set():
+                    self._interrupt.clear()
+                    self._exclusive_changed.notify_all()
+
+    def _capture(self):
+        with self._exclusive_changed:
+            while self._exclusive and not self._cancelled.is_set():
+                self._exclusive_changed.wait(StageQueue.POLL_INTERVAL)
+        with self._mic_lock:
+            if self._interrupt.is_set():
+                return None
+            threshold, keyword = self.mic.passiveListen(
+                self.persona, interrupt=self._interrupt)
+            if not keyword or not threshold:
+                return None
+            self._logger.info("Keyword '%s' has been said!", self.persona)
+            # The user is about to speak, so the command is recorded even
+            # if somebody is waiting for the mic
+            utterance = self.mic.recordUtterance(threshold, self.listen_time)
+            if utterance is None:
+                return self.NOTHING_SAID
+            return utterance
+
+    def _transcribe(self, utterance):
+        # Doesn't need the mic lock, the mic serializes the use of the STT
+        # engine itself
+        if utterance is self.NOTHING_SAID:
+            return []
+        return self.mic.transcribeUtterance(utterance)
+
+    def _speak(self, phrase):
+        with self.exclusive():
+            self.mic.say(phrase)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8-*-
+"""
+Synthesizes the fixed phrases of Jasper in advance.
+
+Modules declare what they say with a PHRASES attribute, next to WORDS:
+
+    PHRASES = ["No me se ningun chiste, soy de Lepe"]
+
+At start-up the PreSynthesizer collects them and synthesizes every phrase
+that isn't cached yet into the ttscache.AudioCache, in a few low priority
+background threads, while Jasper is already listening. Mic.say then finds
+them in the cache the first time they're needed.
+
+Lowering the priority of the threads doesn't help with engines that
+synthesize in another process (e.g. the festival server), and a background
+phrase holds the engine while it's synthesized. So the threads also give way
+to phrases Jasper has to say right away: those are synthesized within
+foreground(), and the PreSynthesizer doesn't start a sentence until nothing
+has been synthesized in the foreground for a while.
+"""
+import contextlib
+import logging
+import os
+import platform
+import threading
+import time
+import Queue
+import metrics
+import sentences
+
+
+def get_phrases_from_module(module):
+    """
+    Returns:
+        The list of fixed phrases module says
+    """
+    return list(module.PHRASES) if hasattr(module, 'PHRASES') else []
+
+
+def get_phrases(modules):
+    """
+    Arguments:
+        modules -- modules (or classes) with a PHRASES attribute
+
+    Returns:
+        The phrases of all modules, without duplicates
+    """
+    phrases = []
+    for module in modules:
+        for phrase in get_phrases_from_module(module):
+            if phrase not in phrases:
+                phrases.append(phrase)
+    return phrases
+
+
+class ForegroundActivity(object):
+    """
+    Tracks the syntheses of phrases that are said right away.
+    """
+
+    # Seconds between two checks whether waiting has been stopped
+    POLL_INTERVAL = 0.1
+
+    def __init__(self):
+        self._active = 0
+        # Time at which the last synthesis has finished
+        self._last = 0
+        self._changed = threading.Condition()
+
+    @contextlib.contextmanager
+    def active(self):
+        with self._changed:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._active -= 1
+                self._last = time.time()
+                self._changed.notify_all()
+
+    def wait_idle(self, quiet, stopped=None):
+        """
+        Blocks until nothing has been synthesized in the foreground for quiet
+        seconds, or until stopped is set.
+
+        Arguments:
+            quiet -- seconds without foreground synthesis to wait for
+            stopped -- (optional) a threading.Event that ends the wait
+
+        Returns:
+            The number of seconds waited
+        """
+        start = time.time()
+        with self._changed:
+            while stopped is None or not stopped.is_set():
+                timeout = self.POLL_INTERVAL
+                if not self._active:
+                    remaining = self._last + quiet - time.time()
+                    if remaining <= 0:
+                        break
+                    timeout = min(timeout, remaining)
+                self._changed.wait(timeout)
+        return time.time() - start
+
+
+_foreground = ForegroundActivity()
+
+foreground = _foreground.active
+
+
+class PreSynthesizer(object):
+
+    def __init__(self, speaker, cache, workers=1, niceness=10, pause=0.1,
+                 quiet=1.0, activity=None):
+        """
+        Arguments:
+            speaker -- the TTS engine instance
+            cache -- the ttscache.AudioCache to synthesize into
+            workers -- number of threads
+            niceness -- added to the nice value of the threads (Linux only,
+                        where each thread has its own)
+            pause -- seconds to wait between two phrases, so that phrases
+                     Jasper has to say right away don't queue up behind a
+                     batch of background ones
+            quiet -- seconds without foreground synthesis before the next
+                     sentence is synthesized in the background
+            activity -- (optional) the ForegroundActivity to give way to
+                        (Default: the one of foreground())
+        """
+        self._logger = logging.getLogger(__name__)
+        self.speaker = speaker
+        self.cache = cache
+        self.workers = workers
+        self.niceness = niceness
+        self.pause = pause
+        self.quiet = quiet
+        self.activity = activity if activity is not None else _foreground
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._stopped = threading.Event()
+
+    def start(self, phrases):
+        """
+        Queues phrases and starts the threads, returns immediately.
+        """
+        for phrase in phrases:
+            self._queue.put(phrase)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run,
+                                      name='PreSynthesizer-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        """
+        Waits until all phrases have been synthesized.
+        """
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _lower_priority(self):
+        if self.niceness and platform.system() == 'Linux':
+            try:
+                os.nice(self.niceness)
+            except OSError:
+                pass
+
+    def _run(self):
+        self._lower_priority()
+        while not self._stopped.is_set():
+            try:
+                phrase = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                # Mic.say synthesizes (and caches) sentence by sentence
+                for sentence in sentences.split(phrase):
+                    waited = self.activity.wait_idle(self.quiet,
+                                                     self._stopped)
+                    if waited >= ForegroundActivity.POLL_INTERVAL:
+                        metrics.observe('presynth.yielded', waited)
+                    if self._stopped.is_set():
+                        break
+                    self._synthesize(sentence)
+            except Exception:
+                metrics.increment('presynth.errors')
+                self._logger.warning("Could not synthesize '%s' in advance",
+                                     phrase, exc_info=True)
+            self._stopped.wait(self.pause)
+
+    def _synthesize(self, phrase):
+        key = self.cache.get_key(self.speaker, phrase)
+        if key in self.cache:
+            metrics.increment('presynth.cached')
+            return
+        start = time.time()
+        synthesized = self.speaker.synthesize(phrase)
+        if synthesized is None:
+            # The engine can only speak, not synthesize
+            self._stopped.set()
+            return
+        self.cache.put(key, *synthesized)
+        metrics.increment('presynth.synthesized')
+        metrics.observe('presynth.time', time.time() - start)
+        self._logger.debug("Synthesized '%s' in advance", phrase)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8-*-
+"""
+Registries of the STT, TTS and KWS engines.
+
+The engines are found by walking the subclass tree of their base class once,
+instead of on every lookup. Checking whether an engine is available can be
+slow (FestivalTTS runs festival, AttSTT connects to the network), so the
+results are cached in <CONFIG_PATH>/engines.yml for ttl seconds and engines
+are only probed when they're actually asked for:
+
+    - a fresh result is used as is
+    - an expired positive result is used as well, while the engine is
+      probed again in the background
+    - engines without a result (or with an expired negative one) are
+      probed right away, but only the requested engine
+"""
+import os
+import time
+import logging
+import threading
+import yaml
+
+import jasperpath
+import metrics
+
+
+class AvailabilityCache(object):
+
+    def __init__(self, path=None, ttl=86400):
+        """
+        Arguments:
+            path -- (optional) the cache file (Default:
+                    <CONFIG_PATH>/engines.yml)
+            ttl -- number of seconds a probe result stays fresh
+        """
+        self._logger = logging.getLogger(__name__)
+        self.path = path if path else jasperpath.config('engines.yml')
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = None
+
+    @staticmethod
+    def get_key(kind, slug):
+        return "%s.%s" % (kind, slug)
+
+    def _load(self):
+        # Called with the lock held
+        if self._data is not None:
+            return
+        self._data = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = yaml.safe_load(f)
+        except (IOError, OSError, yaml.YAMLError):
+            self._logger.warning("Could not read engine cache '%s'",
+                                 self.path, exc_info=True)
+            return
+        if isinstance(data, dict):
+            self._data = data
+
+    def get(self, kind, slug):
+        """
+        Returns:
+            A tuple (available, fresh), or None if the engine has never been
+            probed
+        """
+        with self._lock:
+            self._load()
+            entry = self._data.get(self.get_key(kind, slug))
+        if not isinstance(entry, dict) or 'available' not in entry:
+            return None
+        age = time.time() - entry.get('checked', 0)
+        return (bool(entry['available']), 0 <= age < self.ttl)
+
+    def set(self, kind, slug, available):
+        with self._lock:
+            self._load()
+            self._data[self.get_key(kind, slug)] = {
+                'available': bool(available),
+                'checked': int(time.time())}
+            data = dict(self._data)
+        self._save(data)
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+        self._save({})
+
+    def _save(self, data):
+        dirname = os.path.dirname(self.path)
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            jasperpath.atomic_write(
+                self.path,
+                lambda f: yaml.safe_dump(data, f, default_flow_style=False),
+                mode='w')
+        except (IOError, OSError):
+            self._logger.warning("Could not write engine cache '%s'",
+                                 self.path, exc_info=True)
+
+
+class EngineRegistry(object):
+
+    def __init__(self, base, kind, cache=None):
+        """
+        Arguments:
+            base -- the abstract base class of the engines
+            kind -- e.g. 'stt', used in the cache keys, metrics and errors
+            cache -- (optional) an AvailabilityCache (Default: the one
+                     shared by all registries)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.base = base
+        self.kind = kind
+        self.cache = cache if cache is not None else get_cache()
+        self._lock = threading.Lock()
+        self._engines = None
+        # Slugs of the engines that are being probed, with an event set
+        # once the probe is done
+        self._probes = {}
+
+    def _collect(self):
+        engines = {}
+        stack = list(self.base.__subclasses__())
+        while stack:
+            engine = stack.pop()
+            stack.extend(engine.__subclasses__())
+            slug = getattr(engine, 'SLUG', None)
+            if not slug:
+                continue
+            if slug in engines and engines[slug] is not engine:
+                self._logger.warning("Multiple %s engines found for slug " +
+                                     "'%s'. This is most certainly a bug.",
+                                     self.kind.upper(), slug)
+                continue
+            engines[slug] = engine
+        return engines
+
+    def refresh(self):
+        """
+        Walks the subclass tree again, e.g. after a plugin has been loaded.
+        """
+        engines = self._collect()
+        with self._lock:
+            self._engines = engines
+        return engines
+
+    def _get_map(self):
+        with self._lock:
+            engines = self._engines
+        return engines if engines is not None else self.refresh()
+
+    def get_engines(self):
+        return list(self._get_map().values())
+
+    def get_engine(self, slug, check_available=True):
+        """
+        Returns:
+            The engine class for slug
+
+        Raises:
+            ValueError if there's no such engine, or if check_available is
+            set and the engine isn't available
+        """
+        engine = self._get_map().get(slug)
+        if engine is None:
+            # Defined since the registry was built
+            engine = self.refresh().get(slug)
+        if engine is None:
+            raise ValueError("No %s engine found for slug '%s'" %
+                             (self.kind.upper(), slug))
+        if check_available and not self.is_available(engine):
+            raise ValueError(("%s engine '%s' is not available (due to " +
+                              "missing dependencies, etc.)") %
+                             (self.kind.upper(), slug))
+        return engine
+
+    def is_available(self, engine):
+        """
+        Returns:
+            Whether engine is available, from the cache if possible
+        """
+        cached = self.cache.get(self.kind, engine.SLUG)
+        if cached is not None:
+            available, fresh = cached
+            if fresh:
+                return available
+            if available:
+                self.probe_in_background([engine])
+                return True
+        return self.probe(engine)
+
+    def probe(self, engine):
+        """
+        Runs engine.is_available() and caches its result. If the engine is
+        already being probed, waits for that probe instead.
+        """
+        with self._lock:
+            done = self._probes.get(engine.SLUG)
+            if done is None:
+                done = self._probes[engine.SLUG] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            done.wait()
+            cached = self.cache.get(self.kind, engine.SLUG)
+            return cached is not None and cached[0]
+        try:
+            start = time.time()
+            try:
+                available = bool(engine.is_available())
+            except Exception:
+                self._logger.warning("Probing %s engine '%s' failed",
+                                     self.kind.upper(), engine.SLUG,
+                                     exc_info=True)
+                available = False
+            metrics.observe('registry.%s.probe_time' % self.kind,
+                            time.time() - start)
+            self._logger.debug("%s engine '%s' is %savailable",
+                               self.kind.upper(), engine.SLUG,
+                               '' if available else 'not ')
+            self.cache.set(self.kind, engine.SLUG, available)
+            return available
+        finally:
+            with self._lock:
+                del self._probes[engine.SLUG]
+            done.set()
+
+    def probe_in_background(self, engines=None):
+        """
+        Probes engines (Default: all engines whose cached result has
+        expired) in a daemon thread.
+
+        Returns:
+            The thread, or None if there's nothing to probe
+        """
+        if engines is None:
+            engines = []
+            for engine in self.get_engines():
+                cached = self.cache.get(self.kind, engine.SLUG)
+                if cached is None or not cached[1]:
+                    engines.append(engine)
+        with self._lock:
+            engines = [engine for engine in engines
+                       if engine.SLUG not in self._probes]
+        if not engines:
+            return None
+
+        def run():
+            for engine in engines:
+                self.probe(engine)
+
+        thread = threading.Thread(target=run,
+                                  name='Probe-%s' % self.kind)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns:
+        The AvailabilityCache shared by all registries
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AvailabilityCache()
+        return _cache
@@ -0,0 +1,218 @@
+# -*- coding: utf-8-*-
+"""
+Sample rate conversion and downmixing of int16 audio.
+
+The cloud STT engines only need 16 kHz (or even 8 kHz) mono audio, but
+many microphones only capture at 44.1 or 48 kHz. The PolyphaseResampler
+converts between any two integer rates with a precomputed polyphase
+windowed-sinc filter bank, block by block, so it can also be used on a
+stream of chunks.
+"""
+import logging
+import fractions
+import threading
+import numpy
+
+_resamplers = {}
+_resamplers_lock = threading.Lock()
+
+
+def downmix(samples, channels):
+    """
+    Averages interleaved multi-channel samples into mono.
+
+    Arguments:
+        samples -- a numpy int16 array of interleaved samples
+        channels -- number of channels
+
+    Returns:
+        A numpy int16 array
+    """
+    if channels == 1:
+        return samples
+    frames = samples[:len(samples) // channels * channels]
+    return frames.reshape(-1, channels).mean(axis=1).astype(numpy.int16)
+
+
+class PolyphaseResampler(object):
+
+    def __init__(self, from_rate, to_rate, taps_per_phase=24, cutoff=0.9,
+                 beta=8.0):
+        """
+        Arguments:
+            from_rate -- input sample rate in Hz
+            to_rate -- output sample rate in Hz
+            taps_per_phase -- filter length per polyphase branch, more taps
+                              give a steeper anti-aliasing filter
+            cutoff -- cutoff frequency relative to the lower Nyquist rate
+            beta -- beta of the Kaiser window
+        """
+        self._logger = logging.getLogger(__name__)
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        gcd = fractions.gcd(from_rate, to_rate)
+        self.up = to_rate // gcd
+        self.down = from_rate // gcd
+        self.taps = taps_per_phase
+
+        # Lowpass prototype, running at from_rate * up
+        length = self.taps * self.up
+        fc = 0.5 * cutoff / max(self.up, self.down)
+        t = numpy.arange(length) - (length - 1) / 2.0
+        prototype = 2 * fc * numpy.sinc(2 * fc * t) * \
+            numpy.kaiser(length, beta) * self.up
+        # bank[phase, k] == prototype[phase + k * up]
+        self._bank = prototype.reshape(self.taps, self.up).T.copy()
+        self._offsets = numpy.arange(self.taps)
+        self.reset()
+
+    def _initial_state(self):
+        """
+        Returns:
+            A tuple (history, next_position) for the start of a stream.
+            next_position is the position of the next output sample in the
+            upsampled domain, relative to the start of the history.
+        """
+        return (numpy.zeros(self.taps - 1), (self.taps - 1) * self.up)
+
+    def reset(self):
+        """
+        Forgets the previously processed samples.
+        """
+        self._history, self._next = self._initial_state()
+
+    def process(self, samples):
+        """
+        Resamples the next block of a stream.
+
+        Arguments:
+            samples -- a numpy int16 array
+
+        Returns:
+            A numpy int16 array
+        """
+        y, self._history, self._next = self._filter(samples, self._history,
+                                                    self._next)
+        return y
+
+    def _filter(self, samples, history, next_position):
+        """
+        Returns:
+            A tuple (output, history, next_position) with the filter state
+            after samples
+        """
+        x = numpy.concatenate((history,
+                               numpy.asarray(samples, dtype=numpy.float64)))
+        total = len(x) * self.up
+        count = max(0, (total - next_position + self.down - 1) // self.down)
+        positions = next_position + numpy.arange(count) * self.down
+        index = positions // self.up
+        phase = positions % self.up
+        windows = x[index[:, numpy.newaxis] - self._offsets]
+        y = (self._bank[phase] * windows).sum(axis=1)
+
+        consumed = len(x) - (self.taps - 1)
+        next_position += count * self.down - consumed * self.up
+        y = numpy.clip(numpy.round(y), -32768, 32767).astype(numpy.int16)
+        return (y, x[consumed:], next_position)
+
+    def resample(self, samples):
+        """
+        Resamples a whole recording. The filter state is local to the
+        call, so several threads may use it on the same instance at once.
+
+        Arguments:
+            samples -- a numpy int16 array
+
+        Returns:
+            A numpy int16 array
+        """
+        history, next_position = self._initial_state()
+        return self._filter(samples, history, next_position)[0]
+
+
+def get_resampler(from_rate, to_rate):
+    """
+    Returns:
+        A shared PolyphaseResampler for the given rates. Its filter bank is
+        only computed once. Only use resample() on shared instances,
+        process() changes their state.
+    """
+    key = (from_rate, to_rate)
+    with _resamplers_lock:
+        if key not in _resamplers:
+            _resamplers[key] = PolyphaseResampler(from_rate, to_rate)
+        return _resamplers[key]
+
+
+def resample(samples, from_rate, to_rate):
+    """
+    Resamples a whole recording.
+
+    Arguments:
+        samples -- a numpy int16 array
+        from_rate -- sample rate of samples
+        to_rate -- target sample rate
+
+    Returns:
+        A numpy int16 array
+    """
+    if from_rate == to_rate:
+        return samples
+    return get_resampler(from_rate, to_rate).resample(samples)
+
+
+if __name__ == '__main__':
+    import argparse
+    import io
+    import os
+    import time
+    import wave
+    import jasperpath
+
+    parser = argparse.ArgumentParser(description='Benchmark the resampling ' +
+                                     'of utterances before STT upload')
+    parser.add_argument('--capture-rate', type=int, default=44100,
+                        help='simulated capture rate in Hz')
+    parser.add_argument('--target-rate', type=int, default=16000,
+                        help='sample rate preferred by the STT engine')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='number of runs per utterance')
+    parser.add_argument('files', nargs='*',
+                        default=[jasperpath.data('audio', 'jasper.wav'),
+                                 jasperpath.data('audio', 'time.wav')])
+    args = parser.parse_args()
+
+    def wav_bytes(samples, rate):
+        f = io.BytesIO()
+        wav = wave.open(f, 'wb')
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tostring())
+        wav.close()
+        return len(f.getvalue())
+
+    for fname in args.files:
+        wav = wave.open(fname, 'rb')
+        samples = downmix(numpy.frombuffer(wav.readframes(wav.getnframes()),
+                                           dtype=numpy.int16),
+                          wav.getnchannels())
+        rate = wav.getframerate()
+        wav.close()
+        # What the microphone would have captured
+        captured = resample(samples, rate, args.capture_rate)
+
+        start = time.clock()
+        for i in range(args.runs):
+            converted = resample(captured, args.capture_rate,
+                                 args.target_rate)
+        cpu = (time.clock() - start) / args.runs
+
+        print("%s (%.2f s):" % (os.path.basename(fname),
+                                float(len(samples)) / rate))
+        print("  before: %7d bytes upload at %d Hz, no resampling" %
+              (wav_bytes(captured, args.capture_rate), args.capture_rate))
+        print("  after:  %7d bytes upload at %d Hz, %.2f ms CPU" %
+              (wav_bytes(converted, args.target_rate), args.target_rate,
+               cpu * 1000))
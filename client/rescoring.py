@@ -0,0 +1,108 @@
+# -*- coding: utf-8-*-
+"""
+Reranks the n-best hypotheses of an STT engine.
+
+The acoustically most likely transcription isn't always what the user said,
+e.g. 'que ora es' instead of 'que hora es'. The Rescorer prefers hypotheses
+that consist of words the modules know and that a module can handle, so
+that a close but wrong top hypothesis doesn't end up with Unclear.
+"""
+import logging
+import brain
+import vocabcompiler
+
+
+def _normalize(text):
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return text.upper()
+
+
+class Rescorer(object):
+
+    def __init__(self, phrases, modules=(), rank_penalty=0.1,
+                 vocabulary_weight=1.0, module_weight=0.5):
+        """
+        Arguments:
+            phrases -- the phrases of the command vocabulary
+            modules -- the modules whose isValid() is checked. Modules
+                       without WORDS (catch-alls like Unclear) are ignored.
+            rank_penalty -- score lost per position in the n-best list
+            vocabulary_weight -- score of a hypothesis consisting only of
+                                 vocabulary words
+            module_weight -- score of a hypothesis a module can handle
+        """
+        self._logger = logging.getLogger(__name__)
+        self.words = set()
+        for phrase in phrases:
+            self.words.update(_normalize(phrase).split())
+        self.modules = [module for module in modules
+                        if vocabcompiler.get_phrases_from_module(module)]
+        self.rank_penalty = rank_penalty
+        self.vocabulary_weight = vocabulary_weight
+        self.module_weight = module_weight
+
+    @classmethod
+    def from_modules(cls, modules=None, **kwargs):
+        """
+        Returns:
+            A Rescorer for the phrases and isValid() of modules (Default:
+            all modules in the modules folder)
+        """
+        if modules is None:
+            modules = brain.Brain.get_modules()
+            phrases = vocabcompiler.get_all_phrases()
+        else:
+            phrases = []
+            for module in modules:
+                phrases.extend(vocabcompiler.get_phrases_from_module(module))
+        return cls(phrases, modules, **kwargs)
+
+    def _is_valid(self, text):
+        for module in self.modules:
+            try:
+                if module.isValid(text):
+                    return True
+            except Exception:
+                self._logger.debug("isValid of module '%s' failed",
+                                   module.__name__, exc_info=True)
+        return False
+
+    def score(self, text, rank=0):
+        """
+        Returns:
+            The score of a hypothesis at position rank of the n-best list
+        """
+        words = _normalize(text).split()
+        if not words:
+            return float('-inf')
+        coverage = float(sum(1 for word in words if word in self.words)) / \
+            len(words)
+        score = -self.rank_penalty * rank + self.vocabulary_weight * coverage
+        if self._is_valid(text):
+            score += self.module_weight
+        return score
+
+    def rank(self, hypotheses):
+        """
+        Arguments:
+            hypotheses -- the n-best list, as returned by the
+                          recognize_all() method of an STT engine
+
+        Returns:
+            The transcriptions, best first and without duplicates
+        """
+        scored = []
+        seen = set()
+        for rank, (text, confidence) in enumerate(hypotheses):
+            key = _normalize(text).strip()
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            scored.append((self.score(text, rank), rank, text))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        if scored and scored[0][1] != 0:
+            self._logger.debug("Preferred hypothesis %d '%s' over '%s'",
+                               scored[0][1], scored[0][2],
+                               hypotheses[0][0])
+        return [text for score, rank, text in scored]
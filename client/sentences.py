@@ -0,0 +1,153 @@
+# -*- coding: utf-8-*-
+"""
+Speaks long texts sentence by sentence.
+
+Synthesizing a long text (e.g. the headlines read by News or Noticias) as a
+whole takes a while, and nothing can be heard until it's done. The
+SentencePlayer splits the text at sentence and pause boundaries and
+synthesizes the sentences one after the other in a background thread. Each
+one is queued on the OutputStream as soon as it's ready, which plays queued
+buffers back to back: the first sentence starts playing while the next ones
+are synthesized, and there are no gaps as long as synthesis is faster than
+playback.
+"""
+import logging
+import re
+import threading
+import time
+import Queue
+import metrics
+
+# A sentence or pause ends with punctuation (including '...' and '…')
+# followed by whitespace
+_BOUNDARY = re.compile(u'(?<=[.!?;…])\\s+', re.UNICODE)
+
+
+def split(text, min_chars=20):
+    """
+    Splits text into sentences.
+
+    Arguments:
+        text -- a unicode or an UTF-8 encoded str
+        min_chars -- sentences shorter than this are joined with the next
+                     one, so that abbreviations like 'Sr. Perez' aren't
+                     split
+
+    Returns:
+        A list of sentences, of the same type as text
+    """
+    encoded = isinstance(text, str)
+    if encoded:
+        text = text.decode('utf-8')
+    sentences = []
+    pending = u''
+    for part in _BOUNDARY.split(text.strip()):
+        pending = pending + u' ' + part if pending else part
+        if len(pending) >= min_chars:
+            sentences.append(pending)
+            pending = u''
+    if pending:
+        sentences.append(pending)
+    if encoded:
+        sentences = [sentence.encode('utf-8') for sentence in sentences]
+    return sentences
+
+
+class SentencePlayer(object):
+
+    def __init__(self, synthesize, output, lookahead=2):
+        """
+        Arguments:
+            synthesize -- returns a tuple (samples, rate, channels) for a
+                          sentence, or None if it can't be synthesized
+            output -- the audiooutput.OutputStream to play on
+            lookahead -- number of sentences queued for playback ahead of
+                         the one playing
+        """
+        self._logger = logging.getLogger(__name__)
+        self.synthesize = synthesize
+        self.output = output
+        self.lookahead = lookahead
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stops synthesizing and queueing sentences. Sentences already queued
+        on the output stream have to be stopped there.
+        """
+        self._cancelled.set()
+
+    def play(self, sentences):
+        """
+        Synthesizes and queues sentences in a background thread.
+
+        Yields:
+            The Playback handle of each sentence, in order, as soon as it
+            has been queued. Nothing is yielded for sentences that couldn't
+            be synthesized.
+        """
+        start = time.time()
+        cancelled = self._cancelled = threading.Event()
+        # Bounded, so that the thread doesn't get further ahead than
+        # lookahead sentences
+        handles = Queue.Queue(max(1, self.lookahead))
+        done = object()
+
+        def run():
+            previous = None
+            try:
+                for sentence in sentences:
+                    if cancelled.is_set():
+                        break
+                    synthesized = self.synthesize(sentence)
+                    if synthesized is None or cancelled.is_set():
+                        continue
+                    if previous is not None and previous.done and \
+                            not previous.cancelled:
+                        # The output ran dry while this one was synthesized
+                        metrics.increment('mic.say.gaps')
+                    previous = self.output.play(*synthesized)
+                    while True:
+                        if cancelled.is_set():
+                            # Nobody is going to wait for it
+                            previous.cancel()
+                            break
+                        try:
+                            handles.put(previous, timeout=0.1)
+                            break
+                        except Queue.Full:
+                            continue
+            except Exception:
+                self._logger.error("Failed to synthesize a sentence",
+                                   exc_info=True)
+            finally:
+                handles.put(done)
+
+        thread = threading.Thread(target=run, name='SentencePlayer')
+        thread.daemon = True
+        thread.start()
+        first = None
+        try:
+            while True:
+                playback = handles.get()
+                if playback is done:
+                    break
+                if first is None:
+                    first = playback
+                yield playback
+        finally:
+            # Also when the caller stops early, e.g. after a barge-in
+            self.cancel()
+            while thread.is_alive():
+                try:
+                    handles.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+            # The caller has waited for the first sentence meanwhile
+            if first is not None and first.started is not None:
+                latency = first.started - start
+                metrics.observe('mic.say.first_audio', latency)
+                if len(sentences) > 1:
+                    metrics.observe('mic.say.first_audio_long', latency)
+                self._logger.debug("First audio of %d sentence(s) after " +
+                                   "%.0f ms", len(sentences), 1000 * latency)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8-*-
+"""
+Rejects recordings that aren't speech before they're sent to the STT engine.
+
+Coughs, door slams or a burst of TV noise picked up while listening cost a
+round trip and API quota each time they're transcribed. The SpeechClassifier
+looks at a few cheap features of the whole recording:
+
+    duration   -- too short for a word, or longer than any command
+    clipping   -- share of samples at full scale; clipped audio is mostly
+                  transcribed as garbage
+    band ratio -- share of the energy in the speech band (300-3400 Hz)
+    flatness   -- spectral flatness of the loud frames in the speech band;
+                  noise and bangs have a flat spectrum, voiced speech a
+                  peaky one
+
+To find out how often speech is thrown away, the SpeechFilter still sends a
+small share of the rejected recordings to the STT engine (an audit). Those
+that turn out to contain words are counted as false rejects, which gives an
+estimate of the false reject rate. All counts are exported via metrics.
+"""
+import collections
+import logging
+import random
+import time
+import numpy
+import jasperconfig
+import metrics
+
+# Reasons for rejecting a recording
+TOO_SHORT = 'too_short'
+TOO_LONG = 'too_long'
+CLIPPED = 'clipped'
+OUT_OF_BAND = 'out_of_band'
+NOISE = 'noise'
+
+Features = collections.namedtuple('Features', ['duration', 'clipping',
+                                               'band_ratio', 'flatness'])
+
+
+class SpeechClassifier(object):
+
+    def __init__(self, min_duration=0.2, max_duration=20.0,
+                 band=(300.0, 3400.0), min_band_ratio=0.5, max_clipping=0.01,
+                 max_flatness=0.45, frame_duration=0.025, loud_share=0.5):
+        """
+        Arguments:
+            min_duration -- shortest speech in seconds
+            max_duration -- longest speech in seconds
+            band -- the speech band in Hz
+            min_band_ratio -- minimum share of the energy in the speech band
+            max_clipping -- maximum share of clipped samples
+            max_flatness -- maximum median spectral flatness of the loud
+                            frames, between 0 (a pure tone) and 1 (white
+                            noise)
+            frame_duration -- frame length of the spectral analysis in
+                              seconds
+            loud_share -- share of the frames, the loudest ones, that the
+                          spectral features are computed on. The rest is
+                          mostly the silence around the speech.
+        """
+        self._logger = logging.getLogger(__name__)
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.band = band
+        self.min_band_ratio = min_band_ratio
+        self.max_clipping = max_clipping
+        self.max_flatness = max_flatness
+        self.frame_duration = frame_duration
+        self.loud_share = loud_share
+        # Window and speech band mask per sample rate
+        self._analysis = {}
+
+    def _get_analysis(self, rate):
+        if rate not in self._analysis:
+            frame_size = int(round(rate * self.frame_duration))
+            freqs = numpy.fft.rfftfreq(frame_size, 1.0 / rate)
+            in_band = (freqs >= self.band[0]) & (freqs <= self.band[1])
+            self._analysis[rate] = (frame_size, numpy.hanning(frame_size),
+                                    in_band)
+        return self._analysis[rate]
+
+    def features(self, samples, rate):
+        """
+        Arguments:
+            samples -- a numpy int16 array
+            rate -- sample rate in Hz
+
+        Returns:
+            The Features of samples. band_ratio and flatness are None if
+            samples is shorter than a frame.
+        """
+        duration = float(len(samples)) / rate
+        if not len(samples):
+            return Features(duration, 0.0, None, None)
+        clipping = numpy.mean(numpy.abs(samples.astype(numpy.int32)) >=
+                              32767 - 2 ** 8)
+
+        frame_size, window, in_band = self._get_analysis(rate)
+        num = len(samples) // frame_size
+        if not num:
+            return Features(duration, clipping, None, None)
+        frames = samples[:num * frame_size].reshape(num, frame_size)
+        frames = frames.astype(numpy.float64)
+        energy = numpy.sum(frames ** 2, axis=1)
+        loud = max(1, int(round(num * self.loud_share)))
+        frames = frames[numpy.argsort(energy)[-loud:]]
+        # Without DC, which says nothing about the content
+        power = numpy.abs(numpy.fft.rfft(frames * window, axis=1)) ** 2
+        power = power[:, 1:] + 1e-10
+        band_ratio = numpy.sum(power[:, in_band[1:]]) / numpy.sum(power)
+        # Within the speech band, so that band limited noise (e.g. a
+        # telephone line) isn't taken for a peaky spectrum
+        power = power[:, in_band[1:]]
+        flatness = numpy.exp(numpy.mean(numpy.log(power), axis=1)) / \
+            numpy.mean(power, axis=1)
+        return Features(duration, clipping, float(band_ratio),
+                        float(numpy.median(flatness)))
+
+    def classify(self, samples, rate):
+        """
+        Returns:
+            None if samples may be speech, otherwise the reason for
+            rejecting them (TOO_SHORT, TOO_LONG, CLIPPED, OUT_OF_BAND or
+            NOISE)
+        """
+        features = self.features(samples, rate)
+        self._logger.debug("Recording features: %r", features)
+        if features.duration < self.min_duration:
+            return TOO_SHORT
+        if features.duration > self.max_duration:
+            return TOO_LONG
+        if features.clipping > self.max_clipping:
+            return CLIPPED
+        if features.band_ratio is None:
+            return TOO_SHORT
+        if features.band_ratio < self.min_band_ratio:
+            return OUT_OF_BAND
+        if features.flatness > self.max_flatness:
+            return NOISE
+        return None
+
+
+class SpeechFilter(object):
+
+    def __init__(self, classifier=None, audit_rate=0.05, seed=None):
+        """
+        Arguments:
+            classifier -- (optional) the SpeechClassifier
+            audit_rate -- share of the rejected recordings that are
+                          transcribed anyway, to estimate the false reject
+                          rate
+            seed -- (optional) seed of the audit sampling
+        """
+        self._logger = logging.getLogger(__name__)
+        self.classifier = classifier if classifier is not None \
+            else SpeechClassifier()
+        self.audit_rate = audit_rate
+        self._random = random.Random(seed)
+        self.accepted = 0
+        self.rejected = collections.Counter()
+        self.audited = 0
+        self.false_rejects = 0
+
+    @classmethod
+    def get_config(cls):
+        section = jasperconfig.get_section('speech_filter')
+        config = {}
+        if 'audit_rate' in section:
+            config['audit_rate'] = float(section['audit_rate'])
+        classifier = {}
+        for key in ('min_duration', 'max_duration', 'min_band_ratio',
+                    'max_clipping', 'max_flatness'):
+            if key in section:
+                classifier[key] = float(section[key])
+        config['classifier'] = SpeechClassifier(**classifier)
+        return config
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns:
+            A SpeechFilter configured by the speech_filter section of the
+            profile, or None if it has been disabled there
+        """
+        if not jasperconfig.get_section('speech_filter').get('enabled',
+                                                             True):
+            return None
+        return cls(**cls.get_config())
+
+    def check(self, audio):
+        """
+        Arguments:
+            audio -- a speech_recognition.AudioData with 16 bit samples
+
+        Returns:
+            None if audio should be transcribed, otherwise the reason for
+            rejecting it
+        """
+        start = time.time()
+        reason = self.classifier.classify(
+            numpy.frombuffer(audio.frame_data, dtype=numpy.int16),
+            audio.sample_rate)
+        metrics.observe('speechfilter.time', time.time() - start)
+        if reason is None:
+            self.accepted += 1
+            metrics.increment('speechfilter.accepted')
+        else:
+            self.rejected[reason] += 1
+            metrics.increment('speechfilter.rejected')
+            metrics.increment('speechfilter.rejected.%s' % reason)
+            self._logger.debug("Rejected recording: %s", reason)
+        return reason
+
+    def audit(self):
+        """
+        Returns:
+            Whether a rejected recording should be transcribed anyway. Its
+            result has to be passed to record_audit().
+        """
+        return self._random.random() < self.audit_rate
+
+    def record_audit(self, reason, recognized):
+        """
+        Arguments:
+            reason -- the reason the recording had been rejected for
+            recognized -- whether the STT engine has found words in it
+        """
+        self.audited += 1
+        metrics.increment('speechfilter.audited')
+        if recognized:
+            self.false_rejects += 1
+            metrics.increment('speechfilter.false_rejects')
+            metrics.increment('speechfilter.false_rejects.%s' % reason)
+            self._logger.info("Rejected recording (%s) contained speech",
+                              reason)
+        metrics.observe('speechfilter.false_reject_rate',
+                        self.false_reject_rate)
+
+    @property
+    def false_reject_rate(self):
+        """
+        Returns:
+            The share of the audited recordings that contained speech, or
+            None if none has been audited yet
+        """
+        if not self.audited:
+            return None
+        return float(self.false_rejects) / self.audited
+
+    def stats(self):
+        """
+        Returns:
+            A dict of the counts, including the estimated number of false
+            rejects among all rejected recordings
+        """
+        rejected = sum(self.rejected.values())
+        rate = self.false_reject_rate
+        return {'accepted': self.accepted,
+                'rejected': dict(self.rejected),
+                'audited': self.audited,
+                'false_rejects': self.false_rejects,
+                'false_reject_rate': rate,
+                'estimated_false_rejects': rate * rejected
+                if rate is not None else None}
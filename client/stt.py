@@ -9,15 +9,212 @@ import urllib
 import urlparse
 import re
 import subprocess
+import audioop
+import threading
+import time
+import Queue
+import collections
 from abc import ABCMeta, abstractmethod
 import requests
-import yaml
 import jasperpath
+import jasperconfig
 import diagnose
 import vocabcompiler
+import metrics
+import upload
+import keepalive
+import health
+import registry
 import speech_recognition as sr
 
 
+class TranscriptionStream(object):
+    """
+    A transcription in progress. Audio is fed chunk by chunk while the user
+    is still speaking, partial hypotheses are reported as they come in and
+    finish() returns the final one.
+    """
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, rate, sample_width=2, on_partial=None):
+        """
+        Arguments:
+            rate -- sample rate of the fed audio in Hz
+            sample_width -- bytes per sample of the fed audio
+            on_partial -- (optional) called with every new partial
+                          hypothesis
+        """
+        self._logger = logging.getLogger(__name__)
+        self.rate = rate
+        self.sample_width = sample_width
+        self.on_partial = on_partial
+        self.partial = None
+        self.bytes_fed = 0
+
+    @abstractmethod
+    def feed(self, data):
+        """
+        Queues the next chunk of raw PCM audio and returns immediately.
+        """
+        pass
+
+    @abstractmethod
+    def finish(self):
+        """
+        Signals the end of the utterance and waits for the result.
+
+        Returns:
+            The final hypothesis
+
+        Raises:
+            speech_recognition.UnknownValueError if nothing was recognized
+            speech_recognition.RequestError if the engine failed
+        """
+        pass
+
+    def cancel(self):
+        """
+        Drops the transcription, e.g. because nobody said anything.
+        """
+        pass
+
+    def _set_partial(self, text):
+        if text and text != self.partial:
+            self.partial = text
+            if self.on_partial is not None:
+                self.on_partial(text)
+
+
+class BufferedTranscriptionStream(TranscriptionStream):
+    """
+    Adapter for engines that can only transcribe whole utterances: the fed
+    audio is buffered and transcribed at once by finish().
+    """
+
+    def __init__(self, engine, rate, sample_width=2, on_partial=None):
+        super(BufferedTranscriptionStream, self).__init__(
+            rate, sample_width=sample_width, on_partial=on_partial)
+        self.engine = engine
+        self._chunks = []
+
+    def feed(self, data):
+        self.bytes_fed += len(data)
+        self._chunks.append(data)
+
+    def finish(self):
+        audio = sr.AudioData(b''.join(self._chunks), self.rate,
+                             self.sample_width)
+        self._chunks = []
+        return self.engine.recognize(audio)[0]
+
+    def cancel(self):
+        self._chunks = []
+
+
+class HTTPTranscriptionStream(TranscriptionStream):
+    """
+    Streams audio to a server speaking the protocol of sttserver.py:
+
+        POST   /v1/streams?rate=..&language=..  -> {"id": ...}
+        POST   /v1/streams/<id>/audio            -> {"partial": ...}
+        POST   /v1/streams/<id>/finish           -> {"final": ...}
+        DELETE /v1/streams/<id>
+
+    The chunks are uploaded from a background thread, so feed() never waits
+    for the network. Chunks that queue up meanwhile are sent together.
+    """
+
+    def __init__(self, session, url, rate, sample_width=2, language=None,
+                 on_partial=None, timeout=10):
+        """
+        Arguments:
+            session -- the requests.Session to use
+            url -- base URL of the server
+            language -- (optional) language of the utterance
+            timeout -- seconds to wait for each request
+        """
+        super(HTTPTranscriptionStream, self).__init__(
+            rate, sample_width=sample_width, on_partial=on_partial)
+        self._session = session
+        self.url = url.rstrip('/')
+        self.language = language
+        self.timeout = timeout
+        self.stream_id = None
+        self.requests = 0
+        self._error = None
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name='HTTPTranscriptionStream')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _post(self, path, **kwargs):
+        self.requests += 1
+        r = self._session.post(self.url + path, timeout=self.timeout,
+                               **kwargs)
+        r.raise_for_status()
+        return r.json()
+
+    def _run(self):
+        try:
+            params = {'rate': self.rate, 'width': self.sample_width}
+            if self.language:
+                params['language'] = self.language
+            self.stream_id = self._post('/v1/streams', params=params)['id']
+            done = False
+            while not done:
+                chunks = [self._queue.get()]
+                while chunks[-1] is not None:
+                    try:
+                        chunks.append(self._queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                if chunks[-1] is None:
+                    done = True
+                    chunks.pop()
+                if chunks:
+                    result = self._post('/v1/streams/%s/audio' %
+                                        self.stream_id,
+                                        data=b''.join(chunks))
+                    self._set_partial(result.get('partial'))
+        except (requests.exceptions.RequestException, ValueError,
+                KeyError) as e:
+            self._logger.warning("Streaming to %s failed: %s", self.url, e)
+            self._error = e
+
+    def feed(self, data):
+        self.bytes_fed += len(data)
+        self._queue.put(data)
+
+    def finish(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise sr.RequestError("streaming failed; {0}".format(
+                self._error))
+        try:
+            result = self._post('/v1/streams/%s/finish' % self.stream_id)
+            final = result['final']
+        except (requests.exceptions.RequestException, ValueError,
+                KeyError) as e:
+            raise sr.RequestError("recognition failed; {0}".format(e))
+        if not final:
+            raise sr.UnknownValueError()
+        return final
+
+    def cancel(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.stream_id is None:
+            return
+        try:
+            self._session.delete('%s/v1/streams/%s' % (self.url,
+                                                       self.stream_id),
+                                 timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            pass
+
 
 class AbstractSTTEngine(object):
     """
@@ -26,21 +223,23 @@ class AbstractSTTEngine(object):
 
     __metaclass__ = ABCMeta
     VOCABULARY_TYPE = None
+    # Sample rate the engine works best with. Captured audio is resampled
+    # to it before transcription, None means the capture rate is used.
+    SAMPLE_RATE = None
+    # True if the engine recognizes the audio while it's being captured,
+    # instead of waiting for the whole utterance
+    STREAMING = False
+    # Upload formats accepted by the engine, most compact first
+    UPLOAD_FORMATS = ('wav',)
+    _encoder = None
 
     @classmethod
     def get_config(cls):
-        # FIXME: Replace this as soon as we have a config module
         config = {}
-        # HMM dir
-        # Try to get hmm_dir from config
-        profile_path = jasperpath.config('profile.yml')
-     
-        if os.path.exists(profile_path):
-            with open(profile_path, 'r') as f:
-                profile = yaml.safe_load(f)
-                if 'keys' in profile :
-                    config['userName'] = profile['keys']['USER']
-                    config['password'] = profile['keys']['PASS']
+        keys = jasperconfig.get_section('keys')
+        if keys:
+            config['userName'] = keys['USER']
+            config['password'] = keys['PASS']
         return config
 
     @classmethod
@@ -73,41 +272,190 @@ class AbstractSTTEngine(object):
 
     @abstractmethod
     def transcribe(self, fp):
+        """
+        Returns:
+            The transcription, empty if nothing was recognized
+
+        Raises:
+            speech_recognition.RequestError if the engine failed
+        """
         pass
 
+    def recognize(self, audio):
+        """
+        Like transcribe(), but an utterance without any recognized speech
+        is an error as well.
+
+        Returns:
+            A tuple of the transcription and its confidence between 0 and 1,
+            or None if the engine doesn't report one
+
+        Raises:
+            speech_recognition.UnknownValueError if nothing was recognized
+            speech_recognition.RequestError if the engine failed
+        """
+        transcription = self.transcribe(audio)
+        if not transcription:
+            raise sr.UnknownValueError()
+        return transcription, None
+
+    def recognize_all(self, audio):
+        """
+        Like recognize(), but returns the alternative transcriptions as
+        well, if the engine provides them.
+
+        Returns:
+            The n-best list as list of (transcription, confidence) tuples,
+            most likely first
+
+        Raises:
+            speech_recognition.UnknownValueError if nothing was recognized
+            speech_recognition.RequestError if the engine failed
+        """
+        return [self.recognize(audio)]
+
+    def preconnect(self):
+        """
+        Connects to the server of the engine in the background, so that an
+        upload following soon doesn't have to wait for the handshake.
+        """
+        pass
+
+    def prepare_upload(self, audio):
+        """
+        Trims the silence around an utterance and encodes it in the most
+        compact of UPLOAD_FORMATS.
+
+        Returns:
+            A tuple of the encoded audio and its content type
+        """
+        if self._encoder is None:
+            self._encoder = upload.UploadEncoder(self.UPLOAD_FORMATS)
+        return self._encoder.encode(audio)
+
+    def start_stream(self, rate, sample_width=2, on_partial=None):
+        """
+        Starts a streaming transcription. Engines that can't stream
+        transcribe the buffered audio once the stream is finished.
+
+        Arguments:
+            rate -- sample rate of the audio in Hz
+            sample_width -- bytes per sample
+            on_partial -- (optional) called with every partial hypothesis
+
+        Returns:
+            A TranscriptionStream
+        """
+        return BufferedTranscriptionStream(self, rate,
+                                           sample_width=sample_width,
+                                           on_partial=on_partial)
+
 
 class Ibm(AbstractSTTEngine):
 
     SLUG = 'IBM'
+    SAMPLE_RATE = 16000
+    UPLOAD_FORMATS = ('flac', 'wav')
+    URL = 'https://stream.watsonplatform.net/speech-to-text/api/v1/recognize'
 
-    def __init__(self, userName=None,password =None, language='es-ES'):
+    def __init__(self, userName=None,password =None, language='es-ES',
+                 timeout=10, nbest=5, url=None):
         """
         Arguments:
         api_key - the public api key which allows access to Google APIs
+        nbest - number of alternatives requested per utterance
+        url - (optional) the recognize endpoint, e.g. of sttserver.py
         """
         self._logger = logging.getLogger(__name__)
+        self.userName = userName
+        self.password = password
         self.language = language
-  
+        self.timeout = timeout
+        self.nbest = nbest
+        self.url = url if url else self.URL
+        self._session = keepalive.KeepAliveSession('stt.ibm')
+
+    @classmethod
+    def get_config(cls):
+        config = super(Ibm, cls).get_config()
+        section = jasperconfig.get_section('ibm_stt')
+        for key in ('url', 'language', 'timeout', 'nbest'):
+            if key in section:
+                config[key] = section[key]
+        return config
+
+    def preconnect(self):
+        self._session.preconnect(self.url)
+
+    def recognize(self, audio):
+        """
+        Performs STT via the IBM Speech API.
+        """
+        return self.recognize_all(audio)[0]
+
+    def recognize_all(self, audio):
+        data, content_type = self.prepare_upload(audio)
+        params = {'profanity_filter': 'false',
+                  'model': '%s_BroadbandModel' % self.language,
+                  'inactivity_timeout': -1,
+                  'max_alternatives': self.nbest}
+        headers = {'Content-Type': content_type,
+                   'X-Watson-Learning-Opt-Out': 'true'}
+        try:
+            start = time.time()
+            r = self._session.post(self.url, params=params, data=data,
+                                   headers=headers,
+                                   auth=(self.userName, self.password),
+                                   timeout=self.timeout)
+            r.raise_for_status()
+            elapsed = time.time() - start
+            metrics.observe('upload.time', elapsed)
+            self._logger.debug("Uploaded %d bytes in %.0f ms", len(data),
+                               1000 * elapsed)
+            return self._parse_response(r.json())
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise sr.RequestError(e)
+
     def transcribe(self, audio):
-		"""
-		Performs STT via the IBM Speech API, transcribing an audio file and
-		returning an Spanish string.
-		"""
-		r = sr.Recognizer()
-	
-		config = self.get_config()
-		IBM_USERNAME = config['userName'] 
-		IBM_PASSWORD = config['password'] 
-		try:
-			mensaje = r.recognize_ibm(audio, username=IBM_USERNAME, password=IBM_PASSWORD,
-										language=self.language, show_all=False)
-		except sr.UnknownValueError:
-			mensaje = "IBM Speech to Text could not understand audio"
-		except sr.RequestError as e:
-			mensaje ="Could not request results from IBM Speech to Text service; {0}".format(e)
-		
-		finally:
-			return mensaje
+        """
+        Performs STT via the IBM Speech API, transcribing an audio file and
+        returning an Spanish string.
+        """
+        try:
+            return self.recognize(audio)[0]
+        except sr.UnknownValueError:
+            return ""
+
+    @staticmethod
+    def _parse_response(result):
+        # Every final result is a segment of the utterance with its own
+        # alternatives. The n-best list is the best transcription followed
+        # by the variants that differ from it in a single segment.
+        segments = []
+        confidences = []
+        for utterance in result.get('results', []):
+            alternatives = [hypothesis['transcript'] for hypothesis
+                            in utterance.get('alternatives', [])
+                            if 'transcript' in hypothesis]
+            if not alternatives:
+                continue
+            segments.append(alternatives)
+            for hypothesis in utterance['alternatives']:
+                if 'transcript' in hypothesis:
+                    if 'confidence' in hypothesis:
+                        confidences.append(hypothesis['confidence'])
+                    break
+        if not segments:
+            raise sr.UnknownValueError()
+        best = [segment[0] for segment in segments]
+        confidence = min(confidences) \
+            if len(confidences) == len(segments) else None
+        hypotheses = [("\n".join(best), confidence)]
+        for i, segment in enumerate(segments):
+            for alternative in segment[1:]:
+                variant = best[:i] + [alternative] + best[i + 1:]
+                hypotheses.append(("\n".join(variant), None))
+        return hypotheses
 
 
 
@@ -117,69 +465,763 @@ class AttSTT(AbstractSTTEngine):
     """
 
     SLUG = 'ATT'
-    
-    def __init__(self, userName=None,password =None, language='es-US'):
+    SAMPLE_RATE = 16000
+    # The AT&T Speech API doesn't accept FLAC
+    UPLOAD_FORMATS = ('wav',)
+    TOKEN_URL = 'https://api.att.com/oauth/v4/token'
+    URL = 'https://api.att.com/speech/v3/speechToText'
+
+    def __init__(self, userName=None,password =None, language='es-US',
+                 timeout=10, url=None, token_url=None):
         """
         Arguments:
         api_key - the public api key which allows access to Google APIs
+        url - (optional) the speechToText endpoint, e.g. of sttserver.py
+        token_url - (optional) the OAuth token endpoint
         """
         self._logger = logging.getLogger(__name__)
+        self.userName = userName
+        self.password = password
         self.language = language
-      
+        self.timeout = timeout
+        self.url = url if url else self.URL
+        self.token_url = token_url if token_url else self.TOKEN_URL
+        self._session = keepalive.KeepAliveSession('stt.att')
+        self._token = None
+        self._token_expiry = 0
+
+    @classmethod
+    def get_config(cls):
+        config = super(AttSTT, cls).get_config()
+        section = jasperconfig.get_section('att_stt')
+        for key in ('url', 'token_url', 'language', 'timeout'):
+            if key in section:
+                config[key] = section[key]
+        return config
+
+    def preconnect(self):
+        self._session.preconnect(self.url)
+
+    def _get_token(self):
+        """
+        Returns:
+            An OAuth access token, only requested again when the previous
+            one expires
+        """
+        if self._token is None or time.time() >= self._token_expiry:
+            r = self._session.post(self.token_url, data={
+                'client_id': self.userName,
+                'client_secret': self.password,
+                'grant_type': 'client_credentials',
+                'scope': 'SPEECH'}, timeout=self.timeout)
+            r.raise_for_status()
+            result = r.json()
+            self._token = result['access_token']
+            # Renew a minute early
+            self._token_expiry = time.time() + \
+                int(result.get('expires_in', 3600)) - 60
+        return self._token
+
+    def recognize(self, audio):
+        """
+        Performs STT via the AT&T Speech API.
+        """
+        return self.recognize_all(audio)[0]
+
+    def recognize_all(self, audio):
+        data, content_type = self.prepare_upload(audio)
+        try:
+            token = self._get_token()
+            start = time.time()
+            r = self._session.post(self.url, data=data, headers={
+                'Authorization': 'Bearer %s' % token,
+                'Content-Language': self.language,
+                'Content-Type': content_type}, timeout=self.timeout)
+            if r.status_code == 401:
+                # Revoked before it expired
+                self._token = None
+            r.raise_for_status()
+            elapsed = time.time() - start
+            metrics.observe('upload.time', elapsed)
+            self._logger.debug("Uploaded %d bytes in %.0f ms", len(data),
+                               1000 * elapsed)
+            return self._parse_response(r.json())
+        except (requests.exceptions.RequestException, ValueError,
+                KeyError) as e:
+            raise sr.RequestError(e)
+
     def transcribe(self, audio):
-		"""
-		Performs STT via the IBM Speech API, transcribing an audio file and
-		returning an Spanish string.
-		"""
-		r = sr.Recognizer()
-		
-		config = self.get_config()
-		ATT_APPKEY = config['userName'] 
-		ATT_APPSECRET = config['password'] 
-		try:
-			mensaje = r.recognize_att(audio, app_key=ATT_APPKEY, app_secret=ATT_APPSECRET,
-									language=self.language, show_all=False)
-		except sr.UnknownValueError:
-			mensaje = "AT&T Speech to Text could not understand audio"
-		except sr.RequestError as e:
-			mensaje ="Could not request results from IBM Speech to Text service; {0}".format(e)
-		
-		finally:
-			return mensaje
+        """
+        Performs STT via the AT&T Speech API, transcribing an audio file and
+        returning an Spanish string.
+        """
+        try:
+            return self.recognize(audio)[0]
+        except sr.UnknownValueError:
+            return ""
+
+    @staticmethod
+    def _parse_response(result):
+        # Accepted hypotheses come first, the ones the service was unsure
+        # about ('confirm') are only kept as alternatives
+        accepted = []
+        unsure = []
+        for entry in result.get('Recognition', {}).get('NBest', []):
+            if 'ResultText' not in entry or entry.get('Grade') == 'reject':
+                continue
+            hypothesis = (entry['ResultText'], entry.get('Confidence'))
+            if entry.get('Grade') == 'accept':
+                accepted.append(hypothesis)
+            else:
+                unsure.append(hypothesis)
+        if not accepted:
+            raise sr.UnknownValueError()
+        return accepted + unsure
 
     @classmethod
     def is_available(cls):
         return diagnose.check_network_connection()
 
 
+class HTTPStreamingSTT(AbstractSTTEngine):
+    """
+    Speech-To-Text implementation which streams the audio to an HTTP
+    server while the user is still speaking, e.g. the local stand-in server
+    in sttserver.py.
+    """
+
+    SLUG = 'http-streaming'
+    SAMPLE_RATE = 16000
+    STREAMING = True
+
+    def __init__(self, url='http://localhost:8765', language='es-ES',
+                 timeout=10, userName=None, password=None):
+        """
+        Arguments:
+        url -- base URL of the streaming server
+        language -- language of the utterances
+        timeout -- seconds to wait for each request
+        """
+        self._logger = logging.getLogger(__name__)
+        self.url = url.rstrip('/')
+        self.language = language
+        self.timeout = timeout
+        # Keep the connection to the server open between the chunks
+        self._session = keepalive.KeepAliveSession('stt.http-streaming')
+
+    @classmethod
+    def get_config(cls):
+        config = super(HTTPStreamingSTT, cls).get_config()
+        section = jasperconfig.get_section('http-streaming')
+        for key in ('url', 'language', 'timeout'):
+            if key in section:
+                config[key] = section[key]
+        return config
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def preconnect(self):
+        self._session.preconnect(self.url)
+
+    def start_stream(self, rate, sample_width=2, on_partial=None):
+        return HTTPTranscriptionStream(self._session, self.url, rate,
+                                       sample_width=sample_width,
+                                       language=self.language,
+                                       on_partial=on_partial,
+                                       timeout=self.timeout)
+
+    def recognize(self, audio):
+        """
+        Uploads a whole utterance at once.
+        """
+        params = {'rate': audio.sample_rate, 'width': audio.sample_width,
+                  'language': self.language}
+        try:
+            r = self._session.post(self.url + '/v1/recognize',
+                                   params=params, data=audio.frame_data,
+                                   timeout=self.timeout)
+            r.raise_for_status()
+            final = r.json()['final']
+        except (requests.exceptions.RequestException, ValueError,
+                KeyError) as e:
+            raise sr.RequestError(e)
+        if not final:
+            raise sr.UnknownValueError()
+        return final, None
+
+    def transcribe(self, audio):
+        try:
+            return self.recognize(audio)[0]
+        except sr.UnknownValueError:
+            return ""
+
+
+class PocketSphinxSTT(AbstractSTTEngine):
+    """
+    Offline Speech-To-Text implementation with pocketsphinx.
+
+    Setting up a decoder loads the acoustic and the language model, so
+    decoders are created once and reused for every utterance. Up to
+    pool_size decoders are kept, so that several utterances can be decoded
+    at the same time.
+    """
+
+    SLUG = 'sphinx'
+    VOCABULARY_TYPE = vocabcompiler.PocketsphinxVocabulary
+    # pocketsphinx acoustic models expect 16 kHz
+    SAMPLE_RATE = 16000
+
+    def __init__(self, vocabulary, hmm_dir="/usr/local/share/" +
+                 "pocketsphinx/model/hmm/en_US/hub4wsj_sc_8k", pool_size=2,
+                 userName=None, password=None):
+        """
+        Arguments:
+        vocabulary -- a compiled PocketsphinxVocabulary
+        hmm_dir -- the pocketsphinx acoustic model directory
+        pool_size -- maximum number of decoders
+        """
+        self._logger = logging.getLogger(__name__)
+        if not os.path.exists(hmm_dir):
+            raise OSError(("hmm_dir '%s' does not exist! Please make " +
+                           "sure that you have set the correct hmm_dir in " +
+                           "your profile.") % hmm_dir)
+        self.vocabulary = vocabulary
+        self.hmm_dir = hmm_dir
+        self.pool_size = max(1, pool_size)
+        self._decoders = Queue.Queue()
+        self._lock = threading.Lock()
+        # Create the first decoder right away, so that the first utterance
+        # doesn't have to wait for it
+        self._num_decoders = 1
+        self._decoders.put(self._create_decoder())
+
+    @classmethod
+    def get_config(cls):
+        config = super(PocketSphinxSTT, cls).get_config()
+        section = jasperconfig.get_section('pocketsphinx')
+        if 'hmm_dir' in section:
+            config['hmm_dir'] = section['hmm_dir']
+        if 'pool_size' in section:
+            config['pool_size'] = int(section['pool_size'])
+        return config
+
+    @classmethod
+    def is_available(cls):
+        return diagnose.check_python_import('pocketsphinx')
+
+    def _create_decoder(self):
+        import pocketsphinx
+        start = time.time()
+        config = pocketsphinx.Decoder.default_config()
+        config.set_string('-hmm', self.hmm_dir)
+        config.set_string('-lm', self.vocabulary.languagemodel_file)
+        config.set_string('-dict', self.vocabulary.dictionary_file)
+        config.set_string('-logfn', os.devnull)
+        decoder = pocketsphinx.Decoder(config)
+        self._logger.debug("Created pocketsphinx decoder in %.0f ms",
+                           1000 * (time.time() - start))
+        return decoder
+
+    def _acquire_decoder(self):
+        try:
+            return self._decoders.get_nowait()
+        except Queue.Empty:
+            pass
+        with self._lock:
+            create = self._num_decoders < self.pool_size
+            if create:
+                self._num_decoders += 1
+        if create:
+            try:
+                return self._create_decoder()
+            except Exception:
+                # Give the slot back, the pool would shrink otherwise
+                with self._lock:
+                    self._num_decoders -= 1
+                raise
+        return self._decoders.get()
+
+    def _read_audio(self, audio):
+        """
+        Returns:
+            The audio as raw 16 kHz mono 16 bit PCM
+        """
+        if not isinstance(audio, sr.AudioData):
+            # A WAV file
+            wav = wave.open(audio, 'rb')
+            try:
+                data = wav.readframes(wav.getnframes())
+                if wav.getnchannels() == 2:
+                    data = audioop.tomono(data, wav.getsampwidth(), 0.5, 0.5)
+                audio = sr.AudioData(data, wav.getframerate(),
+                                     wav.getsampwidth())
+            finally:
+                wav.close()
+        return audio.get_raw_data(convert_rate=self.SAMPLE_RATE,
+                                  convert_width=2)
+
+    def recognize(self, audio):
+        data = self._read_audio(audio)
+        decoder = self._acquire_decoder()
+        try:
+            decoder.start_utt()
+            decoder.process_raw(data, False, True)
+            decoder.end_utt()
+            hyp = decoder.hyp()
+        except RuntimeError as e:
+            raise sr.RequestError("pocketsphinx failed; {0}".format(e))
+        finally:
+            self._decoders.put(decoder)
+        if hyp is None or not hyp.hypstr.strip():
+            raise sr.UnknownValueError()
+        return hyp.hypstr, None
+
+    def transcribe(self, audio):
+        """
+        Performs STT on a speech_recognition.AudioData instance or an open
+        WAV file.
+        """
+        try:
+            transcribed = self.recognize(audio)[0]
+        except sr.UnknownValueError:
+            transcribed = ""
+        self._logger.info('Transcribed: %r', transcribed)
+        return transcribed
+
+
+class HedgedSTT(AbstractSTTEngine):
+    """
+    Sends each utterance to several engines and returns the first confident
+    result, so that a slow or failing provider doesn't hold Jasper up.
+
+    To save requests, the next engine is only asked once the previous one
+    has taken longer than the 95th percentile of its recent latencies (or
+    as soon as it has failed).
+    """
+
+    SLUG = 'hedged'
+
+    def __init__(self, engines, hedge_delay='p95', min_confidence=0.0,
+                 default_delay=1.0, timeout=15, window=100, min_samples=5,
+                 userName=None, password=None):
+        """
+        Arguments:
+        engines -- the engine instances, in order of preference
+        hedge_delay -- seconds to wait before asking the next engine, or
+                       'p95' to use the rolling 95th percentile latency of
+                       the previous one. 0 asks all engines at once.
+        min_confidence -- results with a lower confidence only win if no
+                          engine does better
+        default_delay -- hedge delay while fewer than min_samples latencies
+                         of an engine are known
+        timeout -- seconds to wait for any result
+        window -- number of recent latencies kept per engine
+        """
+        self._logger = logging.getLogger(__name__)
+        if not engines:
+            raise ValueError("HedgedSTT needs at least one engine")
+        self.engines = list(engines)
+        # Audio is resampled once, to the rate of the preferred engine
+        self.SAMPLE_RATE = self.engines[0].SAMPLE_RATE
+        self.UPLOAD_FORMATS = self.engines[0].UPLOAD_FORMATS
+        self.hedge_delay = hedge_delay
+        self.min_confidence = min_confidence
+        self.default_delay = default_delay
+        self.timeout = timeout
+        self.min_samples = min_samples
+        self._latencies = [collections.deque(maxlen=window)
+                           for engine in self.engines]
+        self._latencies_lock = threading.Lock()
+
+    @classmethod
+    def get_config(cls):
+        config = {'engines': ['IBM', 'ATT']}
+        section = jasperconfig.get_section('hedged_stt')
+        for key in ('engines', 'hedge_delay', 'min_confidence',
+                    'default_delay', 'timeout'):
+            if key in section:
+                config[key] = section[key]
+        return config
+
+    @classmethod
+    def get_instance(cls, vocabulary_name, phrases):
+        config = cls.get_config()
+        engines = []
+        for slug in config.pop('engines'):
+            if slug == cls.SLUG:
+                raise ValueError("HedgedSTT can't contain itself")
+            engines.append(get_engine_by_slug(slug).get_instance(
+                vocabulary_name, phrases))
+        return cls(engines, **config)
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def preconnect(self):
+        for engine in self.engines:
+            engine.preconnect()
+
+    def get_delay(self, index):
+        """
+        Returns:
+            Seconds to wait for engine index before asking the next one
+        """
+        if self.hedge_delay != 'p95':
+            return float(self.hedge_delay)
+        latencies = sorted(self._latencies[index])
+        if len(latencies) < self.min_samples:
+            return self.default_delay
+        return latencies[int(round(0.95 * (len(latencies) - 1)))]
+
+    def _record_latency(self, index, latency, unfinished):
+        """
+        Records the latency of engine index, unless a timeout has been
+        recorded for it already.
+
+        Arguments:
+            unfinished -- indices of the engines of the call that haven't
+                          finished yet
+        """
+        with self._latencies_lock:
+            if index not in unfinished:
+                return
+            unfinished.discard(index)
+            self._latencies[index].append(latency)
+        metrics.observe('stt.hedged.%s.latency' % self.engines[index].SLUG,
+                        latency)
+
+    def _run(self, index, audio, results, unfinished):
+        # The latency is recorded here, so that engines answering after
+        # the winner count as well
+        start = time.time()
+        try:
+            hypotheses = self.engines[index].recognize_all(audio)
+        except (sr.UnknownValueError, sr.RequestError) as e:
+            latency = time.time() - start
+            self._record_latency(index, latency, unfinished)
+            results.put((index, latency, None, e))
+        else:
+            latency = time.time() - start
+            self._record_latency(index, latency, unfinished)
+            results.put((index, latency, hypotheses, None))
+
+    def recognize(self, audio):
+        return self.recognize_all(audio)[0]
+
+    def recognize_all(self, audio):
+        results = Queue.Queue()
+        deadline = time.time() + self.timeout
+        next_index = 0
+        next_time = time.time()
+        pending = 0
+        unfinished = set()
+        best = None
+        error = None
+        while pending or next_index < len(self.engines):
+            now = time.time()
+            if next_index < len(self.engines) and now >= next_time:
+                if next_index > 0:
+                    metrics.increment('stt.hedged.hedges')
+                    self._logger.debug("Asking %s as well",
+                                       self.engines[next_index].SLUG)
+                unfinished.add(next_index)
+                thread = threading.Thread(target=self._run,
+                                          args=(next_index, audio, results,
+                                                unfinished),
+                                          name='HedgedSTT')
+                thread.daemon = True
+                thread.start()
+                next_time = now + self.get_delay(next_index)
+                next_index += 1
+                pending += 1
+                continue
+            if now >= deadline:
+                break
+            wait = deadline - now
+            if next_index < len(self.engines):
+                wait = min(wait, next_time - now)
+            try:
+                index, latency, hypotheses, e = results.get(timeout=wait)
+            except Queue.Empty:
+                continue
+            pending -= 1
+            slug = self.engines[index].SLUG
+            if e is not None:
+                self._logger.debug("%s failed after %.0f ms: %r", slug,
+                                   1000 * latency, e)
+                # An engine that heard nothing beats one that failed
+                if error is None or isinstance(e, sr.UnknownValueError):
+                    error = e
+            elif hypotheses[0][1] is None or \
+                    hypotheses[0][1] >= self.min_confidence:
+                metrics.increment('stt.hedged.%s.wins' % slug)
+                self._logger.debug("%s answered first after %.0f ms", slug,
+                                   1000 * latency)
+                return hypotheses
+            elif best is None or hypotheses[0][1] > best[0][1]:
+                best = hypotheses
+            # Don't wait for the hedge delay, the result isn't usable
+            next_time = time.time()
+        with self._latencies_lock:
+            # Engines that haven't answered at all are at least this slow
+            for index in unfinished:
+                self._latencies[index].append(self.timeout)
+                metrics.increment('stt.hedged.%s.timeouts' %
+                                  self.engines[index].SLUG)
+            unfinished.clear()
+        if best is not None:
+            return best
+        if error is not None:
+            raise error
+        raise sr.RequestError("no engine answered within %d seconds" %
+                              self.timeout)
+
+    def transcribe(self, audio):
+        try:
+            return self.recognize(audio)[0]
+        except sr.UnknownValueError:
+            return ""
+
+
+class FailoverSTT(AbstractSTTEngine):
+    """
+    Asks the configured engines one after the other until one of them
+    answers, e.g. the cloud services first and pocketsphinx as the local
+    fallback.
+
+    Every engine has a circuit breaker, so a dead service is skipped right
+    away instead of failing every utterance again. Engines that have been
+    slow or unreliable lately are only tried after the healthy ones.
+    """
+
+    SLUG = 'failover'
+
+    def __init__(self, engines, max_latency=5.0, max_error_rate=0.2,
+                 breaker_error_rate=0.5, window=20, min_requests=5,
+                 reset_timeout=30.0, userName=None, password=None):
+        """
+        Arguments:
+        engines -- the engine instances, in order of preference
+        max_latency -- engines with a higher average latency in seconds are
+                       tried after the others
+        max_error_rate -- engines with a higher recent error rate are tried
+                          after the others
+        breaker_error_rate -- recent error rate that opens the breaker of an
+                              engine
+        window -- number of recent requests the error rate is computed over
+        min_requests -- a breaker doesn't open before this many requests
+        reset_timeout -- seconds before an engine with an open breaker is
+                         tried again
+        """
+        self._logger = logging.getLogger(__name__)
+        if not engines:
+            raise ValueError("FailoverSTT needs at least one engine")
+        self.engines = list(engines)
+        # Audio is resampled once, to the rate of the preferred engine
+        self.SAMPLE_RATE = self.engines[0].SAMPLE_RATE
+        self.UPLOAD_FORMATS = self.engines[0].UPLOAD_FORMATS
+        self.max_latency = max_latency
+        self.max_error_rate = max_error_rate
+        self.reset_timeout = reset_timeout
+        self.breakers = [health.CircuitBreaker(
+            'stt.failover.%s' % engine.SLUG, window=window,
+            min_requests=min_requests, max_error_rate=breaker_error_rate,
+            reset_timeout=reset_timeout) for engine in self.engines]
+
+    @classmethod
+    def get_config(cls):
+        config = {'engines': ['IBM', 'ATT', 'sphinx']}
+        section = jasperconfig.get_section('failover_stt')
+        for key in ('engines', 'max_latency', 'max_error_rate',
+                    'breaker_error_rate', 'window', 'min_requests',
+                    'reset_timeout'):
+            if key in section:
+                config[key] = section[key]
+        return config
+
+    @classmethod
+    def get_instance(cls, vocabulary_name, phrases):
+        logger = logging.getLogger(__name__)
+        config = cls.get_config()
+        engines = []
+        for slug in config.pop('engines'):
+            if slug == cls.SLUG:
+                raise ValueError("FailoverSTT can't contain itself")
+            try:
+                engines.append(get_engine_by_slug(slug).get_instance(
+                    vocabulary_name, phrases))
+            except (ImportError, OSError, ValueError):
+                # E.g. pocketsphinx isn't installed, the others still work
+                logger.warning("Skipped STT engine '%s' due to an error.",
+                               slug, exc_info=True)
+        return cls(engines, **config)
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def _is_degraded(self, index):
+        breaker = self.breakers[index]
+        if breaker.last_request is None or \
+                time.time() - breaker.last_request >= self.reset_timeout:
+            # Give it another chance, it won't get new samples otherwise
+            return False
+        return breaker.error_rate > self.max_error_rate or \
+            (breaker.latency is not None and
+             breaker.latency > self.max_latency)
+
+    def get_order(self):
+        """
+        Returns:
+            The indices of the engines in the order they're tried: healthy
+            engines first, then degraded ones, then the ones whose breaker
+            is open. Engines that haven't been asked for reset_timeout
+            seconds keep their place, so that a recovered engine is noticed
+            even while another one answers.
+        """
+        def key(index):
+            breaker = self.breakers[index]
+            unavailable = breaker.state != health.CLOSED and \
+                breaker.retry_in > 0
+            return (unavailable, self._is_degraded(index), index)
+        return sorted(range(len(self.engines)), key=key)
+
+    def preconnect(self):
+        for index, engine in enumerate(self.engines):
+            if self.breakers[index].state == health.CLOSED:
+                engine.preconnect()
+
+    def recognize(self, audio):
+        return self.recognize_all(audio)[0]
+
+    def recognize_all(self, audio):
+        errors = []
+        for index in self.get_order():
+            engine = self.engines[index]
+            breaker = self.breakers[index]
+            if not breaker.allow_request():
+                continue
+            start = time.time()
+            try:
+                hypotheses = engine.recognize_all(audio)
+            except sr.UnknownValueError:
+                # The engine works, there just was nothing to recognize
+                breaker.record_success(time.time() - start)
+                raise
+            except Exception as e:
+                # Not only sr.RequestError, e.g. preparing the upload may
+                # fail as well. The breaker must hear of every failure, or
+                # a half open one would never let a request through again.
+                breaker.record_failure(time.time() - start)
+                self._logger.warning("%s failed, failing over: %r",
+                                     engine.SLUG, e,
+                                     exc_info=not isinstance(
+                                         e, sr.RequestError))
+                errors.append("%s: %s" % (engine.SLUG, e))
+                continue
+            breaker.record_success(time.time() - start)
+            metrics.increment('stt.failover.%s.served' % engine.SLUG)
+            return hypotheses
+        if not errors:
+            raise health.CircuitOpenError("all STT engines are unavailable")
+        raise sr.RequestError("; ".join(errors))
+
+    def transcribe(self, audio):
+        try:
+            return self.recognize(audio)[0]
+        except sr.UnknownValueError:
+            return ""
+
+
 def get_engine_by_slug(slug=None):
-	"""
-	Returns:
-		An STT Engine implementation available on the current platform
-	
-	Raises:
-		ValueError if no speaker implementation is supported on this platform
-	"""
-	
-	for engine in get_engines():
-		if engine.SLUG == slug:
-			return engine
-			
-	raise ValueError("No  engine found for slug '%s'" % slug)
-	
+    """
+    Returns:
+        An STT Engine implementation available on the current platform
+
+    Raises:
+        ValueError if no speaker implementation is supported on this platform
+    """
+    return _registry.get_engine(slug, check_available=False)
+
 
 def get_engines():
-    def get_subclasses(cls):
-        subclasses = set()
-        for subclass in cls.__subclasses__():
-            subclasses.add(subclass)
-            subclasses.update(get_subclasses(subclass))
-        return subclasses
-    return [tts_engine for tts_engine in
-            list(get_subclasses(AbstractSTTEngine))
-            if hasattr(tts_engine, 'SLUG') and tts_engine.SLUG]
-            
+    return _registry.get_engines()
+
+
+_registry = registry.EngineRegistry(AbstractSTTEngine, 'stt')
+
 if __name__ == "__main__":
-	att = AttSTT()
-	
-	print(att.get_config())
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark an STT engine')
+    parser.add_argument('--engine', default='sphinx',
+                        help='slug of the engine to benchmark')
+    parser.add_argument('--vocabulary', choices=['active', 'passive'],
+                        default='active')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='number of runs per file')
+    parser.add_argument('--parallel', type=int, default=2,
+                        help='number of utterances decoded at once in the ' +
+                        'throughput test')
+    parser.add_argument('files', nargs='*',
+                        default=[jasperpath.data('audio', 'jasper.wav'),
+                                 jasperpath.data('audio', 'time.wav')])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    engine_class = get_engine_by_slug(args.engine)
+    start = time.time()
+    if args.vocabulary == 'active':
+        engine = engine_class.get_active_instance()
+    else:
+        engine = engine_class.get_passive_instance()
+    print("%s: set up in %.0f ms" % (args.engine,
+                                     1000 * (time.time() - start)))
+
+    utterances = []
+    for fname in args.files:
+        with open(fname, 'rb') as f:
+            wav = wave.open(f, 'rb')
+            audio = sr.AudioData(wav.readframes(wav.getnframes()),
+                                 wav.getframerate(), wav.getsampwidth())
+            wav.close()
+        utterances.append((os.path.basename(fname), audio))
+
+    for name, audio in utterances:
+        metrics.reset()
+        for i in range(args.runs):
+            with metrics.timer('latency'):
+                transcription = engine.transcribe(audio)
+        summary = metrics.summary('latency')
+        print("%s (%.2f s): %r, p50 %.0f ms, p95 %.0f ms" %
+              (name, float(len(audio.frame_data)) / audio.sample_width /
+               audio.sample_rate, transcription, 1000 * summary['p50'],
+               1000 * summary['p95']))
+
+    # Throughput with several utterances at once
+    jobs = Queue.Queue()
+    for i in range(args.runs):
+        for name, audio in utterances:
+            jobs.put(audio)
+    total = jobs.qsize()
+
+    def worker():
+        while True:
+            try:
+                audio = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            engine.transcribe(audio)
+
+    start = time.time()
+    workers = [threading.Thread(target=worker) for i in range(args.parallel)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+    print("%d utterances with %d thread(s): %.0f ms per utterance" %
+          (total, args.parallel, 1000 * elapsed / total))
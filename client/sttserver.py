@@ -0,0 +1,653 @@
+# -*- coding: utf-8-*-
+"""
+A local stand-in for the cloud STT services.
+
+The server speaks the protocol of stt.HTTPTranscriptionStream and enough of
+the IBM and AT&T recognition APIs for stt.Ibm and stt.AttSTT to talk to it,
+so that the STT engines and everything behind them can be tested and
+benchmarked without network access or credentials. Transcripts are scripted,
+either fixed or looked up by the fingerprint of the audio.
+
+Recognition time is simulated as well: the audio of a stream is "decoded"
+as it arrives, so finishing a stream only costs the time needed for the
+last chunk, while a whole utterance uploaded at once pays for all of it.
+ServiceConditions add network latency, throttling and failures.
+
+Run it standalone with
+
+    python client/sttserver.py --port 8765 --transcript "QUE HORA ES"
+
+or benchmark streaming against whole-utterance upload with --benchmark.
+See benchmark.py for end-to-end benchmarks.
+"""
+import audioop
+import collections
+import io
+import json
+import logging
+import math
+import random
+import socket
+import subprocess
+import threading
+import time
+import uuid
+import urlparse
+import wave
+import BaseHTTPServer
+import SocketServer
+import numpy
+
+
+class ScriptedRecognizer(object):
+    """
+    Pretends to recognize a fixed transcript. Partial hypotheses reveal the
+    words of the transcript at a typical speaking rate.
+    """
+
+    def __init__(self, transcript, words_per_second=2.5):
+        self.words = transcript.split()
+        self.words_per_second = words_per_second
+
+    def __call__(self, frame_data, rate, sample_width, final):
+        if final:
+            return ' '.join(self.words)
+        duration = float(len(frame_data)) / sample_width / rate
+        return ' '.join(self.words[:int(duration * self.words_per_second)])
+
+
+def fingerprint(frame_data, rate, sample_width=2, frame_seconds=0.02):
+    """
+    Returns:
+        The log energy envelope of the audio as a numpy array. Unlike a
+        hash of the samples, it survives resampling, trimming and lossless
+        encoding.
+    """
+    if sample_width != 2:
+        frame_data = audioop.lin2lin(frame_data, sample_width, 2)
+    samples = numpy.frombuffer(frame_data, dtype=numpy.int16)
+    size = max(1, int(rate * frame_seconds))
+    num_frames = len(samples) // size
+    frames = samples[:num_frames * size].astype(numpy.float64)
+    energy = (frames.reshape(num_frames, size) ** 2).mean(axis=1)
+    return numpy.log10(energy + 1.0)
+
+
+def similarity(a, b):
+    """
+    Returns:
+        The best correlation (-1 to 1) of the shorter fingerprint with any
+        part of the longer one
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) < 2 or numpy.std(a) == 0:
+        return 0.0
+    best = -1.0
+    for offset in range(len(b) - len(a) + 1):
+        part = b[offset:offset + len(a)]
+        if numpy.std(part) == 0:
+            continue
+        best = max(best, float(numpy.corrcoef(a, part)[0, 1]))
+    return best
+
+
+class FingerprintRecognizer(object):
+    """
+    Returns the scripted transcript of the known audio clip the received
+    audio matches best.
+    """
+
+    def __init__(self, min_similarity=0.8, default=''):
+        """
+        Arguments:
+            min_similarity -- audio less similar to every known clip gets
+                              the default transcript
+            default -- transcript of unknown audio, empty if nothing is
+                       recognized
+        """
+        self.min_similarity = min_similarity
+        self.default = default
+        self._clips = []
+
+    def add(self, frame_data, rate, sample_width, transcript):
+        """
+        Arguments:
+            transcript -- the transcript, or a list of alternatives (the
+                          n-best list) for the cloud APIs
+        """
+        self._clips.append((fingerprint(frame_data, rate, sample_width),
+                            transcript))
+
+    def add_file(self, path, transcript):
+        wav = wave.open(path, 'rb')
+        try:
+            self.add(wav.readframes(wav.getnframes()), wav.getframerate(),
+                     wav.getsampwidth(), transcript)
+        finally:
+            wav.close()
+
+    def match(self, frame_data, rate, sample_width):
+        """
+        Returns:
+            The transcript of the best matching clip, or None
+        """
+        received = fingerprint(frame_data, rate, sample_width)
+        best, best_score = None, self.min_similarity
+        for clip, transcript in self._clips:
+            score = similarity(received, clip)
+            if score >= best_score:
+                best, best_score = transcript, score
+        return best
+
+    def __call__(self, frame_data, rate, sample_width, final):
+        transcript = self.match(frame_data, rate, sample_width)
+        return transcript if transcript is not None else self.default
+
+
+def _alternatives(result):
+    if isinstance(result, basestring):
+        return [result] if result else []
+    return [text for text in result if text]
+
+
+class ServiceConditions(object):
+    """
+    Simulated behaviour of the network and the service: latency,
+    throttling and failures.
+    """
+
+    DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+    def __init__(self, latency=0.0, jitter=0.0, distribution='lognormal',
+                 failure_rate=0.0, failure_status=503, throttle=None,
+                 seed=None):
+        """
+        Arguments:
+            latency -- median seconds added to every request
+            jitter -- spread of the latency: seconds for 'uniform' (+/-) and
+                      'normal' (standard deviation), the sigma of the
+                      logarithm for 'lognormal'
+            distribution -- one of DISTRIBUTIONS
+            failure_rate -- share of the requests (0 to 1) answered with
+                            failure_status
+            throttle -- (optional) requests per second; requests beyond
+                        that are answered with 429 Too Many Requests
+            seed -- (optional) seed for reproducible runs
+        """
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError("Unknown latency distribution '%s'" %
+                             distribution)
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.throttle = throttle
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(throttle) if throttle else 0.0
+        self._last_refill = time.time()
+
+    def sample_latency(self):
+        with self._lock:
+            if self.distribution == 'uniform':
+                latency = self._random.uniform(self.latency - self.jitter,
+                                               self.latency + self.jitter)
+            elif self.distribution == 'normal':
+                latency = self._random.gauss(self.latency, self.jitter)
+            elif self.distribution == 'lognormal':
+                latency = self.latency * \
+                    math.exp(self._random.gauss(0, self.jitter))
+            else:
+                latency = self.latency
+        return max(0.0, latency)
+
+    def check(self):
+        """
+        Returns:
+            The HTTP status of an injected error for the next request, or
+            None if it may be served
+        """
+        with self._lock:
+            if self.throttle:
+                # Token bucket holding one second worth of requests
+                now = time.time()
+                self._tokens = min(float(self.throttle), self._tokens +
+                                   (now - self._last_refill) * self.throttle)
+                self._last_refill = now
+                if self._tokens < 1:
+                    return 429
+                self._tokens -= 1
+            if self.failure_rate and \
+                    self._random.random() < self.failure_rate:
+                return self.failure_status
+        return None
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep-alive, so that a stream can reuse its connection for all chunks
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        self.server.stt._logger.debug("%s - %s", self.address_string(),
+                                      format % args)
+
+    def _reply(self, code, body=None):
+        data = json.dumps(body if body is not None else {})
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        parts = url.path.strip('/').split('/')
+        body = self._body()
+        stt = self.server.stt
+        status = stt.conditions.check()
+        if status is not None:
+            stt.stats[status] += 1
+            self._reply(status, {'error': 'injected failure'})
+            return
+        content_type = self.headers.getheader('Content-Type', '')
+        try:
+            self._route(parts, params, body, content_type)
+        except ValueError as e:
+            stt.stats[400] += 1
+            self._reply(400, {'error': str(e)})
+
+    def _route(self, parts, params, body, content_type):
+        stt = self.server.stt
+        if parts == ['speech-to-text', 'api', 'v1', 'recognize']:
+            self._reply(200, stt.recognize_ibm(body, content_type, params))
+        elif parts == ['oauth', 'v4', 'token']:
+            self._reply(200, stt.issue_token())
+        elif parts == ['speech', 'v3', 'speechToText']:
+            token = self.headers.getheader('Authorization', '')
+            if not stt.check_token(token.replace('Bearer ', '', 1)):
+                self._reply(401, {'error': 'invalid token'})
+            else:
+                self._reply(200, stt.recognize_att(body, content_type))
+        elif parts == ['v1', 'recognize']:
+            self._reply(200, stt.recognize(body, params))
+        elif parts == ['v1', 'streams']:
+            self._reply(201, stt.open_stream(params))
+        elif len(parts) == 4 and parts[:2] == ['v1', 'streams'] and \
+                parts[3] in ('audio', 'finish'):
+            if parts[3] == 'audio':
+                result = stt.stream_audio(parts[2], body)
+            else:
+                result = stt.finish_stream(parts[2])
+            if result is None:
+                self._reply(404, {'error': 'unknown stream'})
+            else:
+                self._reply(200, result)
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_HEAD(self):
+        # Used by clients to open a connection in advance
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_DELETE(self):
+        parts = urlparse.urlparse(self.path).path.strip('/').split('/')
+        if len(parts) == 3 and parts[:2] == ['v1', 'streams']:
+            self.server.stt.close_stream(parts[2])
+            self._reply(200)
+        else:
+            self._reply(404, {'error': 'not found'})
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address,
+                                           handler_class)
+        # Open keep-alive connections, closed on shutdown
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    client_address)
+
+    def shutdown_request(self, request):
+        with self.connections_lock:
+            self.connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self, timeout=1.0):
+        with self.connections_lock:
+            connections = list(self.connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        # Give the handler threads a chance to finish
+        deadline = time.time() + timeout
+        while self.connections and time.time() < deadline:
+            time.sleep(0.01)
+
+
+class LocalSTTServer(object):
+
+    def __init__(self, host='localhost', port=0, recognizer=None,
+                 processing_factor=0.0, latency=0.0, conditions=None):
+        """
+        Arguments:
+            host -- interface to listen on
+            port -- port to listen on, 0 picks a free one
+            recognizer -- (optional) called as recognizer(frame_data, rate,
+                          sample_width, final) and returns the hypothesis,
+                          or a list of alternatives (Default: an empty
+                          transcript)
+            processing_factor -- simulated seconds of recognition per second
+                                 of audio
+            latency -- simulated seconds added to every request, e.g. the
+                       network round trip
+            conditions -- (optional) ServiceConditions that replace latency
+        """
+        self._logger = logging.getLogger(__name__)
+        self.recognizer = recognizer if recognizer is not None \
+            else ScriptedRecognizer('')
+        self.processing_factor = processing_factor
+        self.conditions = conditions if conditions is not None \
+            else ServiceConditions(latency=latency, distribution='fixed')
+        # Number of requests answered per HTTP status
+        self.stats = collections.Counter()
+        self._tokens = set()
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._server = _ThreadedHTTPServer((host, port), _Handler)
+        self._server.stt = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def ibm_url(self):
+        """
+        The url argument for stt.Ibm
+        """
+        return self.url + '/speech-to-text/api/v1/recognize'
+
+    @property
+    def att_urls(self):
+        """
+        The url and token_url arguments for stt.AttSTT
+        """
+        return {'url': self.url + '/speech/v3/speechToText',
+                'token_url': self.url + '/oauth/v4/token'}
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='LocalSTTServer')
+        self._thread.daemon = True
+        self._thread.start()
+        self._logger.debug("Serving on %s", self.url)
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.close_connections()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _process(self, num_bytes, rate, width):
+        seconds = float(num_bytes) / width / rate
+        time.sleep(self.conditions.sample_latency() +
+                   self.processing_factor * seconds)
+
+    @staticmethod
+    def _format(params):
+        return int(params.get('rate', 16000)), int(params.get('width', 2))
+
+    @staticmethod
+    def decode_audio(data, content_type):
+        """
+        Returns:
+            A tuple of the raw PCM audio of an uploaded WAV or FLAC file,
+            its sample rate and sample width
+
+        Raises:
+            ValueError if the upload can't be decoded
+        """
+        if 'flac' in content_type:
+            import speech_recognition as sr
+            proc = subprocess.Popen([sr.get_flac_converter(), '--decode',
+                                     '--stdout', '--totally-silent', '-'],
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE)
+            data, _ = proc.communicate(data)
+            if proc.returncode != 0:
+                raise ValueError("Could not decode the FLAC upload")
+        try:
+            wav = wave.open(io.BytesIO(data), 'rb')
+            try:
+                frame_data = wav.readframes(wav.getnframes())
+                if wav.getnchannels() > 1:
+                    frame_data = audioop.tomono(frame_data,
+                                                wav.getsampwidth(), 0.5, 0.5)
+                return frame_data, wav.getframerate(), wav.getsampwidth()
+            finally:
+                wav.close()
+        except (wave.Error, EOFError) as e:
+            raise ValueError("Could not decode the upload: %s" % e)
+
+    def _recognize_upload(self, data, content_type):
+        frame_data, rate, width = self.decode_audio(data, content_type)
+        self._process(len(frame_data), rate, width)
+        self.stats[200] += 1
+        return _alternatives(self.recognizer(frame_data, rate, width, True))
+
+    def recognize(self, frame_data, params):
+        rate, width = self._format(params)
+        self._process(len(frame_data), rate, width)
+        self.stats[200] += 1
+        alternatives = _alternatives(self.recognizer(frame_data, rate, width,
+                                                     True))
+        return {'final': alternatives[0] if alternatives else ''}
+
+    def recognize_ibm(self, data, content_type, params):
+        """
+        Returns:
+            The response of the IBM recognize API
+        """
+        alternatives = self._recognize_upload(data, content_type)
+        alternatives = alternatives[:int(params.get('max_alternatives', 1))]
+        if not alternatives:
+            return {'results': [], 'result_index': 0}
+        hypotheses = [{'transcript': text} for text in alternatives]
+        hypotheses[0]['confidence'] = 0.9
+        return {'results': [{'alternatives': hypotheses, 'final': True}],
+                'result_index': 0}
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._tokens.add(token)
+        self.stats[200] += 1
+        return {'access_token': token, 'expires_in': 3600}
+
+    def check_token(self, token):
+        with self._lock:
+            return token in self._tokens
+
+    def recognize_att(self, data, content_type):
+        """
+        Returns:
+            The response of the AT&T speechToText API
+        """
+        alternatives = self._recognize_upload(data, content_type)
+        if not alternatives:
+            return {'Recognition': {'Status': 'No Speech', 'NBest': []}}
+        nbest = [{'Grade': 'accept', 'ResultText': alternatives[0],
+                  'Confidence': 0.9}]
+        nbest.extend({'Grade': 'confirm', 'ResultText': text,
+                      'Confidence': 0.5} for text in alternatives[1:])
+        return {'Recognition': {'Status': 'OK', 'NBest': nbest}}
+
+    def open_stream(self, params):
+        rate, width = self._format(params)
+        stream_id = uuid.uuid4().hex
+        with self._lock:
+            self._streams[stream_id] = {'rate': rate, 'width': width,
+                                        'audio': bytearray()}
+        time.sleep(self.conditions.sample_latency())
+        return {'id': stream_id}
+
+    def stream_audio(self, stream_id, data):
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                return None
+            stream['audio'].extend(data)
+            audio = bytes(stream['audio'])
+        self._process(len(data), stream['rate'], stream['width'])
+        alternatives = _alternatives(self.recognizer(
+            audio, stream['rate'], stream['width'], False))
+        return {'partial': alternatives[0] if alternatives else ''}
+
+    def finish_stream(self, stream_id):
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return None
+        # All audio has already been decoded while it was streamed
+        time.sleep(self.conditions.sample_latency())
+        alternatives = _alternatives(self.recognizer(
+            bytes(stream['audio']), stream['rate'], stream['width'], True))
+        return {'final': alternatives[0] if alternatives else ''}
+
+    def close_stream(self, stream_id):
+        with self._lock:
+            self._streams.pop(stream_id, None)
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import speech_recognition as sr
+    import jasperpath
+    import metrics
+    import stt
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the ' +
+                                     'cloud STT services')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--transcript', default='QUE HORA ES',
+                        help='text recognized in every utterance')
+    parser.add_argument('--script', action='append', default=[],
+                        metavar='WAV=TRANSCRIPT',
+                        help='recognize TRANSCRIPT in audio matching WAV, ' +
+                        'instead of --transcript in everything')
+    parser.add_argument('--processing-factor', type=float, default=0.3,
+                        help='simulated recognition time per second of audio')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated network round trip in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='spread of the latency')
+    parser.add_argument('--distribution', default='lognormal',
+                        choices=ServiceConditions.DISTRIBUTIONS)
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='share of the requests that fail with 503')
+    parser.add_argument('--throttle', type=float, default=None,
+                        help='requests per second before answering 429')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare streaming and whole-utterance upload ' +
+                        'instead of serving')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--chunk', type=float, default=0.1,
+                        help='seconds of audio per streamed chunk')
+    parser.add_argument('files', nargs='*',
+                        default=[jasperpath.data('audio', 'jasper.wav'),
+                                 jasperpath.data('audio', 'time.wav')])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.script:
+        recognizer = FingerprintRecognizer()
+        for script in args.script:
+            fname, transcript = script.split('=', 1)
+            recognizer.add_file(fname, transcript)
+    else:
+        recognizer = ScriptedRecognizer(args.transcript)
+    conditions = ServiceConditions(latency=args.latency, jitter=args.jitter,
+                                   distribution=args.distribution,
+                                   failure_rate=args.failure_rate,
+                                   throttle=args.throttle)
+    server = LocalSTTServer(port=0 if args.benchmark else args.port,
+                            recognizer=recognizer,
+                            processing_factor=args.processing_factor,
+                            conditions=conditions)
+    if not args.benchmark:
+        with server:
+            print("Serving on %s" % server.url)
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        raise SystemExit
+
+    with server:
+        engine = stt.HTTPStreamingSTT(url=server.url)
+        for fname in args.files:
+            wav = wave.open(fname, 'rb')
+            rate = wav.getframerate()
+            width = wav.getsampwidth()
+            frame_data = wav.readframes(wav.getnframes())
+            wav.close()
+            step = int(args.chunk * rate) * width
+            metrics.reset()
+            for i in range(args.runs):
+                # Whole utterance: everything is uploaded after the endpoint
+                start = time.time()
+                engine.transcribe(sr.AudioData(frame_data, rate, width))
+                metrics.observe('whole', time.time() - start)
+
+                # Streaming: the chunks are fed in real time while the user
+                # is speaking, only the wait after the endpoint counts
+                stream = engine.start_stream(rate, sample_width=width)
+                for offset in range(0, len(frame_data), step):
+                    stream.feed(frame_data[offset:offset + step])
+                    time.sleep(args.chunk)
+                start = time.time()
+                stream.finish()
+                metrics.observe('streaming', time.time() - start)
+            print("%s (%.2f s), latency after the end of speech:" %
+                  (os.path.basename(fname),
+                   float(len(frame_data)) / width / rate))
+            for name in ('whole', 'streaming'):
+                summary = metrics.summary(name)
+                print("  %-10s p50 %4.0f ms  p95 %4.0f ms" %
+                      (name, 1000 * summary['p50'], 1000 * summary['p95']))
@@ -8,10 +8,11 @@ Speaker methods:
     play - play the audio in 'filename'
     is_available - returns True if the platform supports this implementation
 """
-import os
+import io
 import platform
 import re
 import tempfile
+import threading
 import subprocess
 import pipes
 import logging
@@ -25,6 +26,7 @@ import argparse
 import yaml
 import codecs
 import sys
+import numpy
 
 
 #logging.basicConfig(level=logging.DEBUG)
@@ -44,16 +46,26 @@ try:
 except ImportError:
     pass
 
+import audiooutput
 import diagnose
+import festival
+import jasperconfig
 import jasperpath
+import registry
 
 
 class AbstractTTSEngine(object):
     """
     Generic parent class for all speakers
+
+    Audio is played in-process on the audiooutput.OutputStream in output,
+    Jasper sets it to the one of the Mic. Engines used on their own share
+    one configured by the profile.
     """
     __metaclass__ = ABCMeta
 
+    output = None
+
     @classmethod
     def get_config(cls):
         return {}
@@ -67,7 +79,7 @@ class AbstractTTSEngine(object):
     @classmethod
     @abstractmethod
     def is_available(cls):
-        return diagnose.check_executable('aplay')
+        return diagnose.check_python_import('pyaudio')
 
     def __init__(self, **kwargs):
         self._logger = logging.getLogger(__name__)
@@ -76,18 +88,56 @@ class AbstractTTSEngine(object):
     def say(self, phrase, *args):
         pass
 
+    def synthesize(self, phrase):
+        """
+        Synthesizes phrase without playing it, so that the caller can play
+        (and interrupt) it on its own.
+
+        Returns:
+            A tuple (samples, rate, channels) with a numpy int16 array of
+            interleaved samples, or None if the engine doesn't support it
+        """
+        return None
+
+    def get_output(self):
+        """
+        Returns:
+            The audiooutput.OutputStream to play on
+        """
+        if self.output is None:
+            self.output = audiooutput.get_shared()
+        return self.output
+
     def play(self, filename):
-        # FIXME: Use platform-independent audio-output here
-        # See issue jasperproject/jasper-client#188
-        cmd = ['aplay', '-D', 'plughw:1,0', str(filename)]
-        self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
-                                                     for arg in cmd]))
-        with tempfile.TemporaryFile() as f:
-            subprocess.call(cmd, stdout=f, stderr=f)
-            f.seek(0)
-            output = f.read()
-            if output:
-                self._logger.debug("Output was: '%s'", output)
+        """
+        Plays a 16 bit WAV file and waits until it has been played.
+        """
+        self._logger.debug("Playing '%s'", filename)
+        self.get_output().play_file(filename).wait()
+
+    def play_samples(self, samples, rate, channels=1):
+        """
+        Plays a numpy int16 array of interleaved samples and waits until
+        it has been played.
+        """
+        self.get_output().play(samples, rate, channels).wait()
+
+    def play_stream(self, chunks):
+        """
+        Plays audio while it's still being synthesized.
+
+        Arguments:
+            chunks -- an iterable of tuples (samples, rate, channels)
+        """
+        output = self.get_output()
+        playback = None
+        try:
+            for samples, rate, channels in chunks:
+                # Queued chunks are played back to back
+                playback = output.play(samples, rate, channels)
+        finally:
+            if playback is not None:
+                playback.wait()
 
 
 class AbstractMp3TTSEngine(AbstractTTSEngine):
@@ -101,28 +151,53 @@ class AbstractMp3TTSEngine(AbstractTTSEngine):
 
     def play_mp3(self, filename):
         mf = mad.MadFile(filename)
-        with tempfile.NamedTemporaryFile(suffix='.wav') as f:
-            wav = wave.open(f, mode='wb')
-            wav.setframerate(mf.samplerate())
-            wav.setnchannels(1 if mf.mode() == mad.MODE_SINGLE_CHANNEL else 2)
-            # 4L is the sample width of 32 bit audio
-            wav.setsampwidth(4L)
+        frames = []
+        frame = mf.read()
+        while frame is not None:
+            frames.append(str(frame))
             frame = mf.read()
-            while frame is not None:
-                wav.writeframes(frame)
-                frame = mf.read()
-            wav.close()
-            self.play(f.name)
+        # mad always decodes to 16 bit stereo, mono is duplicated
+        samples = numpy.frombuffer(''.join(frames), dtype=numpy.int16)
+        self.play_samples(samples, mf.samplerate(), 2)
 
 
 class FestivalTTS(AbstractTTSEngine):
     """
     Uses the festival speech synthesizer
     Requires festival (text2wave) to be available
+
+    Phrases are synthesized by a festival server that is started once and
+    kept running, text2wave is only used if the server fails.
     """
 
     SLUG = 'festival-tts'
 
+    def __init__(self, voice=None, server=True, **kwargs):
+        """
+        Arguments:
+            voice -- (optional) the festival voice, e.g. 'el_diphone'
+            server -- whether to use a festival server
+        """
+        super(FestivalTTS, self).__init__(**kwargs)
+        self.voice = voice
+        self._server = None
+        if server:
+            self._server = festival.FestivalServer(voice=voice)
+            # Warm the server up while Jasper is still starting
+            thread = threading.Thread(target=self._start_server,
+                                      name='FestivalTTS')
+            thread.daemon = True
+            thread.start()
+
+    @classmethod
+    def get_config(cls):
+        config = {}
+        section = jasperconfig.get_section('festival_tts')
+        for key in ('voice', 'server'):
+            if key in section:
+                config[key] = section[key]
+        return config
+
     @classmethod
     def is_available(cls):
         if (super(cls, cls).is_available() and
@@ -143,46 +218,87 @@ class FestivalTTS(AbstractTTSEngine):
                         logger.debug("Output was: '%s'", output)
                     return ('No default voice found' not in output)
         return False
-        
-    def say2(self, phrase):
-        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+
+    def _start_server(self):
+        try:
+            self._server.start()
+        except festival.FestivalError:
+            self._logger.warning("Festival server could not be started",
+                                 exc_info=True)
+
+    @staticmethod
+    def _encode(phrase):
+        if isinstance(phrase, unicode):
+            return phrase.encode('iso-8859-1', 'replace')
+        return phrase.decode('utf-8', 'replace').encode('iso-8859-1',
+                                                        'replace')
+
+    def synthesize_stream(self, phrase):
+        """
+        Yields:
+            A tuple (samples, rate, channels) per sentence of phrase, as
+            soon as it has been synthesized
+        """
+        text = self._encode(phrase)
+        if self._server is not None:
+            started = False
+            try:
+                for chunk in self._server.synthesize(text):
+                    started = True
+                    yield chunk
+                return
+            except festival.FestivalError:
+                if started:
+                    raise
+                self._logger.warning("Festival server failed, falling " +
+                                     "back to text2wave", exc_info=True)
+                if not self._server.is_running:
+                    # It has already been restarted in vain, don't wait for
+                    # it again on every phrase
+                    self._server.close()
+                    self._server = None
+        synthesized = self._synthesize_once(text)
+        if synthesized is not None:
+            yield synthesized
+
+    def synthesize(self, phrase):
+        chunks = list(self.synthesize_stream(phrase))
+        if not chunks:
+            return None
+        samples, rate, channels = chunks[0]
+        return (numpy.concatenate([chunk[0] for chunk in chunks]), rate,
+                channels)
+
+    def _synthesize_once(self, text):
+        """
+        Synthesizes text with a new text2wave process.
+        """
         cmd = ['text2wave']
-        with tempfile.NamedTemporaryFile(suffix='.wav') as out_f:
-            with tempfile.SpooledTemporaryFile() as in_f:
-                in_f.write(phrase)
-                in_f.seek(0)
-                with tempfile.SpooledTemporaryFile() as err_f:
-                    self._logger.debug('Executing %s',
-                                       ' '.join([pipes.quote(arg)
-                                                 for arg in cmd]))
-                    subprocess.call(cmd, stdin=in_f, stdout=out_f,
-                                    stderr=err_f)
-                    err_f.seek(0)
-                    output = err_f.read()
-                    if output:
-                        self._logger.debug("Output was: '%s'", output)
-            self.play(out_f.name)
-                          
+        self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
+                                                     for arg in cmd]))
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        output, errors = proc.communicate(text)
+        if errors:
+            self._logger.debug("Output was: '%s'", errors)
+        if proc.returncode != 0 or not output:
+            return None
+        wav = wave.open(io.BytesIO(output), 'rb')
+        try:
+            samples = numpy.frombuffer(wav.readframes(wav.getnframes()),
+                                       dtype=numpy.int16)
+            return (samples, wav.getframerate(), wav.getnchannels())
+        finally:
+            wav.close()
 
     def say(self, phrase):
-           
-        orden = """ echo " {0} " | 
-                    iconv -f utf-8 -t iso-8859-1 |  
-                    text2wave  | 
-                    aplay -D plughw:1,0 """.format(phrase)
-
-        
-        os.system(orden)
-        
-        
-        
-        
-        
-       
-         
-
-
+        self._logger.debug("Saying '%s' with '%s'", phrase, self.SLUG)
+        self.play_stream(self.synthesize_stream(phrase))
 
+    def close(self):
+        if self._server is not None:
+            self._server.close()
 
 
 def get_default_engine_slug():
@@ -200,32 +316,14 @@ def get_engine_by_slug(slug=None):
 
     if not slug or type(slug) is not str:
         raise TypeError("Invalid slug '%s'", slug)
-
-    selected_engines = filter(lambda engine: hasattr(engine, "SLUG") and
-                              engine.SLUG == slug, get_engines())
-    if len(selected_engines) == 0:
-        raise ValueError("No TTS engine found for slug '%s'" % slug)
-    else:
-        if len(selected_engines) > 1:
-            print("WARNING: Multiple TTS engines found for slug '%s'. " +
-                  "This is most certainly a bug." % slug)
-        engine = selected_engines[0]
-        if not engine.is_available():
-            raise ValueError(("TTS engine '%s' is not available (due to " +
-                              "missing dependencies, etc.)") % slug)
-        return engine
+    return _registry.get_engine(slug)
 
 
 def get_engines():
-    def get_subclasses(cls):
-        subclasses = set()
-        for subclass in cls.__subclasses__():
-            subclasses.add(subclass)
-            subclasses.update(get_subclasses(subclass))
-        return subclasses
-    return [tts_engine for tts_engine in
-            list(get_subclasses(AbstractTTSEngine))
-            if hasattr(tts_engine, 'SLUG') and tts_engine.SLUG]
+    return _registry.get_engines()
+
+
+_registry = registry.EngineRegistry(AbstractTTSEngine, 'tts')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Jasper TTS module')
@@ -241,7 +339,7 @@ if __name__ == '__main__':
     engines = get_engines()
     available_engines = []
     for engine in get_engines():
-        if engine.is_available():
+        if _registry.is_available(engine):
             available_engines.append(engine)
     disabled_engines = list(set(engines).difference(set(available_engines)))
     print("Available TTS engines:")
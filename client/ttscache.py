@@ -0,0 +1,218 @@
+# -*- coding: utf-8-*-
+"""
+An on-disk cache of synthesized phrases.
+
+Jasper says the same phrases over and over (the salutation, "Perdon?", the
+answers of Life and Chiste...). The AudioCache keeps their synthesized
+audio in <CONFIG_PATH>/ttscache, addressed by a hash of the engine, its
+settings and the normalized text, so that each phrase is synthesized once.
+
+Every entry is a file of raw int16 samples, named
+<key>-<rate>-<channels>.pcm. Hits are memory-mapped instead of read, and
+touched, so that the modification times give the order in which entries
+have been used: once the cache grows beyond max_bytes, the least recently
+used entries are removed.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import numpy
+import jasperconfig
+import jasperpath
+import metrics
+
+
+def normalize(text):
+    """
+    Returns:
+        text as NFC normalized unicode, with runs of whitespace collapsed
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def get_options(speaker):
+    """
+    Returns:
+        The settings of speaker that change how it sounds: its public
+        attributes with plain values, e.g. the voice
+    """
+    return dict((name, value) for name, value in vars(speaker).items()
+                if not name.startswith('_') and
+                isinstance(value, (basestring, int, long, float, bool,
+                                   type(None))))
+
+
+class AudioCache(object):
+
+    SUFFIX = '.pcm'
+
+    def __init__(self, path=None, max_bytes=50 * 1024 * 1024):
+        """
+        Arguments:
+            path -- (optional) the cache directory (Default:
+                    <CONFIG_PATH>/ttscache)
+            max_bytes -- size of the cache after which the least recently
+                         used entries are evicted
+        """
+        self._logger = logging.getLogger(__name__)
+        self.path = path if path else jasperpath.config('ttscache')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (file name, size), built from the directory on first use
+        self._entries = None
+        self._size = 0
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns:
+            An AudioCache configured by the tts_cache section of the
+            profile, or None if it has been disabled there
+        """
+        section = jasperconfig.get_section('tts_cache')
+        if not section.get('enabled', True):
+            return None
+        config = {}
+        if 'path' in section:
+            config['path'] = os.path.expanduser(section['path'])
+        if 'max_size_mb' in section:
+            config['max_bytes'] = int(float(section['max_size_mb']) *
+                                      1024 * 1024)
+        return cls(**config)
+
+    @staticmethod
+    def get_key(speaker, phrase):
+        """
+        Returns:
+            The key of phrase said by the TTS engine instance speaker
+        """
+        data = json.dumps([speaker.SLUG, get_options(speaker),
+                           normalize(phrase)], sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _scan(self):
+        # Called with the lock held
+        if self._entries is not None:
+            return
+        self._entries, self._size = {}, 0
+        if not os.path.isdir(self.path):
+            return
+        for fname in os.listdir(self.path):
+            if not fname.endswith(self.SUFFIX):
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.path, fname))
+            except OSError:
+                continue
+            self._entries[fname.split('-', 1)[0]] = (fname, size)
+            self._size += size
+
+    @property
+    def size(self):
+        with self._lock:
+            self._scan()
+            return self._size
+
+    def __contains__(self, key):
+        with self._lock:
+            self._scan()
+            return key in self._entries
+
+    def get(self, key):
+        """
+        Returns:
+            A tuple (samples, rate, channels), with the samples memory
+            mapped, or None if key isn't cached
+        """
+        with self._lock:
+            self._scan()
+            entry = self._entries.get(key)
+        if entry is None:
+            metrics.increment('ttscache.misses')
+            return None
+        fname, size = entry
+        fpath = os.path.join(self.path, fname)
+        try:
+            # Mark it as used
+            os.utime(fpath, None)
+            if size:
+                samples = numpy.memmap(fpath, dtype=numpy.int16, mode='r')
+            else:
+                samples = numpy.zeros(0, dtype=numpy.int16)
+        except (IOError, OSError, ValueError):
+            # E.g. evicted by another process meanwhile
+            self._logger.debug("Could not read cached audio '%s'", fpath,
+                               exc_info=True)
+            with self._lock:
+                if self._entries.pop(key, None) is not None:
+                    self._size -= size
+            metrics.increment('ttscache.misses')
+            return None
+        metrics.increment('ttscache.hits')
+        rate, channels = fname[:-len(self.SUFFIX)].split('-')[1:]
+        return (samples, int(rate), int(channels))
+
+    def put(self, key, samples, rate, channels):
+        """
+        Stores the synthesized audio of key and evicts the least recently
+        used entries if the cache has become too large.
+        """
+        data = numpy.asarray(samples, dtype=numpy.int16).tostring()
+        if len(data) > self.max_bytes:
+            return
+        fname = '%s-%d-%d%s' % (key, rate, channels, self.SUFFIX)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            jasperpath.atomic_write(os.path.join(self.path, fname),
+                                    lambda f: f.write(data))
+        except (IOError, OSError):
+            self._logger.warning("Could not write cached audio to '%s'",
+                                 self.path, exc_info=True)
+            return
+        with self._lock:
+            self._scan()
+            old = self._entries.get(key)
+            if old is not None:
+                self._size -= old[1]
+                if old[0] != fname:
+                    try:
+                        os.remove(os.path.join(self.path, old[0]))
+                    except OSError:
+                        pass
+            self._entries[key] = (fname, len(data))
+            self._size += len(data)
+            metrics.increment('ttscache.writes')
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Called with the lock held
+        used = []
+        for key, (fname, size) in self._entries.items():
+            try:
+                mtime = os.path.getmtime(os.path.join(self.path, fname))
+            except OSError:
+                mtime = 0
+            used.append((mtime, key))
+        used.sort()
+        for mtime, key in used:
+            if self._size <= self.max_bytes:
+                break
+            fname, size = self._entries.pop(key)
+            self._size -= size
+            try:
+                # Open memory maps of the entry stay valid
+                os.remove(os.path.join(self.path, fname))
+            except OSError:
+                pass
+            metrics.increment('ttscache.evictions')
+            self._logger.debug("Evicted cached audio '%s', unused for " +
+                               "%.0f s", fname, time.time() - mtime)
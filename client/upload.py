@@ -0,0 +1,160 @@
+# -*- coding: utf-8-*-
+"""
+Prepares utterances for the upload to a cloud STT engine.
+
+On a slow network the upload dominates the recognition latency, so the
+audio is trimmed to the speech it contains and encoded in the most compact
+format the engine accepts, e.g. FLAC instead of WAV.
+"""
+import io
+import logging
+import subprocess
+import time
+import wave
+import numpy
+import speech_recognition as sr
+import metrics
+from vad import VoiceActivityDetector
+
+CONTENT_TYPES = {'flac': 'audio/x-flac',
+                 'wav': 'audio/wav'}
+
+
+def trim_silence(samples, rate, padding=0.2, noise_percentile=10):
+    """
+    Cuts the silence at the start and the end of an utterance.
+
+    Arguments:
+        samples -- a numpy int16 array
+        rate -- sample rate in Hz
+        padding -- seconds of silence kept before and after the speech
+        noise_percentile -- percentile of the frame energies taken as the
+                            noise floor
+
+    Returns:
+        A numpy int16 array, samples itself if no speech has been found
+    """
+    vad = VoiceActivityDetector(rate, hangover=0)
+    frames = vad.frames(samples)
+    if not len(frames):
+        return samples
+    energy, zcr = vad.features(frames)
+    vad.noise_floor = max(float(numpy.percentile(energy, noise_percentile)),
+                          vad.min_noise_floor)
+    speech, smoothed = vad.process(samples)
+    speech_frames = numpy.flatnonzero(speech)
+    if not len(speech_frames):
+        return samples
+    pad = int(round(padding * rate))
+    start = max(0, speech_frames[0] * vad.frame_size - pad)
+    end = min(len(samples), (speech_frames[-1] + 1) * vad.frame_size + pad)
+    return samples[start:end]
+
+
+def encode_wav(samples, rate):
+    """
+    Returns:
+        A mono 16 bit WAV file as a string
+    """
+    f = io.BytesIO()
+    wav = wave.open(f, 'wb')
+    try:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tostring())
+    finally:
+        wav.close()
+    return f.getvalue()
+
+
+def encode_flac(samples, rate, compression=5):
+    """
+    Arguments:
+        samples -- a numpy int16 array
+        rate -- sample rate in Hz
+        compression -- FLAC compression level from 0 (fastest) to 8
+                       (smallest)
+
+    Returns:
+        A FLAC file as a string
+
+    Raises:
+        OSError if no FLAC encoder is available
+    """
+    proc = subprocess.Popen([sr.get_flac_converter(), '--stdout',
+                             '--totally-silent', '-%d' % compression, '-'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    data, _ = proc.communicate(encode_wav(samples, rate))
+    if proc.returncode != 0:
+        raise OSError("FLAC encoder exited with status %d" %
+                      proc.returncode)
+    return data
+
+
+class UploadEncoder(object):
+
+    def __init__(self, formats=('wav',), trim=True, padding=0.2,
+                 compression=5):
+        """
+        Arguments:
+            formats -- the formats accepted by the engine, most preferred
+                       first. Formats that can't be encoded here are
+                       skipped.
+            trim -- whether to cut the silent edges of the utterance
+            padding -- seconds of silence kept around the speech
+            compression -- FLAC compression level
+        """
+        self._logger = logging.getLogger(__name__)
+        self.formats = [fmt for fmt in formats if fmt in CONTENT_TYPES]
+        if not self.formats:
+            raise ValueError("None of the formats %r is supported" %
+                             (formats,))
+        self.trim = trim
+        self.padding = padding
+        self.compression = compression
+
+    def encode(self, audio):
+        """
+        Arguments:
+            audio -- a speech_recognition.AudioData instance of 16 bit audio
+
+        Returns:
+            A tuple of the encoded audio and its content type
+        """
+        start = time.time()
+        samples = numpy.frombuffer(audio.get_raw_data(convert_width=2),
+                                   dtype=numpy.int16)
+        original = len(samples)
+        if self.trim:
+            samples = trim_silence(samples, audio.sample_rate,
+                                   padding=self.padding)
+        for fmt in list(self.formats):
+            try:
+                if fmt == 'flac':
+                    data = encode_flac(samples, audio.sample_rate,
+                                       self.compression)
+                else:
+                    data = encode_wav(samples, audio.sample_rate)
+            except OSError as e:
+                self._logger.warning("Could not encode %s: %s", fmt, e)
+                # Don't try again with every utterance
+                if len(self.formats) > 1:
+                    self.formats.remove(fmt)
+                continue
+            break
+        else:
+            raise ValueError("Could not encode the audio in any of %r" %
+                             (self.formats,))
+        elapsed = time.time() - start
+        metrics.observe('upload.bytes', len(data))
+        metrics.observe('upload.encode_time', elapsed)
+        metrics.observe('upload.trimmed',
+                        float(original - len(samples)) / audio.sample_rate)
+        self._logger.debug("Prepared upload in %.1f ms: %.2f s of audio " +
+                           "trimmed to %.2f s, %d bytes of PCM as %d " +
+                           "bytes of %s", 1000 * elapsed,
+                           float(original) / audio.sample_rate,
+                           float(len(samples)) / audio.sample_rate,
+                           2 * original, len(data), fmt)
+        return data, CONTENT_TYPES[fmt]
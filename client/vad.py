@@ -0,0 +1,236 @@
+# -*- coding: utf-8-*-
+"""
+Voice activity detection and endpointing on blocks of int16 samples.
+
+The VoiceActivityDetector classifies fixed-size frames as speech or
+non-speech using their energy and zero-crossing rate. Its noise floor adapts
+to the non-speech frames it sees and is meant to outlive a single listen, so
+the ambient level doesn't have to be relearned every time.
+
+The Endpointer uses the detector to find the start and the end of an
+utterance in a stream of blocks.
+"""
+import logging
+import numpy
+
+
+class VoiceActivityDetector(object):
+
+    def __init__(self, rate, frame_duration=0.01, noise_floor=None,
+                 energy_ratio=3.0, unvoiced_ratio=1.5, zcr_threshold=0.25,
+                 hangover=0.2, adaptation=0.02, min_noise_floor=20.0,
+                 max_speech=5.0):
+        """
+        Arguments:
+            rate -- sample rate in Hz
+            frame_duration -- frame length in seconds
+            noise_floor -- (optional) initial RMS noise floor, e.g. from a
+                           previous calibration
+            energy_ratio -- frames louder than noise_floor * energy_ratio
+                            are speech
+            unvoiced_ratio -- frames louder than noise_floor * unvoiced_ratio
+                              are speech if their zero-crossing rate is above
+                              zcr_threshold (fricatives like 's')
+            zcr_threshold -- zero crossings per sample, see unvoiced_ratio
+            hangover -- seconds a speech decision is held after the last
+                        speech frame
+            adaptation -- weight of each non-speech frame in the noise floor
+            min_noise_floor -- lower bound of the noise floor
+            max_speech -- seconds of uninterrupted speech after which the
+                          ambient level is assumed to have risen and the
+                          noise floor is reset to the quietest frame seen
+        """
+        self._logger = logging.getLogger(__name__)
+        self.rate = rate
+        self.frame_size = int(round(rate * frame_duration))
+        self.energy_ratio = energy_ratio
+        self.unvoiced_ratio = unvoiced_ratio
+        self.zcr_threshold = zcr_threshold
+        self.hangover_frames = int(round(hangover / frame_duration))
+        self.adaptation = adaptation
+        self.min_noise_floor = min_noise_floor
+        self.noise_floor = noise_floor
+        self.max_speech_frames = int(round(max_speech / frame_duration))
+        # Frames since the last raw speech decision, carried across blocks
+        self._since_speech = self.hangover_frames + 1
+        # Length and quietest frame of the current run of speech frames
+        self._speech_run = 0
+        self._speech_run_min = None
+
+    @property
+    def threshold(self):
+        """
+        Returns:
+            The RMS energy above which a frame counts as speech, or None if
+            the detector hasn't seen any audio yet
+        """
+        if self.noise_floor is None:
+            return None
+        return self.noise_floor * self.energy_ratio
+
+    @threshold.setter
+    def threshold(self, value):
+        self.noise_floor = max(float(value) / self.energy_ratio,
+                               self.min_noise_floor)
+
+    def frames(self, samples):
+        """
+        Splits samples into a (n, frame_size) array, dropping the remainder.
+        """
+        num = len(samples) // self.frame_size
+        return numpy.asarray(samples[:num * self.frame_size],
+                             dtype=numpy.float64).reshape(num,
+                                                          self.frame_size)
+
+    def features(self, frames):
+        """
+        Returns:
+            A tuple of the RMS energy and the zero-crossing rate per frame
+        """
+        energy = numpy.sqrt((frames ** 2).mean(axis=1))
+        signs = numpy.signbit(frames)
+        zcr = (signs[:, 1:] != signs[:, :-1]).mean(axis=1)
+        return energy, zcr
+
+    def process(self, samples):
+        """
+        Classifies all complete frames in samples.
+
+        Arguments:
+            samples -- a numpy int16 array, its length should be a multiple
+                       of frame_size
+
+        Returns:
+            A tuple of two boolean arrays with one entry per frame: the raw
+            speech decisions and the decisions with hangover applied
+        """
+        frames = self.frames(samples)
+        if not len(frames):
+            empty = numpy.zeros(0, dtype=bool)
+            return empty, empty
+        energy, zcr = self.features(frames)
+        if self.noise_floor is None:
+            self.noise_floor = max(float(numpy.median(energy)),
+                                   self.min_noise_floor)
+
+        speech = ((energy > self.noise_floor * self.energy_ratio) |
+                  ((energy > self.noise_floor * self.unvoiced_ratio) &
+                   (zcr > self.zcr_threshold)))
+
+        # Hangover: distance of every frame to the last speech frame
+        idx = numpy.arange(len(speech))
+        last = numpy.where(speech, idx, -self._since_speech)
+        last = numpy.maximum.accumulate(last)
+        smoothed = (idx - last) <= self.hangover_frames
+        self._since_speech = int(len(speech) - last[-1])
+
+        # Adapt the noise floor to the non-speech frames, as if they had
+        # been averaged in one by one
+        noise = energy[~speech]
+        if len(noise):
+            decay = (1 - self.adaptation) ** len(noise)
+            self.noise_floor = max(decay * self.noise_floor +
+                                   (1 - decay) * float(noise.mean()),
+                                   self.min_noise_floor)
+            run = energy[numpy.flatnonzero(~speech)[-1] + 1:]
+            self._speech_run = 0
+            self._speech_run_min = None
+        else:
+            run = energy
+        if len(run):
+            self._speech_run += len(run)
+            run_min = float(run.min())
+            if self._speech_run_min is not None:
+                run_min = min(run_min, self._speech_run_min)
+            self._speech_run_min = run_min
+        if self._speech_run > self.max_speech_frames:
+            # Nobody talks that long, the ambient level has risen
+            self._logger.debug("Resetting noise floor from %.1f to %.1f",
+                               self.noise_floor, self._speech_run_min)
+            self.noise_floor = max(self._speech_run_min,
+                                   self.min_noise_floor)
+            self._speech_run = 0
+            self._speech_run_min = None
+        return speech, smoothed
+
+
+class Endpointer(object):
+    """
+    Finds the start and the end of an utterance with a VoiceActivityDetector.
+
+    Feed consecutive blocks with process() until it returns True.
+    """
+
+    WAITING, SPEAKING, ENDED = range(3)
+
+    def __init__(self, vad, silence_timeout=1.0, min_speech=0.1,
+                 max_duration=None):
+        """
+        Arguments:
+            vad -- the VoiceActivityDetector to use
+            silence_timeout -- seconds of silence that end an utterance
+            min_speech -- seconds of speech needed to start an utterance
+            max_duration -- (optional) maximum utterance length in seconds
+        """
+        self.vad = vad
+        frame_duration = float(vad.frame_size) / vad.rate
+        self.silence_frames = int(round(silence_timeout / frame_duration))
+        self.min_speech_frames = max(1, int(round(min_speech /
+                                                  frame_duration)))
+        self.max_frames = None if max_duration is None \
+            else int(round(max_duration / frame_duration))
+        self.reset()
+
+    def reset(self):
+        self.state = self.WAITING
+        # Frame indices relative to the first frame fed after reset()
+        self.frames_seen = 0
+        self.speech_start = None
+        self.last_speech = None
+        self.end = None
+        self._run = 0
+
+    def process(self, samples):
+        """
+        Arguments:
+            samples -- the next block of int16 samples
+
+        Returns:
+            True as soon as the end of the utterance has been found
+        """
+        if self.state == self.ENDED:
+            return True
+        raw, smoothed = self.vad.process(samples)
+        for i in range(len(smoothed)):
+            frame = self.frames_seen + i
+            if raw[i]:
+                self.last_speech = frame
+            if self.state == self.WAITING:
+                self._run = self._run + 1 if smoothed[i] else 0
+                if self._run >= self.min_speech_frames:
+                    self.state = self.SPEAKING
+                    self.speech_start = frame - self._run + 1
+                    if self.last_speech is None:
+                        self.last_speech = frame
+            elif self.state == self.SPEAKING:
+                silent = frame - self.last_speech
+                too_long = (self.max_frames is not None and
+                            frame - self.speech_start + 1 >= self.max_frames)
+                if silent >= self.silence_frames or too_long:
+                    self.state = self.ENDED
+                    self.end = frame + 1
+                    break
+        self.frames_seen += len(smoothed)
+        return self.state == self.ENDED
+
+    @property
+    def endpoint_lag(self):
+        """
+        Returns:
+            Seconds of audio between the last speech frame and the frame at
+            which the endpoint fired, or None if it hasn't fired yet
+        """
+        if self.end is None or self.last_speech is None:
+            return None
+        return (self.end - self.last_speech - 1) * \
+            float(self.vad.frame_size) / self.vad.rate
@@ -6,10 +6,10 @@ import sys
 import shutil
 import logging
 
-import yaml
 import argparse
 
-from client import tts, stt, jasperpath, diagnose
+from client import tts, stt, kws, jasperpath, jasperconfig, diagnose, \
+    rescoring, speechfilter, ttscache, presynth, metrics
 from client.conversation import Conversation
 
 # Add jasperpath.LIB_PATH to sys.path
@@ -73,9 +73,8 @@ class Jasper(object):
         # Read config
         self._logger.debug("Trying to read config file: '%s'", new_configfile)
         try:
-            with open(new_configfile, "r") as f:
-                self.config = yaml.safe_load(f)
-        except OSError:
+            self.config = jasperconfig.get_profile(required=True)
+        except (IOError, OSError):
             self._logger.error("Can't open config file: '%s'", new_configfile)
             raise
 
@@ -95,9 +94,59 @@ class Jasper(object):
                            "to '%s'", tts_engine_slug)
         tts_engine_class = tts.get_engine_by_slug(tts_engine_slug)
 
+        try:
+            kws_engine_slug = self.config['kws_engine']
+        except KeyError:
+            kws_engine_slug = kws.get_default_engine_slug()
+            self._logger.info("kws_engine not specified in profile, " +
+                              "defaulting to '%s'", kws_engine_slug)
+        try:
+            kws_engine_class = kws.get_engine_by_slug(kws_engine_slug)
+        except ValueError:
+            kws_engine_class = None
+            self._logger.warning("KWS engine '%s' is not available, every " +
+                                 "utterance will be sent to the STT engine " +
+                                 "while listening passively.",
+                                 kws_engine_slug, exc_info=True)
+
         # Initialize Mic
+        mic_kwargs = {'kws_engine': kws_engine_class}
+        if 'audio' in self.config:
+            if 'input_device' in self.config['audio']:
+                mic_kwargs['input_device'] = \
+                    int(self.config['audio']['input_device'])
+            if 'sample_rate' in self.config['audio']:
+                mic_kwargs['sample_rate'] = \
+                    int(self.config['audio']['sample_rate'])
+            if 'channels' in self.config['audio']:
+                mic_kwargs['channels'] = \
+                    int(self.config['audio']['channels'])
+            # Per device settings override the general ones
+            device = mic_kwargs.get('input_device', 0)
+            devices = self.config['audio'].get('devices', {})
+            if device in devices:
+                if 'sample_rate' in devices[device]:
+                    mic_kwargs['sample_rate'] = \
+                        int(devices[device]['sample_rate'])
+                if 'channels' in devices[device]:
+                    mic_kwargs['channels'] = int(devices[device]['channels'])
+            if 'lookback' in self.config['audio']:
+                mic_kwargs['lookback'] = \
+                    float(self.config['audio']['lookback'])
+            if 'silence_timeout' in self.config['audio']:
+                mic_kwargs['silence_timeout'] = \
+                    float(self.config['audio']['silence_timeout'])
+        # Prefer the alternative transcriptions the modules understand
+        mic_kwargs['rescorer'] = rescoring.Rescorer.from_modules()
+        # Don't upload coughs and door slams
+        mic_kwargs['speech_filter'] = \
+            speechfilter.SpeechFilter.get_instance()
+        # Jasper says the same phrases over and over
+        mic_kwargs['tts_cache'] = ttscache.AudioCache.get_instance()
         self.mic = Mic(tts_engine_class.get_instance(),
-                       stt_engine_class.get_active_instance())
+                       stt_engine_class.get_active_instance(), **mic_kwargs)
+        # The speaker plays on the output stream of the Mic as well
+        self.mic.speaker.output = self.mic.output
 
     def run(self):
         if 'first_name' in self.config:
@@ -108,7 +157,29 @@ class Jasper(object):
         self.mic.say(salutation)
         
         conversation = Conversation("espejo", self.mic, self.config)
-        conversation.handleForever()
+        # Synthesize what the modules say while Jasper is already listening
+        if getattr(self.mic, 'tts_cache', None) is not None:
+            phrases = presynth.get_phrases(
+                [conversation, conversation.brain] +
+                conversation.brain.modules)
+            presynth.PreSynthesizer(self.mic.speaker,
+                                    self.mic.tts_cache).start(phrases)
+        # Log what Jasper has been doing every log_interval seconds and
+        # when it stops, e.g. to see how long the STT engine takes
+        reporter = None
+        metrics_config = self.config.get('metrics', {})
+        if 'log_interval' in metrics_config:
+            reporter = metrics.Reporter(float(metrics_config['log_interval']))
+            reporter.start()
+        try:
+            conversation.handleForever()
+        finally:
+            if reporter is not None:
+                reporter.stop()
+                metrics.log()
+            # The capture stream stays open for the whole session
+            if hasattr(self.mic, 'close'):
+                self.mic.close()
         
 if __name__ == "__main__":
 
@@ -120,6 +191,7 @@ if __name__ == "__main__":
     logging.basicConfig()
     logger = logging.getLogger()
     logger.getChild("client.stt").setLevel(logging.INFO)
+    logger.getChild("client.metrics").setLevel(logging.INFO)
 
     if args.debug:
         logger.setLevel(logging.DEBUG)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import threading
+import mock
+import numpy
+from client import audiocapture
+
+
+class DummyStream(object):
+    def __init__(self, chunk_data, failures=0):
+        self.chunk_data = chunk_data
+        # Number of reads that fail, like those of an unplugged device
+        self.failures = failures
+        self.closed = False
+        self._event = threading.Event()
+
+    def read(self, num_frames, exception_on_overflow=True):
+        # Throttle a bit so that the reader thread doesn't spin
+        self._event.wait(0.001)
+        if self.failures:
+            self.failures -= 1
+            raise IOError('Device unavailable', -9985)
+        return self.chunk_data
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class DummyAudio(object):
+    def __init__(self, chunk_data, failures=()):
+        self.opened = []
+        self.chunk_data = chunk_data
+        # Failing reads of each stream opened
+        self.failures = list(failures)
+
+    def get_format_from_width(self, width):
+        return width
+
+    def open(self, **kwargs):
+        failures = self.failures.pop(0) if self.failures else 0
+        stream = DummyStream(self.chunk_data, failures)
+        self.opened.append(stream)
+        return stream
+
+
+class TestCaptureStream(unittest.TestCase):
+
+    def setUp(self):
+        self.audio = DummyAudio(b'\x01\x00' * 4)
+        self.capture = audiocapture.CaptureStream(self.audio, chunk=4)
+
+    def tearDown(self):
+        self.capture.close()
+
+    def testStreamIsOpenedOnce(self):
+        for i in range(3):
+            with self.capture.subscribe() as reader:
+                self.assertEqual(reader.read(4, timeout=1), b'\x01\x00' * 4)
+        self.assertEqual(len(self.audio.opened), 1)
+        self.assertFalse(self.audio.opened[0].closed)
+
+    def testReadAcrossChunks(self):
+        with self.capture.subscribe() as reader:
+            self.assertEqual(len(reader.read(6, timeout=1)), 12)
+            self.assertEqual(len(reader.read(2, timeout=1)), 4)
+
+    def testCloseWakesReaders(self):
+        reader = self.capture.subscribe()
+        self.capture.close()
+        self.assertTrue(self.audio.opened[0].closed)
+        with self.assertRaises(IOError):
+            while True:
+                reader.read(4, timeout=1)
+
+
+class TestDeviceFailure(unittest.TestCase):
+
+    def setUp(self):
+        self.retry_delay = audiocapture.CaptureStream.RETRY_DELAY
+        audiocapture.CaptureStream.RETRY_DELAY = 0.01
+
+    def tearDown(self):
+        audiocapture.CaptureStream.RETRY_DELAY = self.retry_delay
+
+    def testReopened(self):
+        audio = DummyAudio(b'\x01\x00' * 4, failures=[1])
+        capture = audiocapture.CaptureStream(audio, chunk=4)
+        with capture.subscribe() as reader:
+            self.assertEqual(reader.read(4, timeout=1), b'\x01\x00' * 4)
+        self.assertEqual(len(audio.opened), 2)
+        self.assertTrue(audio.opened[0].closed)
+        capture.close()
+
+    def testGivesUp(self):
+        audio = DummyAudio(b'\x01\x00' * 4, failures=[1, 1, 1])
+        capture = audiocapture.CaptureStream(audio, chunk=4, max_retries=2)
+        reader = capture.subscribe()
+        with self.assertRaises(IOError):
+            reader.read(4, timeout=1)
+        self.assertFalse(capture.is_active)
+        # Subscribing again tries the device again
+        with capture.subscribe() as reader:
+            self.assertEqual(reader.read(4, timeout=1), b'\x01\x00' * 4)
+        capture.close()
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = audiocapture.RingBuffer(8)
+
+    def testWrapAround(self):
+        self.ring.write(numpy.arange(6, dtype=numpy.int16))
+        self.ring.write(numpy.arange(6, 11, dtype=numpy.int16))
+        self.assertEqual(self.ring.position, 11)
+        self.assertEqual(self.ring.oldest, 3)
+        self.assertEqual(list(self.ring.read(3)), range(3, 11))
+        self.assertEqual(list(self.ring.read(5, 7)), [5, 6])
+
+    def testOverwrittenRange(self):
+        self.ring.write(numpy.arange(20, dtype=numpy.int16))
+        self.assertEqual(list(self.ring.read(12)), range(12, 20))
+        with self.assertRaises(ValueError):
+            self.ring.read(11)
+
+
+class TestPreroll(unittest.TestCase):
+
+    def testLookback(self):
+        capture = audiocapture.CaptureStream(DummyAudio(b'\x01\x00' * 4),
+                                             rate=100, chunk=4)
+        with capture.subscribe() as reader:
+            reader.read(40, timeout=1)
+        position = capture.position
+        with capture.subscribe(start=0, lookback=0.1) as reader:
+            self.assertGreaterEqual(reader.position, position - 10)
+            self.assertLessEqual(reader.preroll_frames, 10 + 4)
+        capture.close()
+
+
+class TestOverrun(unittest.TestCase):
+
+    def testPositionSkipsDroppedChunks(self):
+        capture = mock.Mock(frame_width=2)
+        reader = audiocapture.CaptureReader(capture, maxsize=2, position=0,
+                                            preroll=b'\x00\x00' * 2)
+        for i in range(4):
+            chunk = numpy.arange(4 * i, 4 * i + 4, dtype=numpy.int16)
+            reader._put(chunk.tostring(), 2 + 4 * i)
+        self.assertEqual(reader.overruns, 2)
+        data = numpy.frombuffer(reader.read(4, timeout=1), dtype=numpy.int16)
+        # The pre-roll and the first two chunks are gone
+        self.assertEqual(list(data), range(8, 12))
+        self.assertEqual(reader.position, 14)
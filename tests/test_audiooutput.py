@@ -0,0 +1,221 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import threading
+import wave
+import mock
+import numpy
+from client import audiooutput, jasperpath, metrics
+
+
+class DummyStream(object):
+    def __init__(self, delay=0, underflows=(), fail=False):
+        self.written = []
+        self.fail = fail
+        self.closed = False
+        self.delay = delay
+        # Indices of the writes that underflow
+        self.underflows = underflows
+        self._event = threading.Event()
+
+    def write(self, data, exception_on_underflow=False):
+        self._event.wait(self.delay)
+        if self.fail:
+            raise IOError('Unanticipated host error', -9999)
+        self.written.append(data)
+        if len(self.written) - 1 in self.underflows and \
+                exception_on_underflow:
+            raise IOError('Output underflowed',
+                          audiooutput.OUTPUT_UNDERFLOWED)
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class DummyAudio(object):
+    def __init__(self, delay=0, underflows=()):
+        self.opened = []
+        self.delay = delay
+        self.underflows = underflows
+        self.devices = [{'name': 'HDA Intel: ALC (hw:0,0)',
+                         'maxOutputChannels': 2},
+                        {'name': 'USB Audio Device: Mic (hw:1,0)',
+                         'maxOutputChannels': 0},
+                        {'name': 'USB Audio Device: Speaker (hw:1,1)',
+                         'maxOutputChannels': 2}]
+
+    def get_format_from_width(self, width):
+        return width
+
+    def get_device_count(self):
+        return len(self.devices)
+
+    def get_device_info_by_index(self, index):
+        return self.devices[index]
+
+    def open(self, **kwargs):
+        self.kwargs = kwargs
+        stream = DummyStream(self.delay, self.underflows)
+        self.opened.append(stream)
+        return stream
+
+
+class TestReadWav(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.fname = os.path.join(self.path, 'test.wav')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testMemoryMapped(self):
+        expected = numpy.arange(-500, 500, dtype=numpy.int16)
+        wav = wave.open(self.fname, 'wb')
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(22050)
+        wav.writeframes(expected.tostring())
+        wav.close()
+        samples, rate, channels = audiooutput.read_wav(self.fname)
+        self.assertIsInstance(samples, numpy.memmap)
+        self.assertTrue(numpy.array_equal(samples, expected))
+        self.assertEqual((rate, channels), (22050, 2))
+
+    def testOtherChunks(self):
+        data = numpy.arange(11, dtype=numpy.int16).tostring()
+        fmt = struct.pack('<HHIIHH', 1, 1, 16000, 32000, 2, 16)
+        chunks = ('LIST' + struct.pack('<I', 3) + 'abc\0' +
+                  'fmt ' + struct.pack('<I', len(fmt)) + fmt +
+                  # Claims more than was written
+                  'data' + struct.pack('<I', 0xFFFFFFFF) + data)
+        with open(self.fname, 'wb') as f:
+            f.write('RIFF' + struct.pack('<I', 4 + len(chunks)) + 'WAVE' +
+                    chunks)
+        samples, rate, channels = audiooutput.read_wav(self.fname)
+        self.assertEqual(list(samples), range(11))
+        self.assertEqual((rate, channels), (16000, 1))
+
+    def testNotPcm16(self):
+        wav = wave.open(self.fname, 'wb')
+        wav.setnchannels(1)
+        wav.setsampwidth(1)
+        wav.setframerate(8000)
+        wav.writeframes('\x80' * 100)
+        wav.close()
+        self.assertRaises(ValueError, audiooutput.read_wav, self.fname)
+
+
+class TestAudioCue(unittest.TestCase):
+
+    def testFromFile(self):
+        cue = audiooutput.AudioCue.from_file(jasperpath.data('audio',
+                                                             'beep_hi.wav'))
+        self.assertEqual(cue.rate, 44100)
+        self.assertEqual(cue.channels, 2)
+        self.assertAlmostEqual(cue.duration, 9403 / 44100.0)
+        mono = cue.get_samples(16000, 1)
+        self.assertAlmostEqual(len(mono), 9403 * 16000 / 44100, delta=1)
+        self.assertIs(cue.get_samples(16000, 1), mono)
+
+
+class TestOutputStream(unittest.TestCase):
+
+    def testPlayIsAsynchronous(self):
+        audio = DummyAudio(delay=0.01)
+        output = audiooutput.OutputStream(audio, rate=16000, channels=1,
+                                          chunk=100)
+        playback = output.play(numpy.zeros(1000, dtype=numpy.int16))
+        self.assertFalse(playback.done)
+        self.assertTrue(playback.wait(5))
+        self.assertEqual(len(audio.opened[0].written), 10)
+        output.play(numpy.zeros(100, dtype=numpy.int16)).wait(5)
+        self.assertEqual(len(audio.opened), 1)
+        output.close()
+        self.assertTrue(audio.opened[0].closed)
+
+    def testStop(self):
+        audio = DummyAudio(delay=0.01)
+        output = audiooutput.OutputStream(audio, rate=16000, channels=1,
+                                          chunk=100)
+        first = output.play(numpy.zeros(100000, dtype=numpy.int16))
+        second = output.play(numpy.zeros(100000, dtype=numpy.int16))
+        output.stop()
+        self.assertTrue(first.wait(5))
+        self.assertTrue(second.wait(5))
+        self.assertTrue(second.cancelled)
+        self.assertLess(len(audio.opened[0].written), 100)
+        output.close()
+
+    def testPlayFile(self):
+        audio = DummyAudio()
+        output = audiooutput.OutputStream(audio, rate=44100, channels=2,
+                                          chunk=1000)
+        output.play_file(jasperpath.data('audio', 'beep_hi.wav')).wait(5)
+        self.assertEqual(sum(len(data) for data in audio.opened[0].written),
+                         9403 * 2 * 2)
+        output.close()
+
+    def testDeviceByName(self):
+        audio = DummyAudio()
+        output = audiooutput.OutputStream(audio, device_index='USB Audio')
+        output.start()
+        self.assertEqual(audio.kwargs['output_device_index'], 2)
+        self.assertEqual(output.device_index, 2)
+        output.close()
+        output = audiooutput.OutputStream(audio, device_index='Bluetooth')
+        self.assertRaises(ValueError, output.start)
+
+    def testConfig(self):
+        section = {'output_device': 'USB Audio', 'output_rate': '16000',
+                   'output_channels': 1, 'output_buffer': 256}
+        with mock.patch('client.jasperconfig.get_section',
+                        return_value=section):
+            output = audiooutput.OutputStream.get_instance(DummyAudio(),
+                                                           chunk=512)
+        self.assertEqual(output.device_index, 'USB Audio')
+        self.assertEqual((output.rate, output.channels, output.chunk),
+                         (16000, 1, 512))
+
+    def testUnderruns(self):
+        metrics.reset()
+        # The first write after being idle underflows anyway
+        audio = DummyAudio(underflows=(0, 2, 5))
+        output = audiooutput.OutputStream(audio, rate=16000, channels=1,
+                                          chunk=100)
+        first = output.play(numpy.zeros(300, dtype=numpy.int16))
+        second = output.play(numpy.zeros(300, dtype=numpy.int16))
+        self.assertTrue(second.wait(5))
+        self.assertEqual((first.underruns, second.underruns), (1, 1))
+        self.assertEqual(output.underruns, 2)
+        self.assertEqual(metrics.counter('audiooutput.underruns'), 2)
+        self.assertEqual(len(audio.opened[0].written), 6)
+        self.assertIsNotNone(metrics.last('audiooutput.latency'))
+        output.close()
+
+    def testWriteError(self):
+        metrics.reset()
+        audio = DummyAudio(delay=0.01)
+        output = audiooutput.OutputStream(audio, rate=16000, channels=1,
+                                          chunk=100)
+        output.start()
+        audio.opened[0].fail = True
+        first = output.play(numpy.zeros(1000, dtype=numpy.int16))
+        second = output.play(numpy.zeros(1000, dtype=numpy.int16))
+        self.assertTrue(first.wait(5))
+        self.assertTrue(second.wait(5))
+        self.assertTrue(first.cancelled)
+        self.assertEqual(metrics.counter('audiooutput.errors'), 1)
+        self.assertTrue(audio.opened[0].closed)
+        # The queued buffer is played on a reopened stream
+        self.assertFalse(second.cancelled)
+        self.assertEqual(len(audio.opened), 2)
+        self.assertEqual(len(audio.opened[1].written), 10)
+        output.close()
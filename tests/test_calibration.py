@@ -0,0 +1,36 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+from client import calibration
+
+
+class TestCalibrationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'calibration.yml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testPersistence(self):
+        store = calibration.CalibrationStore(path=self.path)
+        self.assertIsNone(store.get('USB Mic', 16000))
+        store.update('USB Mic', 16000, 123.5)
+        store.save()
+
+        store = calibration.CalibrationStore(path=self.path)
+        self.assertEqual(store.get('USB Mic', 16000), 123.5)
+        self.assertIsNone(store.get('USB Mic', 44100))
+
+    def testPeriodicSave(self):
+        store = calibration.CalibrationStore(path=self.path,
+                                             save_interval=3600)
+        store.update('USB Mic', 16000, 50)
+        self.assertFalse(os.path.exists(self.path))
+        store.save_interval = 0
+        store.update('USB Mic', 16000, 60)
+        self.assertTrue(os.path.exists(self.path))
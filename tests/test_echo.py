@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import numpy
+from client import audiooutput, echo, jasperpath, resample, vad
+
+RATE = 16000
+
+
+def tone(duration, freq=300, level=8000):
+    t = numpy.arange(int(RATE * duration)) / float(RATE)
+    return (level * numpy.sin(2 * numpy.pi * freq * t)).astype(numpy.int16)
+
+
+class TestPlaybackGate(unittest.TestCase):
+
+    def setUp(self):
+        self.reference = tone(1.0)
+        self.gate = echo.PlaybackGate(self.reference, RATE, coupling=1.0)
+
+    def testSuppressesEcho(self):
+        frame = (self.reference[1600:1760] * 0.5).astype(numpy.int16)
+        gated = self.gate.process(frame, 0.1)
+        self.assertLess(numpy.abs(gated).max(), numpy.abs(frame).max() / 10)
+        self.assertEqual(self.gate.suppressed, 1)
+        # The coupling moves towards the real echo level
+        self.assertLess(self.gate.coupling, 1.0)
+
+    def testPassesDoubleTalk(self):
+        for i in range(50):
+            frame = (self.reference[1600:1760] * 0.1).astype(numpy.int16)
+            self.gate.process(frame, 0.1)
+        user = tone(0.01, freq=150, level=6000)
+        frame = (self.reference[1600:1760] * 0.1).astype(numpy.int16) + user
+        self.assertTrue((self.gate.process(frame, 0.1) == frame).all())
+
+    def testNoPlayback(self):
+        frame = tone(0.01, level=100)
+        self.assertTrue((self.gate.process(frame, 5.0) == frame).all())
+        self.assertTrue((self.gate.process(frame, -1.0) == frame).all())
+
+
+class TestCueEcho(unittest.TestCase):
+
+    def setUp(self):
+        self.cue = audiooutput.AudioCue.from_file(
+            jasperpath.data('audio', 'beep_hi.wav'))
+        echo_samples = resample.resample(
+            resample.downmix(self.cue.samples, self.cue.channels),
+            self.cue.rate, RATE)
+        rng = numpy.random.RandomState(0)
+        background = (rng.randn(RATE) * 50).astype(numpy.int16)
+        # The mic picks up the beep 50 ms after the recording started
+        self.captured = background.copy()
+        start = int(0.05 * RATE)
+        self.captured[start:start + len(echo_samples)] += \
+            (echo_samples * 0.5).astype(numpy.int16)
+        self.detector = vad.VoiceActivityDetector(RATE)
+        self.detector.process(background)
+
+    def record(self, gate):
+        endpointer = vad.Endpointer(self.detector)
+        block = self.detector.frame_size * 10
+        for i in range(0, len(self.captured), block):
+            samples = self.captured[i:i + block]
+            if gate is not None:
+                samples = gate.process_block(samples,
+                                             float(i) / RATE - 0.05, RATE,
+                                             self.detector.frame_size)
+            endpointer.process(samples)
+        return endpointer
+
+    def testCueOnlyRecordingTimesOut(self):
+        gate = echo.PlaybackGate(self.cue.samples, self.cue.rate,
+                                 channels=self.cue.channels,
+                                 floor=self.detector.noise_floor)
+        endpointer = self.record(gate)
+        self.assertEqual(endpointer.state, vad.Endpointer.WAITING)
+        self.assertGreater(gate.suppressed, 0)
+
+    def testSpeechDuringCue(self):
+        start = int(0.1 * RATE)
+        user = tone(0.5, freq=150, level=6000)
+        self.captured[start:start + len(user)] += user
+        gate = echo.PlaybackGate(self.cue.samples, self.cue.rate,
+                                 channels=self.cue.channels,
+                                 floor=self.detector.noise_floor)
+        self.assertNotEqual(self.record(gate).state,
+                            vad.Endpointer.WAITING)
+
+    def testUngatedCueStartsUtterance(self):
+        self.assertNotEqual(self.record(None).state,
+                            vad.Endpointer.WAITING)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import numpy
+from client import festival, tts
+
+# Speaks enough of festival's server protocol for the FestivalServer. Every
+# sentence is answered with its own waveform, 100 samples per character.
+FAKE_FESTIVAL = r'''#!%(python)s
+import io, os, re, socket, struct, sys, wave
+KEY = 'ft_StUfF_key'
+script, log = sys.argv[2], sys.argv[0] + '.log'
+port = int(re.search(r'server_port (\d+)', open(script).read()).group(1))
+server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(('127.0.0.1', port))
+server.listen(1)
+
+def stuff(data):
+    return data.replace(KEY[:-1], KEY[:-1] + 'X') + KEY
+
+def riff(text):
+    f = io.BytesIO()
+    wav = wave.open(f, 'wb')
+    wav.setnchannels(1)
+    wav.setsampwidth(2)
+    wav.setframerate(16000)
+    wav.writeframes(struct.pack('<%%dh' %% (100 * len(text)),
+                                *[len(text)] * (100 * len(text))))
+    wav.close()
+    return f.getvalue()
+
+while True:
+    conn, address = server.accept()
+    for line in conn.makefile('rb'):
+        with open(log, 'a') as f:
+            f.write(line)
+        match = re.match(r'\(tts_textall "(.*)" \'nil\)$', line.strip())
+        if match:
+            text = match.group(1).replace('\\"', '"')
+            if 'CRASH' in text:
+                os._exit(1)
+            if 'FAIL' in text:
+                conn.sendall('ER\n')
+                continue
+            for sentence in [s for s in text.split('.') if s.strip()]:
+                conn.sendall('WV\n' + stuff(riff(sentence)))
+        else:
+            conn.sendall('LP\n' + stuff('nil'))
+        conn.sendall('OK\n')
+    conn.close()
+'''
+
+
+class TestReplyReader(unittest.TestCase):
+
+    def testStuffedKey(self):
+        ours, theirs = socket.socketpair()
+        payload = 'abc' + festival.KEY + 'ft_StUfF_keX' + 'def'
+        stuffed = payload.replace(festival.KEY[:-1],
+                                  festival.KEY[:-1] + 'X')
+        theirs.sendall('WV\n' + stuffed + festival.KEY + 'ER\n')
+        reader = festival.ReplyReader(ours, chunk_size=5)
+        replies = reader.replies()
+        self.assertEqual(next(replies), ('WV', payload))
+        self.assertRaises(festival.CommandError, next, replies)
+        ours.close()
+        theirs.close()
+
+    def testQuote(self):
+        self.assertEqual(festival.quote('di "hola" \\'),
+                         '"di \\"hola\\" \\\\"')
+
+
+class TestFestivalServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.command = os.path.join(self.tempdir, 'festival')
+        with open(self.command, 'w') as f:
+            f.write(FAKE_FESTIVAL % {'python': sys.executable})
+        os.chmod(self.command, stat.S_IRWXU)
+        self.server = festival.FestivalServer(command=self.command,
+                                              voice='el_diphone',
+                                              check_interval=0.05)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tempdir)
+
+    def commands(self):
+        with open(self.command + '.log') as f:
+            return f.read().splitlines()
+
+    def testSynthesize(self):
+        chunks = list(self.server.synthesize('Hola. Que tal'))
+        self.assertEqual(len(chunks), 2)
+        samples, rate, channels = chunks[1]
+        self.assertEqual((len(samples), rate, channels), (800, 16000, 1))
+        self.assertTrue(numpy.all(samples == 8))
+        self.assertIn("(voice_el_diphone)", self.commands())
+        self.assertIn('(tts_textall "Hola. Que tal" \'nil)', self.commands())
+
+    def testStaysWarm(self):
+        list(self.server.synthesize('uno'))
+        process = self.server._process
+        list(self.server.synthesize('dos'))
+        self.assertIs(self.server._process, process)
+
+    def testAbandonedSynthesis(self):
+        chunks = self.server.synthesize('Uno. Dos. Tres')
+        next(chunks)
+        chunks.close()
+        self.assertEqual([len(c[0]) for c in
+                          self.server.synthesize('Cuatro')], [600])
+
+    def testCrash(self):
+        list(self.server.synthesize('uno'))
+        with self.assertRaises(festival.FestivalError):
+            list(self.server.synthesize('CRASH'))
+        self.assertEqual(len(list(self.server.synthesize('dos'))), 1)
+
+    def testCommandError(self):
+        list(self.server.synthesize('uno'))
+        process = self.server._process
+        with self.assertRaises(festival.CommandError):
+            list(self.server.synthesize('FAIL'))
+        # Neither restarted nor disconnected
+        self.assertIs(self.server._process, process)
+        self.assertEqual(self.server._restarts, [])
+        self.assertEqual(len(list(self.server.synthesize('dos'))), 1)
+
+    def testLockReleasedWhilePlaying(self):
+        chunks = self.server.synthesize('Uno. Dos')
+        next(chunks)
+        acquired = []
+
+        def acquire():
+            acquired.append(self.server._lock.acquire(False))
+            if acquired[0]:
+                self.server._lock.release()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        self.assertEqual(acquired, [True])
+        self.assertEqual(len(list(chunks)), 1)
+
+    def testSupervisor(self):
+        self.server.start()
+        process = self.server._process
+        process.kill()
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            # Not while the supervisor is restarting it
+            with self.server._lock:
+                if self.server._process is not process:
+                    break
+            time.sleep(0.05)
+        with self.server._lock:
+            self.assertTrue(self.server.is_running)
+            self.assertIsNot(self.server._process, process)
+
+    def testMissingExecutable(self):
+        server = festival.FestivalServer(
+            command=os.path.join(self.tempdir, 'nonexistant'))
+        with self.assertRaises(festival.FestivalError):
+            list(server.synthesize('hola'))
+
+
+class TestFestivalTTS(unittest.TestCase):
+
+    def testSynthesize(self):
+        tempdir = tempfile.mkdtemp()
+        command = os.path.join(tempdir, 'festival')
+        with open(command, 'w') as f:
+            f.write(FAKE_FESTIVAL % {'python': sys.executable})
+        os.chmod(command, stat.S_IRWXU)
+        engine = tts.FestivalTTS(server=False)
+        engine._server = festival.FestivalServer(command=command)
+        try:
+            samples, rate, channels = engine.synthesize(u'Sí. No')
+            self.assertEqual(len(samples), 500)
+            with open(command + '.log') as f:
+                self.assertIn('(tts_textall "S\xed. No" \'nil)',
+                              f.read().splitlines())
+        finally:
+            engine.close()
+            shutil.rmtree(tempdir)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import mock
+from client import health
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = health.CircuitBreaker('test', window=4,
+                                             min_requests=2,
+                                             max_error_rate=0.5,
+                                             reset_timeout=10)
+
+    def testOpensOnErrors(self):
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, health.CLOSED)
+        self.breaker.record_failure(0.1)
+        self.assertEqual(self.breaker.state, health.OPEN)
+        self.assertAlmostEqual(self.breaker.error_rate, 0.5)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertRaises(health.CircuitOpenError, self.breaker.check)
+
+    def testNeedsMinRequests(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, health.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+
+    def testHalfOpenProbe(self):
+        with mock.patch('time.time', return_value=100):
+            self.breaker.record_failure()
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, health.OPEN)
+        with mock.patch('time.time', return_value=111):
+            # Only one probe at a time
+            self.assertTrue(self.breaker.allow_request())
+            self.assertEqual(self.breaker.state, health.HALF_OPEN)
+            self.assertFalse(self.breaker.allow_request())
+            # A failed probe opens the breaker again
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state, health.OPEN)
+            self.assertFalse(self.breaker.allow_request())
+        with mock.patch('time.time', return_value=122):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record_success(0.2)
+        self.assertEqual(self.breaker.state, health.CLOSED)
+        self.assertEqual(self.breaker.error_rate, 0.0)
+
+    def testLatency(self):
+        self.breaker.record_success(1.0)
+        self.assertEqual(self.breaker.latency, 1.0)
+        self.breaker.record_success(2.0)
+        self.assertAlmostEqual(self.breaker.latency, 1.2)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+from client import jasperconfig
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'profile.yml')
+        self.snapshot_path = os.path.join(self.tempdir, 'profile.cache')
+        self.write("stt_engine: IBM\nkeys:\n  USER: user\n  PASS: secret\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, text, mtime=None):
+        with open(self.path, 'w') as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def getProfile(self):
+        return jasperconfig.Profile(path=self.path,
+                                    snapshot_path=self.snapshot_path,
+                                    check_interval=0)
+
+    def testParsedOnce(self):
+        profile = self.getProfile()
+        with mock.patch('yaml.safe_load',
+                        side_effect=jasperconfig.yaml.safe_load) as load:
+            self.assertEqual(profile.get()['stt_engine'], 'IBM')
+            self.assertEqual(profile.get_section('keys')['USER'], 'user')
+            self.assertEqual(profile.get_section('julius'), {})
+            self.assertEqual(load.call_count, 1)
+
+    def testReload(self):
+        profile = self.getProfile()
+        self.assertEqual(profile.get()['stt_engine'], 'IBM')
+        self.write("stt_engine: ATT\n", mtime=1000000000)
+        self.assertEqual(profile.get()['stt_engine'], 'ATT')
+
+    def testSnapshot(self):
+        self.getProfile().get()
+        self.assertTrue(os.path.exists(self.snapshot_path))
+        with mock.patch('yaml.safe_load') as load:
+            self.assertEqual(self.getProfile().get()['stt_engine'], 'IBM')
+            self.assertFalse(load.called)
+
+    def testStaleSnapshot(self):
+        self.getProfile().get()
+        self.write("stt_engine: ATT\n", mtime=1000000000)
+        self.assertEqual(self.getProfile().get()['stt_engine'], 'ATT')
+
+    def testBrokenSnapshot(self):
+        self.getProfile().get()
+        with open(self.snapshot_path, 'rb') as f:
+            data = f.read()
+        # Truncated, and referring to a class that doesn't exist (anymore)
+        for broken in (data[:len(data) // 2],
+                       "cjasperconfig\nNoSuchClass\np0\n."):
+            with open(self.snapshot_path, 'wb') as f:
+                f.write(broken)
+            self.assertEqual(self.getProfile().get()['stt_engine'], 'IBM')
+
+    def testMissing(self):
+        os.remove(self.path)
+        profile = self.getProfile()
+        self.assertEqual(profile.get(), {})
+        self.assertRaises(IOError, profile.get, required=True)
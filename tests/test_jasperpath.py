@@ -0,0 +1,37 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+from client import jasperpath
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testWrite(self):
+        jasperpath.atomic_write(self.path, lambda f: f.write(b'data'))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+        self.assertEqual(os.listdir(self.tempdir), ['file'])
+
+    def testWriterFails(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'old')
+
+        def writer(f):
+            f.write(b'new')
+            raise IOError("disk full")
+        self.assertRaises(IOError, jasperpath.atomic_write, self.path,
+                          writer)
+        # The old file is kept and the temporary file is gone
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(os.listdir(self.tempdir), ['file'])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8-*-
+import unittest
+from client import keepalive, metrics, sttserver
+
+
+class TestKeepAliveSession(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.server = sttserver.LocalSTTServer().start()
+        self.session = keepalive.KeepAliveSession('test')
+        self.url = self.server.url + '/v1/recognize'
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+
+    def testReuse(self):
+        for i in range(3):
+            self.session.post(self.url, data=b'\x00' * 320)
+        self.assertEqual(self.session.opened, 1)
+        self.assertEqual(self.session.reused, 2)
+        self.assertAlmostEqual(self.session.reuse_rate, 2 / 3.0)
+        self.assertEqual(metrics.counter('test.connections_reused'), 2)
+
+    def testPreconnect(self):
+        self.session.preconnect(self.server.url)
+        self.session.wait_preconnect()
+        self.assertIsNotNone(self.session.handshake_time)
+        self.session.post(self.url, data=b'\x00' * 320)
+        self.assertEqual(self.session.opened, 0)
+        self.assertEqual(self.session.reused, 1)
+        self.assertEqual(metrics.summary('test.handshake_saved')['count'], 1)
+
+    def testPreconnectFailure(self):
+        session = keepalive.KeepAliveSession('test')
+        # Nothing listens on port 1
+        session.preconnect('http://localhost:1')
+        session.wait_preconnect()
+        self.assertIsNone(session.handshake_time)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import mock
+import numpy
+from client import kws
+
+RATE = 16000
+
+
+def chirp(duration=0.5, f0=300, f1=3000):
+    t = numpy.arange(int(RATE * duration)) / float(RATE)
+    phase = 2 * numpy.pi * (f0 * t + (f1 - f0) * t ** 2 / (2 * duration))
+    return (8000 * numpy.sin(phase)).astype(numpy.int16)
+
+
+def noise(duration, seed=0):
+    rng = numpy.random.RandomState(seed)
+    return (rng.randn(int(RATE * duration)) * 300).astype(numpy.int16)
+
+
+class TestTemplateKWS(unittest.TestCase):
+
+    def setUp(self):
+        self.spotter = kws.TemplateKWS(['JASPER', 'espejo'], RATE,
+                                       templates={'JASPER': [chirp()]})
+
+    def feed(self, samples):
+        detected = []
+        size = self.spotter.frame_size
+        for i in range(0, len(samples) - size + 1, size):
+            keyword = self.spotter.process(samples[i:i + size])
+            if keyword:
+                detected.append(keyword)
+        return detected
+
+    def testDetectsKeyword(self):
+        samples = numpy.concatenate((noise(0.3), chirp(), noise(0.3, 1)))
+        self.assertIn('JASPER', self.feed(samples))
+
+    def testIgnoresNoise(self):
+        self.assertEqual(self.feed(noise(1.5)), [])
+
+    def testInvalidFrameDuration(self):
+        with self.assertRaises(ValueError):
+            kws.TemplateKWS(['JASPER'], RATE, templates={},
+                            frame_duration=0.05)
+
+    def testGetEngineBySlug(self):
+        self.assertIs(kws.get_engine_by_slug('template-kws'),
+                      kws.TemplateKWS)
+        with self.assertRaises(ValueError):
+            kws.get_engine_by_slug('nonexistant-kws')
+        with self.assertRaises(ValueError):
+            kws.get_engine_by_slug(None)
+
+
+class TestPocketSphinxKWS(unittest.TestCase):
+
+    def setUp(self):
+        self.create_decoder = mock.patch.object(kws.PocketSphinxKWS,
+                                                '_create_decoder').start()
+        self.g2p = mock.patch.object(kws, 'PhonetisaurusG2P').start()
+        self.g2p.get_config.return_value = {}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getPronunciations(self):
+        return self.create_decoder.call_args[0][4]
+
+    def testKeywordWithoutPronunciation(self):
+        self.g2p.side_effect = OSError("Can't find command")
+        with self.assertRaises(ValueError):
+            kws.PocketSphinxKWS(['espejo'], RATE)
+
+    def testDerivedPronunciation(self):
+        self.g2p.return_value.translate.return_value = {
+            'ESPEJO': ['EH S P EY HH OW', 'EH S P EH JH OW']}
+        kws.PocketSphinxKWS(['espejo', 'jasper'], RATE)
+        self.g2p.return_value.translate.assert_called_once_with(['ESPEJO'])
+        self.assertEqual(self.getPronunciations(),
+                         {'ESPEJO': 'EH S P EY HH OW'})
+
+    def testProfilePronunciation(self):
+        kws.PocketSphinxKWS(['espejo'], RATE,
+                            pronunciations={'espejo': 'EH S P EH HH OW'})
+        self.assertFalse(self.g2p.called)
+        self.assertEqual(self.getPronunciations(),
+                         {'ESPEJO': 'EH S P EH HH OW'})
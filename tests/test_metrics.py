@@ -0,0 +1,51 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import logging
+import time
+import unittest
+import mock
+from client import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+
+    def testCounter(self):
+        self.metrics.increment('foo')
+        self.metrics.increment('foo', 2)
+        self.assertEqual(self.metrics.counter('foo'), 3)
+        self.assertEqual(self.metrics.counter('bar'), 0)
+
+    def testSummary(self):
+        self.assertIsNone(self.metrics.summary('latency'))
+        for i in range(1, 101):
+            self.metrics.observe('latency', i)
+        summary = self.metrics.summary('latency')
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['p50'], 51)
+        self.assertEqual(summary['p95'], 95)
+        self.assertEqual(summary['p99'], 99)
+
+    def testTimer(self):
+        with self.metrics.timer('block'):
+            pass
+        self.assertEqual(self.metrics.summary('block')['count'], 1)
+        self.assertIn('block', self.metrics.snapshot()['distributions'])
+
+    def testReporter(self):
+        self.metrics.increment('foo')
+        logger = mock.Mock()
+        reporter = metrics.Reporter(0.01, self.metrics, logger)
+        reporter.start()
+        try:
+            for i in range(100):
+                if logger.log.called:
+                    break
+                time.sleep(0.01)
+        finally:
+            reporter.stop()
+            reporter.join(1)
+        self.assertFalse(reporter.is_alive())
+        logger.log.assert_any_call(logging.INFO, "%s: %g", 'foo', 1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import collections
+import threading
+import time
+import unittest
+import mock
+from client import pipeline
+
+# Like mic.Utterance, the Mic can't be imported without PyAudio
+Utterance = collections.namedtuple('Utterance', ['audio', 'stream'])
+
+
+class FakeMic(object):
+    """
+    Hears the keyword followed by each of the given commands, one after the
+    other, then nothing but silence.
+    """
+
+    def __init__(self, commands, transcription_time=0.0):
+        self.commands = list(commands)
+        self.transcription_time = transcription_time
+        self.recorded = []
+        self.said = []
+        self.lock = threading.Lock()
+
+    def passiveListen(self, PERSONA, LISTEN_TIME=5, THRESHOLD_TIME=5,
+                      interrupt=None):
+        with self.lock:
+            if self.commands:
+                return (1, PERSONA)
+        # Nobody says anything, wait for LISTEN_TIME like the real Mic
+        interrupt.wait(LISTEN_TIME)
+        return (1, None)
+
+    def recordUtterance(self, threshold, listen_time=5):
+        with self.lock:
+            command = self.commands.pop(0)
+            self.recorded.append((command, time.time()))
+        if command is None:
+            # The keyword wasn't followed by a command
+            return None
+        return Utterance(command, mock.Mock())
+
+    def transcribeUtterance(self, utterance):
+        time.sleep(self.transcription_time)
+        return [utterance.audio] if utterance.audio else []
+
+    def say(self, phrase):
+        self.said.append(phrase)
+
+
+class TestConversationPipeline(unittest.TestCase):
+
+    def testFollowUpWhileTranscribing(self):
+        mic = FakeMic(["QUE HORA ES", "EL TIEMPO"], transcription_time=0.2)
+        with pipeline.ConversationPipeline(mic, "JASPER") as conversation:
+            self.assertEqual(conversation.get_command(2), ["QUE HORA ES"])
+            self.assertEqual(conversation.get_command(2), ["EL TIEMPO"])
+        # The second command was recorded before the first one had been
+        # transcribed
+        self.assertLess(mic.recorded[1][1] - mic.recorded[0][1], 0.2)
+
+    def testNothingSaidAfterKeyword(self):
+        mic = FakeMic([None, "EL TIEMPO"])
+        with pipeline.ConversationPipeline(mic, "JASPER") as conversation:
+            self.assertEqual(conversation.get_command(2), [])
+            self.assertEqual(conversation.get_command(2), ["EL TIEMPO"])
+
+    def testBackpressure(self):
+        mic = FakeMic(["UNO", "DOS", "TRES", "CUATRO", "CINCO"])
+        conversation = pipeline.ConversationPipeline(mic, "JASPER",
+                                                     max_utterances=1,
+                                                     max_commands=1)
+        with conversation:
+            time.sleep(0.3)
+            # One command waiting to be handled, one transcribed and
+            # waiting for the queue, one waiting for transcription and one
+            # recorded: capture is blocked
+            self.assertEqual(len(mic.recorded), 4)
+            self.assertEqual(conversation.get_command(1), ["UNO"])
+            self.assertEqual(conversation.get_command(1), ["DOS"])
+        self.assertRaises(pipeline.Cancelled, conversation.get_command, 1)
+
+    def testStopCancelsQueuedUtterances(self):
+        mic = FakeMic(["UNO", "DOS", "TRES"])
+        conversation = pipeline.ConversationPipeline(mic, "JASPER",
+                                                     max_utterances=1,
+                                                     max_commands=1)
+        conversation.start()
+        time.sleep(0.3)
+        start = time.time()
+        conversation.stop(timeout=2)
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(conversation.cancelled)
+
+    def testExclusiveInterruptsCapture(self):
+        mic = FakeMic([])
+        with pipeline.ConversationPipeline(mic, "JASPER") as conversation:
+            time.sleep(0.1)
+            start = time.time()
+            with conversation.exclusive():
+                # Capture was waiting for the keyword for up to 5 s
+                self.assertLess(time.time() - start, 1)
+                mic.say("HOLA")
+            conversation.say("ADIOS")
+            time.sleep(0.2)
+        self.assertEqual(mic.said, ["HOLA", "ADIOS"])
+
+    def testGetCommandTimeout(self):
+        mic = FakeMic([])
+        with pipeline.ConversationPipeline(mic, "JASPER") as conversation:
+            self.assertIsNone(conversation.get_command(0.05))
+
+
+class TestStageQueue(unittest.TestCase):
+
+    def testCancelledPut(self):
+        cancelled = threading.Event()
+        queue = pipeline.StageQueue('test', 1, cancelled)
+        queue.put(1)
+        threading.Timer(0.1, cancelled.set).start()
+        self.assertRaises(pipeline.Cancelled, queue.put, 2)
+        self.assertEqual(queue.drain(), [1])
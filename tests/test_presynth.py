@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+import numpy
+from client import brain, presynth, ttscache
+from client.modules import Chiste, Life, Unclear
+
+
+class DummySpeaker(object):
+    SLUG = 'dummy-tts'
+
+    def __init__(self, can_synthesize=True):
+        self.synthesized = []
+        self.can_synthesize = can_synthesize
+        self.lock = threading.Lock()
+
+    def synthesize(self, phrase):
+        if not self.can_synthesize:
+            return None
+        with self.lock:
+            self.synthesized.append(phrase)
+        return (numpy.zeros(len(phrase), dtype=numpy.int16), 16000, 1)
+
+
+class TestPreSynthesizer(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = ttscache.AudioCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testGetPhrases(self):
+        phrases = presynth.get_phrases([brain.Brain, Unclear, Life, Chiste,
+                                        types.ModuleType('Empty')])
+        self.assertIn(brain.Brain.ERROR_MESSAGE, phrases)
+        self.assertIn("¿Perdon?", phrases)
+        self.assertIn(Life.ANSWER, phrases)
+        self.assertIn(Chiste.ANSWER, phrases)
+        self.assertEqual(len(phrases), len(set(phrases)))
+
+    def testSynthesizesIntoCache(self):
+        speaker = DummySpeaker()
+        key = self.cache.get_key(speaker, "dos")
+        self.cache.put(key, numpy.zeros(3, dtype=numpy.int16), 16000, 1)
+        synthesizer = presynth.PreSynthesizer(speaker, self.cache, workers=2,
+                                              pause=0)
+        synthesizer.start(["uno", "dos", "tres"]).join(5)
+        self.assertEqual(sorted(speaker.synthesized), ["tres", "uno"])
+        for phrase in ("uno", "dos", "tres"):
+            self.assertIn(self.cache.get_key(speaker, phrase), self.cache)
+
+    def testEngineWithoutSynthesis(self):
+        speaker = DummySpeaker(can_synthesize=False)
+        synthesizer = presynth.PreSynthesizer(speaker, self.cache, pause=0)
+        synthesizer.start(["uno", "dos"]).join(5)
+        self.assertEqual(self.cache.size, 0)
+
+    def testYieldsToForeground(self):
+        speaker = DummySpeaker()
+        activity = presynth.ForegroundActivity()
+        synthesizer = presynth.PreSynthesizer(speaker, self.cache, pause=0,
+                                              quiet=0.05, activity=activity)
+        with activity.active():
+            synthesizer.start(["uno"])
+            time.sleep(0.2)
+            self.assertEqual(speaker.synthesized, [])
+        synthesizer.join(5)
+        self.assertEqual(speaker.synthesized, ["uno"])
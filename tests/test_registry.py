@@ -0,0 +1,144 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import mock
+from client import registry
+
+
+class Base(object):
+    pass
+
+
+class FastEngine(Base):
+    SLUG = 'fast'
+    probes = 0
+
+    @classmethod
+    def is_available(cls):
+        cls.probes += 1
+        return True
+
+
+class SlowEngine(Base):
+    SLUG = 'slow'
+    probes = 0
+
+    @classmethod
+    def is_available(cls):
+        cls.probes += 1
+        time.sleep(0.2)
+        return False
+
+
+class NoSlugEngine(Base):
+    pass
+
+
+class ChildEngine(NoSlugEngine):
+    SLUG = 'child'
+
+    @classmethod
+    def is_available(cls):
+        raise OSError("broken")
+
+
+class TestEngineRegistry(unittest.TestCase):
+
+    def setUp(self):
+        FastEngine.probes = 0
+        SlowEngine.probes = 0
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'engines.yml')
+        self.cache = registry.AvailabilityCache(self.path, ttl=60)
+        self.registry = registry.EngineRegistry(Base, 'test', self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testEngines(self):
+        self.assertEqual(set(self.registry.get_engines()),
+                         set([FastEngine, SlowEngine, ChildEngine]))
+        with mock.patch.object(Base, '__subclasses__') as subclasses:
+            self.registry.get_engines()
+            self.assertFalse(subclasses.called)
+
+    def testLateEngine(self):
+        self.registry.get_engines()
+
+        class LateEngine(Base):
+            SLUG = 'late'
+
+            @classmethod
+            def is_available(cls):
+                return True
+        self.assertIs(self.registry.get_engine('late'), LateEngine)
+        with self.assertRaises(ValueError):
+            self.registry.get_engine('nonexistant')
+
+    def testProbesLazily(self):
+        self.assertIs(self.registry.get_engine('fast'), FastEngine)
+        self.assertEqual((FastEngine.probes, SlowEngine.probes), (1, 0))
+        self.registry.get_engine('fast')
+        self.assertEqual(FastEngine.probes, 1)
+
+    def testNotAvailable(self):
+        with self.assertRaises(ValueError):
+            self.registry.get_engine('slow')
+        with self.assertRaises(ValueError):
+            self.registry.get_engine('child')
+        self.assertIs(self.registry.get_engine('slow', check_available=False),
+                      SlowEngine)
+
+    def testCacheIsPersisted(self):
+        self.registry.get_engine('fast')
+        cache = registry.AvailabilityCache(self.path, ttl=60)
+        other = registry.EngineRegistry(Base, 'test', cache)
+        self.assertTrue(other.is_available(FastEngine))
+        self.assertEqual(FastEngine.probes, 1)
+
+    def testExpiredResult(self):
+        self.cache.set('test', 'fast', True)
+        self.cache.set('test', 'slow', True)
+        self.cache.ttl = 0
+        # A positive result is used while the engine is probed again
+        start = time.time()
+        self.assertTrue(self.registry.is_available(SlowEngine))
+        self.assertLess(time.time() - start, 0.1)
+        time.sleep(0.4)
+        self.assertEqual(SlowEngine.probes, 1)
+        self.assertEqual(self.cache.get('test', 'slow'), (False, False))
+        # A negative one is not
+        self.assertFalse(self.registry.is_available(SlowEngine))
+        self.assertEqual(SlowEngine.probes, 2)
+
+    def testConcurrentProbes(self):
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(
+                self.registry.is_available(SlowEngine)))
+            for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [False] * 3)
+        self.assertEqual(SlowEngine.probes, 1)
+
+    def testProbeInBackground(self):
+        self.cache.set('test', 'fast', True)
+        thread = self.registry.probe_in_background()
+        thread.join()
+        self.assertEqual((FastEngine.probes, SlowEngine.probes), (0, 1))
+        self.assertEqual(self.cache.get('test', 'child'), (False, True))
+        self.assertIsNone(self.registry.probe_in_background())
+
+    def testBrokenCache(self):
+        with open(self.path, 'w') as f:
+            f.write("{not: yaml")
+        cache = registry.AvailabilityCache(self.path)
+        self.assertIsNone(cache.get('test', 'fast'))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import threading
+import unittest
+import numpy
+from client import resample
+
+
+def sine(freq, rate, duration=1.0, level=10000):
+    t = numpy.arange(int(rate * duration)) / float(rate)
+    return (level * numpy.sin(2 * numpy.pi * freq * t)).astype(numpy.int16)
+
+
+class TestResample(unittest.TestCase):
+
+    def testLength(self):
+        samples = sine(1000, 44100)
+        self.assertEqual(len(resample.resample(samples, 44100, 16000)),
+                         16000)
+        self.assertEqual(len(resample.resample(samples, 44100, 8000)), 8000)
+
+    def testPassband(self):
+        converted = resample.resample(sine(1000, 44100), 44100, 16000)
+        spectrum = numpy.abs(numpy.fft.rfft(converted[1000:15000]))
+        self.assertEqual(numpy.argmax(spectrum), 14000 * 1000 // 16000)
+        self.assertGreater(numpy.abs(converted[1000:15000]).max(), 9500)
+
+    def testAntiAliasing(self):
+        # 12 kHz is above the Nyquist rate of 16 kHz audio
+        converted = resample.resample(sine(12000, 44100), 44100, 16000)
+        self.assertLess(numpy.abs(converted[1000:15000]).max(), 100)
+
+    def testStreaming(self):
+        samples = sine(440, 48000)
+        resampler = resample.PolyphaseResampler(48000, 16000)
+        streamed = numpy.concatenate([resampler.process(samples[i:i + 1000])
+                                      for i in range(0, len(samples), 1000)])
+        self.assertTrue((streamed == resample.resample(samples, 48000,
+                                                       16000)).all())
+
+    def testSharedResamplerIsThreadSafe(self):
+        samples = sine(440, 48000)
+        expected = resample.resample(samples, 48000, 16000)
+        shared = resample.get_resampler(48000, 16000)
+        # A stream processed on the shared instance doesn't disturb
+        # resample(), which other threads may call at the same time
+        shared.process(samples[:1000])
+        self.assertTrue((shared.resample(samples) == expected).all())
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(shared.resample(samples)))
+            for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for result in results:
+            self.assertTrue((result == expected).all())
+        shared.reset()
+
+    def testDownmix(self):
+        stereo = numpy.array([100, 300, -50, 50], dtype=numpy.int16)
+        self.assertEqual(list(resample.downmix(stereo, 2)), [200, 0])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import re
+import types
+import unittest
+import mock
+from client import brain, rescoring, test_mic
+
+
+def _module(name, words, pattern):
+    module = types.ModuleType(name)
+    module.WORDS = words
+    module.isValid = lambda text: bool(re.search(pattern, text,
+                                                 re.IGNORECASE))
+    return module
+
+
+class TestRescorer(unittest.TestCase):
+
+    def setUp(self):
+        self.time = _module('Time', ['QUE', 'HORA', 'ES'], r'\bhora\b')
+        self.unclear = types.ModuleType('Unclear')
+        self.unclear.isValid = lambda text: True
+        self.rescorer = rescoring.Rescorer.from_modules([self.time,
+                                                         self.unclear])
+
+    def testIgnoresCatchAll(self):
+        self.assertEqual(self.rescorer.modules, [self.time])
+
+    def testPrefersVocabulary(self):
+        hypotheses = [("que ora es", 0.6), ("que hora es", None),
+                      ("pero ahora", None)]
+        self.assertEqual(self.rescorer.rank(hypotheses),
+                         ["que hora es", "que ora es", "pero ahora"])
+
+    def testKeepsOrderOfEqualScores(self):
+        hypotheses = [("hola", 0.9), ("ola", None)]
+        self.assertEqual(self.rescorer.rank(hypotheses), ["hola", "ola"])
+
+    def testDeduplicates(self):
+        hypotheses = [("que hora es", 0.9), ("Que hora es ", None),
+                      ("", None)]
+        self.assertEqual(self.rescorer.rank(hypotheses), ["que hora es"])
+
+    def testBrokenModule(self):
+        broken = _module('Broken', ['HOLA'], r'hola')
+        broken.isValid = mock.Mock(side_effect=ValueError)
+        rescorer = rescoring.Rescorer(['HOLA'], [broken])
+        self.assertEqual(rescorer.rank([("hola", None)]), ["hola"])
+
+
+class TestBrainAlternatives(unittest.TestCase):
+
+    def testFirstAcceptedAlternative(self):
+        time = _module('Time', ['HORA'], r'\bhora\b')
+        time.handle = mock.Mock()
+        unclear = types.ModuleType('Unclear')
+        unclear.isValid = lambda text: False
+        my_brain = brain.Brain(test_mic.Mic([]), {})
+        my_brain.modules = [time, unclear]
+        my_brain.query(["que ora es", "que hora es"])
+        self.assertEqual(time.handle.call_args[0][0], "que hora es")
+
+    def testMatch(self):
+        time = _module('Time', ['HORA'], r'\bhora\b')
+        my_brain = brain.Brain(test_mic.Mic([]), {})
+        my_brain.modules = [time]
+        self.assertEqual(my_brain.match("que hora es"),
+                         (time, "que hora es"))
+        self.assertEqual(my_brain.match(["hola"]), (None, None))
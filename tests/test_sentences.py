@@ -0,0 +1,121 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import time
+import unittest
+import numpy
+from client import audiooutput, metrics, sentences
+
+RATE = 16000
+
+
+class RealTimeStream(object):
+    """
+    Takes as long to write samples as playing them would.
+    """
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data, exception_on_underflow=False):
+        time.sleep(len(data) / 2.0 / RATE)
+        self.written.append(data)
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DummyAudio(object):
+
+    def get_format_from_width(self, width):
+        return width
+
+    def open(self, **kwargs):
+        self.stream = RealTimeStream()
+        return self.stream
+
+
+class TestSplit(unittest.TestCase):
+
+    def testHeadlines(self):
+        text = ("Estos son los titulares del momento 1)Sube el paro... " +
+                "2)Llueve en Madrid todo el dia... 3)Gana el Betis")
+        self.assertEqual(sentences.split(text),
+                         ["Estos son los titulares del momento " +
+                          "1)Sube el paro...",
+                          "2)Llueve en Madrid todo el dia...",
+                          "3)Gana el Betis"])
+
+    def testShortSentencesAreJoined(self):
+        self.assertEqual(sentences.split("Hola. Soy el Sr. Perez, su " +
+                                         "asistente. Adios."),
+                         ["Hola. Soy el Sr. Perez, su asistente.", "Adios."])
+        self.assertEqual(sentences.split("¿Perdon?"), ["¿Perdon?"])
+
+    def testUnicode(self):
+        self.assertEqual(sentences.split(u"Primera frase larga… " +
+                                         u"segunda frase larga"),
+                         [u"Primera frase larga…",
+                          u"segunda frase larga"])
+
+
+class TestSentencePlayer(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.audio = DummyAudio()
+        self.output = audiooutput.OutputStream(self.audio, rate=RATE,
+                                               channels=1, chunk=800)
+        self.synthesized = []
+
+    def tearDown(self):
+        self.output.close()
+
+    def synthesize(self, sentence):
+        # Four times faster than real time
+        duration = 0.2
+        time.sleep(duration / 4)
+        self.synthesized.append((sentence, time.time()))
+        return (numpy.zeros(int(duration * RATE), dtype=numpy.int16), RATE,
+                1)
+
+    def testPipelined(self):
+        player = sentences.SentencePlayer(self.synthesize, self.output)
+        names = ["uno", "dos", "tres", "cuatro"]
+        start = time.time()
+        playbacks = list(player.play(names))
+        for playback in playbacks:
+            self.assertTrue(playback.wait(2))
+        total = time.time() - start
+        # Synthesis overlaps playback: 4 * 0.05 s + 4 * 0.2 s otherwise
+        self.assertLess(total, 0.95)
+        self.assertEqual([name for name, t in self.synthesized], names)
+        self.assertEqual(metrics.counter('mic.say.gaps'), 0)
+        first_audio = metrics.last('mic.say.first_audio_long')
+        self.assertLess(first_audio, 0.15)
+
+    def testCancel(self):
+        player = sentences.SentencePlayer(self.synthesize, self.output,
+                                          lookahead=1)
+        playbacks = player.play(["uno", "dos", "tres", "cuatro", "cinco"])
+        first = next(playbacks)
+        first.wait()
+        self.output.stop()
+        playbacks.close()
+        time.sleep(0.2)
+        self.assertLess(len(self.synthesized), 5)
+
+    def testGaps(self):
+        def slow(sentence):
+            time.sleep(0.1)
+            return (numpy.zeros(800, dtype=numpy.int16), RATE, 1)
+        player = sentences.SentencePlayer(slow, self.output)
+        for playback in player.play(["uno", "dos", "tres"]):
+            playback.wait()
+        self.assertEqual(metrics.counter('mic.say.gaps'), 2)
+
+    def testNothingSynthesized(self):
+        player = sentences.SentencePlayer(lambda sentence: None, self.output)
+        self.assertEqual(list(player.play(["uno", "dos"])), [])
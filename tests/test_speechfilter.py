@@ -0,0 +1,119 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import wave
+import mock
+import numpy
+import speech_recognition as sr
+from client import jasperpath, metrics, speechfilter
+
+RATE = 16000
+
+
+def read_samples(name):
+    wav = wave.open(jasperpath.data('audio', name), 'rb')
+    try:
+        return numpy.frombuffer(wav.readframes(wav.getnframes()),
+                                dtype=numpy.int16)
+    finally:
+        wav.close()
+
+
+def tone(frequency, duration, amplitude=8000):
+    t = numpy.arange(int(duration * RATE)) / float(RATE)
+    return (amplitude * numpy.sin(2 * numpy.pi * frequency * t)).astype(
+        numpy.int16)
+
+
+class TestSpeechClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.classifier = speechfilter.SpeechClassifier()
+        self.random = numpy.random.RandomState(0)
+
+    def testSpeech(self):
+        for name in ('jasper.wav', 'time.wav'):
+            self.assertIsNone(self.classifier.classify(read_samples(name),
+                                                       RATE))
+
+    def testTooShort(self):
+        self.assertEqual(self.classifier.classify(read_samples('time.wav')
+                                                  [:1600], RATE),
+                         speechfilter.TOO_SHORT)
+        self.assertEqual(self.classifier.classify(
+            numpy.zeros(0, dtype=numpy.int16), RATE), speechfilter.TOO_SHORT)
+
+    def testTooLong(self):
+        samples = numpy.tile(read_samples('time.wav'), 10)
+        self.assertEqual(self.classifier.classify(samples, RATE),
+                         speechfilter.TOO_LONG)
+
+    def testClipped(self):
+        samples = read_samples('time.wav').astype(numpy.int32) * 40
+        samples = numpy.clip(samples, -32768, 32767).astype(numpy.int16)
+        self.assertEqual(self.classifier.classify(samples, RATE),
+                         speechfilter.CLIPPED)
+
+    def testHum(self):
+        self.assertEqual(self.classifier.classify(tone(50, 1.0), RATE),
+                         speechfilter.OUT_OF_BAND)
+
+    def testNoise(self):
+        # Noise in the speech band only, like a hiss on the telephone
+        noise = numpy.fft.rfft(self.random.randn(RATE))
+        freqs = numpy.fft.rfftfreq(RATE, 1.0 / RATE)
+        noise[(freqs < 300) | (freqs > 3400)] = 0
+        samples = numpy.fft.irfft(noise)
+        samples = (samples / numpy.abs(samples).max() * 8000).astype(
+            numpy.int16)
+        features = self.classifier.features(samples, RATE)
+        self.assertGreater(features.band_ratio, 0.9)
+        self.assertEqual(self.classifier.classify(samples, RATE),
+                         speechfilter.NOISE)
+
+
+class TestSpeechFilter(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.speech = sr.AudioData(read_samples('time.wav').tostring(),
+                                   RATE, 2)
+        self.hum = sr.AudioData(tone(50, 1.0).tostring(), RATE, 2)
+
+    def testCounts(self):
+        speech_filter = speechfilter.SpeechFilter(audit_rate=0)
+        self.assertIsNone(speech_filter.check(self.speech))
+        self.assertEqual(speech_filter.check(self.hum),
+                         speechfilter.OUT_OF_BAND)
+        self.assertFalse(speech_filter.audit())
+        self.assertEqual(metrics.counter('speechfilter.accepted'), 1)
+        self.assertEqual(metrics.counter('speechfilter.rejected.' +
+                                         speechfilter.OUT_OF_BAND), 1)
+        stats = speech_filter.stats()
+        self.assertEqual(stats['rejected'], {speechfilter.OUT_OF_BAND: 1})
+        self.assertIsNone(stats['false_reject_rate'])
+
+    def testFalseRejectEstimate(self):
+        speech_filter = speechfilter.SpeechFilter(audit_rate=0.5, seed=1)
+        for i in range(4):
+            speech_filter.check(self.hum)
+        speech_filter.record_audit(speechfilter.OUT_OF_BAND, True)
+        speech_filter.record_audit(speechfilter.OUT_OF_BAND, False)
+        self.assertEqual(speech_filter.false_reject_rate, 0.5)
+        self.assertEqual(speech_filter.stats()['estimated_false_rejects'], 2)
+        self.assertEqual(metrics.counter('speechfilter.false_rejects'), 1)
+        self.assertEqual(metrics.last('speechfilter.false_reject_rate'), 0.5)
+
+    def testAuditRate(self):
+        speech_filter = speechfilter.SpeechFilter(audit_rate=0.1, seed=0)
+        audits = sum(speech_filter.audit() for i in range(1000))
+        self.assertTrue(50 < audits < 150)
+
+    def testDisabled(self):
+        with mock.patch('client.jasperconfig.get_section',
+                        return_value={'enabled': False}):
+            self.assertIsNone(speechfilter.SpeechFilter.get_instance())
+        with mock.patch('client.jasperconfig.get_section',
+                        return_value={'max_flatness': '0.3'}):
+            speech_filter = speechfilter.SpeechFilter.get_instance()
+        self.assertEqual(speech_filter.classifier.max_flatness, 0.3)
@@ -2,7 +2,15 @@
 # -*- coding: utf-8-*-
 import unittest
 import imp
-from client import stt, jasperpath
+import os
+import time
+import threading
+import wave
+import mock
+import numpy
+import speech_recognition as sr
+from client import stt, sttserver, jasperpath, health, benchmark, metrics, \
+    resample
 
 
 def cmuclmtk_installed():
@@ -49,3 +57,411 @@ class TestSTT(unittest.TestCase):
         with open(self.time_clip, mode="rb") as f:
             transcription = self.active_stt_engine.transcribe(f)
         self.assertIn("TIME", transcription)
+
+
+class DummySTTEngine(stt.AbstractSTTEngine):
+
+    def __init__(self):
+        self.transcribed = []
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def transcribe(self, audio):
+        self.transcribed.append(audio)
+        return "HELLO"
+
+
+class TestBufferedTranscriptionStream(unittest.TestCase):
+
+    def testFinish(self):
+        engine = DummySTTEngine()
+        stream = engine.start_stream(16000)
+        stream.feed(b'\x00\x01' * 100)
+        stream.feed(b'\x02\x03' * 50)
+        self.assertEqual(stream.finish(), "HELLO")
+        self.assertEqual(len(engine.transcribed), 1)
+        audio = engine.transcribed[0]
+        self.assertEqual(audio.sample_rate, 16000)
+        self.assertEqual(audio.frame_data, b'\x00\x01' * 100 +
+                         b'\x02\x03' * 50)
+        self.assertEqual(stream.bytes_fed, 300)
+
+
+class TestHTTPStreamingSTT(unittest.TestCase):
+
+    def setUp(self):
+        self.server = sttserver.LocalSTTServer(
+            recognizer=sttserver.ScriptedRecognizer("QUE HORA ES",
+                                                    words_per_second=10))
+        self.server.start()
+        self.engine = stt.HTTPStreamingSTT(url=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testStream(self):
+        partials = []
+        stream = self.engine.start_stream(16000, on_partial=partials.append)
+        for i in range(5):
+            # 0.1 s per chunk
+            stream.feed(b'\x00' * 3200)
+        self.assertEqual(stream.finish(), "QUE HORA ES")
+        self.assertEqual(stream.bytes_fed, 16000)
+        self.assertTrue(partials)
+        self.assertTrue("QUE HORA ES".startswith(partials[-1]))
+        self.assertEqual(self.server._streams, {})
+
+    def testTranscribe(self):
+        audio = sr.AudioData(b'\x00' * 3200, 16000, 2)
+        self.assertEqual(self.engine.transcribe(audio), "QUE HORA ES")
+
+    def testCancel(self):
+        stream = self.engine.start_stream(16000)
+        stream.feed(b'\x00' * 3200)
+        stream.cancel()
+        self.assertEqual(self.server._streams, {})
+
+    def testServerDown(self):
+        # Nothing listens on port 1
+        engine = stt.HTTPStreamingSTT(url='http://localhost:1')
+        stream = engine.start_stream(16000)
+        stream.feed(b'\x00' * 3200)
+        self.assertRaises(sr.RequestError, stream.finish)
+
+
+class TestCloudResponses(unittest.TestCase):
+
+    def testIbm(self):
+        result = {'results': [{'alternatives': [{'transcript': 'que hora',
+                                                 'confidence': 0.9}]},
+                              {'alternatives': [{'transcript': 'es',
+                                                 'confidence': 0.8},
+                                                {'transcript': 'ves'}]}]}
+        self.assertEqual(stt.Ibm._parse_response(result),
+                         [("que hora\nes", 0.8), ("que hora\nves", None)])
+        self.assertRaises(sr.UnknownValueError, stt.Ibm._parse_response,
+                          {'results': []})
+
+    def testAtt(self):
+        result = {'Recognition': {'NBest': [
+            {'Grade': 'reject', 'ResultText': 'que ora'},
+            {'Grade': 'confirm', 'ResultText': 'que hora ves',
+             'Confidence': 0.4},
+            {'Grade': 'accept', 'ResultText': 'que hora es',
+             'Confidence': 0.7}]}}
+        self.assertEqual(stt.AttSTT._parse_response(result),
+                         [("que hora es", 0.7), ("que hora ves", 0.4)])
+        self.assertRaises(sr.UnknownValueError, stt.AttSTT._parse_response,
+                          {'Recognition': {'Status': 'No Speech'}})
+
+
+class TestLocalCloudServices(unittest.TestCase):
+
+    def setUp(self):
+        with open(jasperpath.data('audio', 'time.wav'), 'rb') as f:
+            wav = wave.open(f, 'rb')
+            self.frame_data = wav.readframes(wav.getnframes())
+            self.rate = wav.getframerate()
+            wav.close()
+        self.audio = sr.AudioData(self.frame_data, self.rate, 2)
+        self.recognizer = sttserver.FingerprintRecognizer()
+        self.recognizer.add_file(jasperpath.data('audio', 'time.wav'),
+                                 ["QUE HORA ES", "QUE ORA ES"])
+        self.recognizer.add_file(jasperpath.data('audio', 'jasper.wav'),
+                                 "JASPER")
+        self.server = sttserver.LocalSTTServer(
+            recognizer=self.recognizer).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testFingerprint(self):
+        match = self.recognizer.match
+        self.assertEqual(match(self.frame_data, self.rate, 2),
+                         ["QUE HORA ES", "QUE ORA ES"])
+        # Trimmed and resampled audio matches as well
+        samples = numpy.frombuffer(self.frame_data, dtype=numpy.int16)
+        trimmed = samples[len(samples) // 5:-len(samples) // 5]
+        resampled = resample.resample(trimmed, self.rate, 8000)
+        self.assertEqual(match(resampled.tostring(), 8000, 2),
+                         ["QUE HORA ES", "QUE ORA ES"])
+        self.assertIsNone(match(b'\x00' * 32000, 16000, 2))
+
+    def testIbm(self):
+        engine = stt.Ibm(url=self.server.ibm_url)
+        self.assertEqual(engine.recognize_all(self.audio),
+                         [("QUE HORA ES", 0.9), ("QUE ORA ES", None)])
+        self.assertRaises(sr.UnknownValueError, engine.recognize,
+                          sr.AudioData(b'\x00' * 32000, 16000, 2))
+
+    def testAtt(self):
+        engine = stt.AttSTT(**self.server.att_urls)
+        self.assertEqual(engine.recognize(self.audio), ("QUE HORA ES", 0.9))
+        # Tokens are reused
+        engine.recognize(self.audio)
+        self.assertEqual(self.server.stats[200], 3)
+
+    def testInjectedFailures(self):
+        self.server.conditions = sttserver.ServiceConditions(
+            failure_rate=1.0)
+        engine = stt.Ibm(url=self.server.ibm_url)
+        self.assertRaises(sr.RequestError, engine.recognize, self.audio)
+        self.assertEqual(self.server.stats[503], 1)
+
+    def testThrottle(self):
+        self.server.conditions = sttserver.ServiceConditions(throttle=1)
+        engine = stt.Ibm(url=self.server.ibm_url)
+        engine.recognize(self.audio)
+        self.assertRaises(sr.RequestError, engine.recognize, self.audio)
+        self.assertEqual(self.server.stats[429], 1)
+
+    def testLatency(self):
+        conditions = sttserver.ServiceConditions(latency=0.1, jitter=0.05,
+                                                 distribution='uniform',
+                                                 seed=1)
+        for i in range(20):
+            self.assertTrue(0.05 <= conditions.sample_latency() <= 0.15)
+        self.server.conditions = conditions
+        start = time.time()
+        stt.Ibm(url=self.server.ibm_url).recognize(self.audio)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def testBenchmark(self):
+        engine = benchmark.create_engine('failover', {'IBM': self.server,
+                                                      'ATT': self.server})
+        bench = benchmark.Benchmark(engine)
+        metrics.reset()
+        self.assertIsNone(bench.run_once(self.audio))
+        for stage in benchmark.STAGES:
+            if stage != 'resample':
+                self.assertIsNotNone(metrics.summary('benchmark.%s' % stage),
+                                     stage)
+
+
+class FakeCloudEngine(stt.AbstractSTTEngine):
+
+    def __init__(self, text, delay=0.0, confidence=None, error=None):
+        # Not a class attribute, so that it isn't a registered engine
+        self.SLUG = 'fake-%s' % text
+        self.text = text
+        self.delay = delay
+        self.confidence = confidence
+        self.error = error
+        self.calls = 0
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def recognize(self, audio):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        if not self.text:
+            raise sr.UnknownValueError()
+        return self.text, self.confidence
+
+    def transcribe(self, audio):
+        try:
+            return self.recognize(audio)[0]
+        except sr.UnknownValueError:
+            return ""
+
+
+class TestHedgedSTT(unittest.TestCase):
+
+    def setUp(self):
+        self.audio = sr.AudioData(b'\x00' * 3200, 16000, 2)
+
+    def testFirstResultWins(self):
+        slow = FakeCloudEngine("SLOW", delay=0.5)
+        fast = FakeCloudEngine("FAST", delay=0.01)
+        engine = stt.HedgedSTT([slow, fast], hedge_delay=0)
+        start = time.time()
+        self.assertEqual(engine.transcribe(self.audio), "FAST")
+        self.assertLess(time.time() - start, 0.4)
+
+    def testHedgeDelay(self):
+        first = FakeCloudEngine("FIRST", delay=0.01)
+        second = FakeCloudEngine("SECOND")
+        engine = stt.HedgedSTT([first, second], default_delay=0.2)
+        self.assertEqual(engine.transcribe(self.audio), "FIRST")
+        self.assertEqual(second.calls, 0)
+
+        # Once the first engine is slower than its p95, ask the second one
+        first.delay = 0.5
+        engine.min_samples = 1
+        self.assertEqual(engine.transcribe(self.audio), "SECOND")
+        self.assertEqual(second.calls, 1)
+
+    def testFailover(self):
+        broken = FakeCloudEngine(None, error=sr.RequestError("down"))
+        unsure = FakeCloudEngine("UNSURE", confidence=0.2)
+        sure = FakeCloudEngine("SURE", confidence=0.9)
+        engine = stt.HedgedSTT([broken, unsure, sure], default_delay=10,
+                               min_confidence=0.5)
+        self.assertEqual(engine.recognize(self.audio), ("SURE", 0.9))
+
+    def testLatenciesOfLosers(self):
+        slow = FakeCloudEngine("SLOW", delay=0.2)
+        fast = FakeCloudEngine("FAST")
+        engine = stt.HedgedSTT([slow, fast], hedge_delay=0)
+        self.assertEqual(engine.transcribe(self.audio), "FAST")
+        time.sleep(0.4)
+        self.assertEqual(len(engine._latencies[0]), 1)
+        self.assertGreaterEqual(engine._latencies[0][0], 0.2)
+
+    def testTimeout(self):
+        hung = FakeCloudEngine("HUNG", delay=0.5)
+        engine = stt.HedgedSTT([hung], timeout=0.1)
+        self.assertRaises(sr.RequestError, engine.recognize, self.audio)
+        time.sleep(0.6)
+        # The late answer doesn't count twice
+        self.assertEqual(list(engine._latencies[0]), [0.1])
+
+    def testAllFail(self):
+        engine = stt.HedgedSTT([
+            FakeCloudEngine(None, error=sr.RequestError("down")),
+            FakeCloudEngine(None, error=sr.UnknownValueError())],
+            hedge_delay=0)
+        self.assertRaises(sr.UnknownValueError, engine.recognize, self.audio)
+
+
+class TestFailoverSTT(unittest.TestCase):
+
+    def setUp(self):
+        self.audio = sr.AudioData(b'\x00' * 3200, 16000, 2)
+        self.cloud = FakeCloudEngine("CLOUD", error=sr.RequestError("down"))
+        self.local = FakeCloudEngine("LOCAL")
+        self.engine = stt.FailoverSTT([self.cloud, self.local],
+                                      min_requests=2, reset_timeout=60)
+
+    def testFailover(self):
+        self.assertEqual(self.engine.transcribe(self.audio), "LOCAL")
+        self.assertEqual(self.cloud.calls, 1)
+
+    def testBreaker(self):
+        for i in range(3):
+            self.assertEqual(self.engine.transcribe(self.audio), "LOCAL")
+        # The failing service is only asked once the others have failed
+        self.assertEqual(self.cloud.calls, 1)
+        self.assertEqual(self.engine.get_order(), [1, 0])
+
+        # ...or once it hasn't been asked for a while
+        self.cloud.error = None
+        self.engine.breakers[0].last_request -= 60
+        self.assertEqual(self.engine.get_order(), [0, 1])
+        self.assertEqual(self.engine.transcribe(self.audio), "CLOUD")
+        self.assertEqual(self.engine.breakers[0].state, "closed")
+
+    def testSlowEngineIsDemoted(self):
+        self.cloud.error = None
+        self.engine.max_latency = 0.5
+        self.engine.breakers[0].record_success(2.0)
+        self.assertEqual(self.engine.transcribe(self.audio), "LOCAL")
+        self.assertEqual(self.cloud.calls, 0)
+
+    def testErrors(self):
+        self.local.error = sr.RequestError("down too")
+        self.assertRaises(sr.RequestError, self.engine.transcribe,
+                          self.audio)
+        self.assertRaises(sr.RequestError, self.engine.transcribe,
+                          self.audio)
+        # Both breakers are open now, nobody is asked
+        self.assertRaises(health.CircuitOpenError, self.engine.transcribe,
+                          self.audio)
+        self.assertEqual(self.local.calls, 2)
+
+    def testUnexpectedError(self):
+        self.cloud.error = ValueError("can't prepare the upload")
+        self.assertEqual(self.engine.transcribe(self.audio), "LOCAL")
+        self.assertEqual(self.engine.breakers[0].error_rate, 1.0)
+        # A failed probe opens a half open breaker again, instead of
+        # leaving it waiting for the probe forever
+        breaker = self.engine.breakers[0]
+        breaker._set_state(health.HALF_OPEN)
+        breaker.last_request -= 60
+        self.assertEqual(self.engine.transcribe(self.audio), "LOCAL")
+        self.assertEqual(self.cloud.calls, 2)
+        self.assertEqual(breaker.state, health.OPEN)
+        self.assertFalse(breaker._probing)
+
+    def testNothingRecognized(self):
+        self.local.text = ""
+        self.assertEqual(self.engine.transcribe(self.audio), "")
+        self.assertRaises(sr.UnknownValueError, self.engine.recognize,
+                          self.audio)
+
+
+class FakeDecoder(object):
+
+    def __init__(self, config):
+        self.data = b''
+
+    @staticmethod
+    def default_config():
+        return mock.Mock()
+
+    def start_utt(self):
+        self.data = b''
+
+    def process_raw(self, data, no_search, full_utt):
+        # Give other threads a chance to ask for a decoder meanwhile
+        time.sleep(0.05)
+        self.data += data
+
+    def end_utt(self):
+        pass
+
+    def hyp(self):
+        return mock.Mock(hypstr="WHAT TIME IS IT") if self.data else None
+
+
+class TestPocketSphinxSTTPool(unittest.TestCase):
+
+    def setUp(self):
+        self.module = mock.Mock(Decoder=FakeDecoder)
+        self.patcher = mock.patch.dict('sys.modules',
+                                       {'pocketsphinx': self.module})
+        self.patcher.start()
+        vocabulary = mock.Mock(languagemodel_file='lm', dictionary_file='dic')
+        self.engine = stt.PocketSphinxSTT(vocabulary, hmm_dir=os.curdir,
+                                          pool_size=2)
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def testTranscribe(self):
+        with open(jasperpath.data('audio', 'time.wav'), 'rb') as f:
+            self.assertEqual(self.engine.transcribe(f), "WHAT TIME IS IT")
+        audio = sr.AudioData(b'', 16000, 2)
+        self.assertEqual(self.engine.transcribe(audio), "")
+        # The decoder is reused
+        self.assertEqual(self.engine._num_decoders, 1)
+
+    def testPool(self):
+        audio = sr.AudioData(b'\x00' * 3200, 16000, 2)
+        threads = [threading.Thread(target=self.engine.transcribe,
+                                    args=(audio,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.engine._num_decoders, 2)
+        self.assertEqual(self.engine._decoders.qsize(), 2)
+
+    def testFailedDecoderFreesSlot(self):
+        audio = sr.AudioData(b'\x00' * 3200, 16000, 2)
+        # Somebody else is using the first decoder
+        self.engine._decoders.get()
+        with mock.patch.object(self.engine, '_create_decoder',
+                               side_effect=RuntimeError("no model")):
+            for i in range(3):
+                self.assertRaises(RuntimeError, self.engine.transcribe,
+                                  audio)
+        self.assertEqual(self.engine._num_decoders, 1)
+        self.assertEqual(self.engine.transcribe(audio), "WHAT TIME IS IT")
+        self.assertEqual(self.engine._num_decoders, 2)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
 import unittest
-from client import tts
+import mock
+import numpy
+from client import jasperpath, tts
 
 
 class TestTTS(unittest.TestCase):
@@ -9,3 +11,35 @@ class TestTTS(unittest.TestCase):
         tts_engine = tts.get_engine_by_slug('dummy-tts')
         tts_instance = tts_engine()
         tts_instance.say('This is a test.')
+
+
+class SilentTTS(tts.AbstractTTSEngine):
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def say(self, phrase):
+        pass
+
+
+class TestPlay(unittest.TestCase):
+
+    def setUp(self):
+        self.speaker = SilentTTS()
+        self.speaker.output = mock.Mock()
+
+    def testPlay(self):
+        fname = jasperpath.data('audio', 'beep_hi.wav')
+        self.speaker.play(fname)
+        play_file = self.speaker.output.play_file
+        play_file.assert_called_once_with(fname)
+        play_file.return_value.wait.assert_called_once_with()
+
+    def testPlayStream(self):
+        chunks = [(numpy.zeros(10, dtype=numpy.int16), 16000, 1)
+                  for i in range(3)]
+        self.speaker.play_stream(iter(chunks))
+        self.assertEqual(self.speaker.output.play.call_count, 3)
+        # Only waits for the last chunk, the others are queued before it
+        self.speaker.output.play.return_value.wait.assert_called_once_with()
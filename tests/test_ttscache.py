@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from client import metrics, ttscache
+
+
+class DummySpeaker(object):
+    SLUG = 'dummy-tts'
+
+    def __init__(self, voice='el_diphone'):
+        self.voice = voice
+        self._server = object()
+
+
+class TestAudioCache(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.path = tempfile.mkdtemp()
+        self.cache = ttscache.AudioCache(self.path, max_bytes=3000)
+        self.samples = numpy.arange(500, dtype=numpy.int16)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testKey(self):
+        speaker = DummySpeaker()
+        key = self.cache.get_key(speaker, "Perdon?")
+        self.assertEqual(key, self.cache.get_key(speaker, u" Perdon?\n"))
+        self.assertNotEqual(key, self.cache.get_key(speaker, "Perdon"))
+        self.assertNotEqual(key, self.cache.get_key(DummySpeaker('kal'),
+                                                    "Perdon?"))
+        self.assertEqual(self.cache.get_key(speaker, u"Qu\xe9"),
+                         self.cache.get_key(speaker, u"Qué"))
+
+    def testHit(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', self.samples, 16000, 1)
+        samples, rate, channels = self.cache.get('a')
+        self.assertIsInstance(samples, numpy.memmap)
+        self.assertTrue(numpy.array_equal(samples, self.samples))
+        self.assertEqual((rate, channels), (16000, 1))
+        self.assertEqual(metrics.counter('ttscache.hits'), 1)
+        self.assertEqual(metrics.counter('ttscache.misses'), 1)
+
+    def testPersisted(self):
+        self.cache.put('a', self.samples, 22050, 2)
+        cache = ttscache.AudioCache(self.path)
+        self.assertEqual(cache.size, 1000)
+        self.assertEqual(cache.get('a')[1:], (22050, 2))
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        for i, key in enumerate(('a', 'b', 'c')):
+            self.cache.put(key, self.samples, 16000, 1)
+            # Modification times in the past, oldest first
+            os.utime(os.path.join(self.path, '%s-16000-1.pcm' % key),
+                     (1000 + i, 1000 + i))
+        self.cache.get('a')
+        self.cache.put('d', self.samples, 16000, 1)
+        self.assertNotIn('b', self.cache)
+        for key in ('a', 'c', 'd'):
+            self.assertIn(key, self.cache)
+        self.assertEqual(self.cache.size, 3000)
+        self.assertEqual(len(os.listdir(self.path)), 3)
+        self.assertEqual(metrics.counter('ttscache.evictions'), 1)
+
+    def testReplace(self):
+        self.cache.put('a', self.samples, 16000, 1)
+        self.cache.put('a', self.samples[:100], 8000, 1)
+        self.assertEqual(os.listdir(self.path), ['a-8000-1.pcm'])
+        self.assertEqual(self.cache.size, 200)
+
+    def testTooLarge(self):
+        self.cache.put('a', numpy.zeros(2000, dtype=numpy.int16), 16000, 1)
+        self.assertNotIn('a', self.cache)
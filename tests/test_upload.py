@@ -0,0 +1,58 @@
+# -*- coding: utf-8-*-
+import io
+import unittest
+import wave
+import numpy
+import speech_recognition as sr
+from client import upload
+
+
+def make_utterance(rate=16000):
+    rng = numpy.random.RandomState(0)
+    silence = rng.normal(0, 30, rate).astype(numpy.int16)
+    t = numpy.arange(rate // 2) / float(rate)
+    speech = (8000 * numpy.sin(2 * numpy.pi * 220 * t)).astype(numpy.int16)
+    return numpy.concatenate((silence, speech, silence))
+
+
+class TestTrimSilence(unittest.TestCase):
+
+    def testTrim(self):
+        samples = make_utterance()
+        trimmed = upload.trim_silence(samples, 16000, padding=0.1)
+        # 0.5 s of speech plus 0.1 s of padding on both sides
+        self.assertAlmostEqual(len(trimmed) / 16000.0, 0.7, delta=0.03)
+
+    def testNoSpeech(self):
+        samples = numpy.zeros(16000, dtype=numpy.int16)
+        self.assertIs(upload.trim_silence(samples, 16000), samples)
+
+
+class TestUploadEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = make_utterance()
+        self.audio = sr.AudioData(self.samples.tostring(), 16000, 2)
+
+    def testWav(self):
+        encoder = upload.UploadEncoder(formats=('wav',), trim=False)
+        data, content_type = encoder.encode(self.audio)
+        self.assertEqual(content_type, 'audio/wav')
+        wav = wave.open(io.BytesIO(data), 'rb')
+        self.assertEqual(wav.getframerate(), 16000)
+        self.assertEqual(wav.getnframes(), len(self.samples))
+
+    def testFlac(self):
+        try:
+            sr.get_flac_converter()
+        except OSError:
+            self.skipTest("No FLAC encoder available")
+        encoder = upload.UploadEncoder(formats=('flac', 'wav'))
+        data, content_type = encoder.encode(self.audio)
+        self.assertEqual(content_type, 'audio/x-flac')
+        self.assertTrue(data.startswith(b'fLaC'))
+        # Less than half of the PCM size
+        self.assertLess(len(data), len(self.samples))
+
+    def testUnsupportedFormat(self):
+        self.assertRaises(ValueError, upload.UploadEncoder, formats=('mp3',))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import numpy
+from client import vad
+
+RATE = 16000
+
+
+def noise(duration, level=100, seed=0):
+    rng = numpy.random.RandomState(seed)
+    return (rng.randn(int(RATE * duration)) * level).astype(numpy.int16)
+
+
+def tone(duration, freq=200, level=5000):
+    t = numpy.arange(int(RATE * duration)) / float(RATE)
+    return (level * numpy.sin(2 * numpy.pi * freq * t)).astype(numpy.int16)
+
+
+class TestVoiceActivityDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.vad = vad.VoiceActivityDetector(RATE, hangover=0.1)
+
+    def testSpeechAndHangover(self):
+        self.vad.process(noise(0.5))
+        raw, smoothed = self.vad.process(numpy.concatenate((tone(0.2),
+                                                            noise(0.3, 1))))
+        self.assertTrue(raw[:20].all())
+        self.assertFalse(raw[20:].any())
+        # 100 ms hangover = 10 frames of 10 ms
+        self.assertTrue(smoothed[:30].all())
+        self.assertFalse(smoothed[31:].any())
+
+    def testHangoverAcrossBlocks(self):
+        self.vad.process(noise(0.5))
+        self.vad.process(tone(0.1))
+        raw, smoothed = self.vad.process(noise(0.2))
+        self.assertFalse(raw.any())
+        self.assertTrue(smoothed[:10].all())
+        self.assertFalse(smoothed[11:].any())
+
+    def testNoiseFloorAdapts(self):
+        self.vad.process(noise(0.5, level=100))
+        low = self.vad.noise_floor
+        for i in range(20):
+            self.vad.process(noise(0.5, level=400, seed=i))
+        self.assertGreater(self.vad.noise_floor, 2 * low)
+        raw, smoothed = self.vad.process(noise(0.5, level=400, seed=99))
+        self.assertLess(raw.mean(), 0.1)
+
+
+class TestEndpointer(unittest.TestCase):
+
+    def testEndpoint(self):
+        detector = vad.VoiceActivityDetector(RATE)
+        endpointer = vad.Endpointer(detector, silence_timeout=0.5)
+        samples = numpy.concatenate((noise(0.5), tone(0.8), noise(1.0, 1)))
+        block = detector.frame_size * 10
+        ended = False
+        for i in range(0, len(samples), block):
+            if endpointer.process(samples[i:i + block]):
+                ended = True
+                break
+        self.assertTrue(ended)
+        self.assertEqual(endpointer.speech_start, 50)
+        self.assertEqual(endpointer.last_speech, 129)
+        self.assertAlmostEqual(endpointer.endpoint_lag, 0.5, places=2)
+
+    def testNoSpeech(self):
+        detector = vad.VoiceActivityDetector(RATE)
+        endpointer = vad.Endpointer(detector)
+        self.assertFalse(endpointer.process(noise(2.0)))
+        self.assertEqual(endpointer.state, vad.Endpointer.WAITING)